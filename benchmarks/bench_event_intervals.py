@@ -0,0 +1,131 @@
+'''
+bench_event_intervals
+---------------------
+Compares the groupby chain generate_event_ranges used to run with the
+interval engine (event_intervals) on ISS-sized and Starlink-fleet-sized
+inputs, and checks they give the same event ranges.
+
+    python bench_event_intervals.py
+    python bench_event_intervals.py --iss-rows 60000 --fleet-sats 1500 --fleet-rows 1500
+
+Inputs (random maneuver flags of --detectors detectors):
+    iss    - one satellite with --iss-rows TLEs
+    fleet  - --fleet-sats satellites with --fleet-rows TLEs each
+
+Methods:
+    groupby  - the previous generate_event_ranges, once per satellite
+    engine   - event_intervals.event_ranges over all satellites at once
+    union    - event ranges of each detector, then event_intervals.union_intervals
+'''
+
+import argparse
+import time
+import sys
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(join(dirname(abspath(__file__)), '../job/maneuver'))
+import event_intervals
+
+
+def groupby_event_ranges(all_maneuvered):
+    '''
+    generate_event_ranges as it was before, kept here as the baseline
+    '''
+    df = pd.DataFrame(all_maneuvered)
+    mdf = df.any(axis='columns')
+    mdf.name = "maneuvered"
+    mdf = mdf.to_frame()
+    mdf['maneuvere_group'] = (mdf.maneuvered != mdf.maneuvered.shift())
+    mdf['maneuvere_group'] = mdf['maneuvere_group'].fillna(False).astype(int).cumsum()
+    grouped = mdf.reset_index().groupby('maneuvere_group')
+    events = pd.DataFrame({'start' : grouped.EPOCH.first(),
+                           'end' : grouped.EPOCH.last(),
+                           'v' : grouped.maneuvered.first()}).reset_index(drop=True)
+    events = events[events.v==True][['start','end']]
+    interval = pd.offsets.Hour() * 25 # we use 25 hours because 24 sometimes barely misses some daily TLE updates
+    events['start'] = events['start'] - interval
+    events['end'] = events['end'] + interval
+    events['group'] = (events.start >= events.end.shift()).cumsum()
+    event_ranges = pd.DataFrame({'start' : events.groupby('group').start.first(),
+                                 'end' : events.groupby('group').end.last()}).reset_index(drop=True)
+    return event_ranges
+
+
+def make_flags(num_sats, num_rows, num_detectors, seed=0):
+    '''
+    Returns norads, epochs (a TLE every 2 to 24 hours) and the flags of each detector
+    (short bursts, about 1 % of the rows)
+    '''
+    rng = np.random.default_rng(seed)
+    norads = np.repeat(np.arange(num_sats) + 40000, num_rows)
+    hours = rng.uniform(2, 24, num_sats * num_rows).reshape(num_sats, num_rows).cumsum(axis=1).ravel()
+    epochs = np.datetime64('2010-01-01', 'ns') + (hours * 3600e9).astype('timedelta64[ns]')
+    flags = []
+    for d in range(num_detectors):
+        burst = rng.random(len(norads)) < 0.003
+        flags.append(burst | np.roll(burst, 1) | np.roll(burst, 2))
+    return norads, epochs, flags
+
+
+def run_groupby(norads, epochs, flags):
+    starts = np.flatnonzero(np.append(True, norads[1:] != norads[:-1]))
+    ends = np.append(starts[1:], len(norads))
+    frames = []
+    for s, e in zip(starts, ends):
+        index = pd.Index(epochs[s:e], name='EPOCH')
+        ranges = groupby_event_ranges({d: pd.Series(f[s:e], index=index) for d, f in enumerate(flags)})
+        frames.append(ranges.assign(NORAD_CAT_ID=norads[s]))
+    return pd.concat(frames, ignore_index=True)[['NORAD_CAT_ID', 'start', 'end']]
+
+
+def run_engine(norads, epochs, flags):
+    return event_intervals.event_ranges(norads, epochs, np.any(flags, axis=0))
+
+
+def run_union(norads, epochs, flags):
+    per_detector = [event_intervals.pad_intervals(event_intervals.flags_to_runs(norads, epochs, f)) for f in flags]
+    return event_intervals.to_frame(event_intervals.union_intervals(per_detector))
+
+
+def covers(ranges, outer):
+    '''
+    True when every range is inside a range of outer (same satellite)
+    '''
+    joined = pd.merge_asof(ranges.sort_values('start'), outer.sort_values('start'), on='start', by='NORAD_CAT_ID',
+                           direction='backward', suffixes=('', '_outer'))
+    return bool((joined['end_outer'] >= joined['end']).all())
+
+
+def same_ranges(a, b):
+    a = a.sort_values(['NORAD_CAT_ID', 'start']).reset_index(drop=True)
+    b = b.sort_values(['NORAD_CAT_ID', 'start']).reset_index(drop=True)
+    return a.shape == b.shape and (a.values.astype(str) == b.values.astype(str)).all()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iss-rows', type=int, default=60000)
+    parser.add_argument('--fleet-sats', type=int, default=1500)
+    parser.add_argument('--fleet-rows', type=int, default=1500)
+    parser.add_argument('--detectors', type=int, default=7)
+    args = parser.parse_args()
+
+    for case, num_sats, num_rows in [('iss', 1, args.iss_rows), ('fleet', args.fleet_sats, args.fleet_rows)]:
+        norads, epochs, flags = make_flags(num_sats, num_rows, args.detectors)
+        print(f'{case}: {num_sats} satellites, {len(norads)} rows, {args.detectors} detectors')
+        results = {}
+        for method, run in [('groupby', run_groupby), ('engine', run_engine), ('union', run_union)]:
+            start = time.time()
+            results[method] = run(norads, epochs, flags)
+            elapsed = time.time() - start
+            print(f'    {method:8s} {elapsed:8.3f} s  {len(results[method])} ranges')
+            if method == 'groupby':
+                baseline = elapsed
+            else:
+                print(f'             {baseline / elapsed:8.0f}x')
+        print('    engine same as groupby:', same_ranges(results['groupby'], results['engine']))
+        # union merges the padded ranges of each detector, so ranges 25-50 hours apart may join
+        print('    union covers groupby:', covers(results['groupby'], results['union']))
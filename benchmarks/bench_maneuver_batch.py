@@ -0,0 +1,82 @@
+'''
+bench_maneuver_batch
+--------------------
+Compares the per-satellite maneuver detection (find_maneuvers called for each
+NORAD id) with the batch detector over a synthetic GP history, and checks both
+give the same event ranges.
+
+    python bench_maneuver_batch.py
+    python bench_maneuver_batch.py --sats 200 --mean-len 1000
+
+Methods:
+    loop   - detect_maneuver.find_maneuvers for each satellite
+    batch  - maneuver_batch.find_maneuvers_batch over all satellites
+'''
+
+import argparse
+import time
+import sys
+from os.path import abspath, dirname, join
+
+import pandas as pd
+
+sys.path.append(join(dirname(abspath(__file__)), '../job/maneuver'))
+import detect_maneuver
+import maneuver_batch
+from gp_history_synth import MANEUVER_FUNCTIONS, make_gp_history
+
+
+def loop_detector(df, maneuver_functions):
+    '''
+    Runs find_maneuvers one satellite at a time (the way the notebooks do)
+    '''
+    events, combined = [], []
+    for norad, sat_df in df.groupby('NORAD_CAT_ID'):
+        results, event_range = detect_maneuver.find_maneuvers(sat_df, maneuver_functions)
+        for col, funcs in results.items():
+            for name, _, thresholds in funcs:
+                for threshold, ranges in thresholds:
+                    events.append(ranges.assign(NORAD_CAT_ID=norad, column=col, name=name, threshold=threshold))
+        combined.append(event_range.assign(NORAD_CAT_ID=norad))
+    return pd.concat(events, ignore_index=True), pd.concat(combined, ignore_index=True)
+
+
+def batch_detector(df, maneuver_functions):
+    '''
+    Runs the batch detector over all satellites
+    '''
+    layout = maneuver_batch.BatchLayout(df)
+    return maneuver_batch.find_maneuvers_batch(layout, maneuver_functions)
+
+
+def same_ranges(a, b, keys):
+    '''
+    True when both range tables hold the same rows
+    '''
+    a = a.sort_values(keys).reset_index(drop=True)[keys + ['end']].astype(str)
+    b = b.sort_values(keys).reset_index(drop=True)[keys + ['end']].astype(str)
+    return a.shape == b.shape and (a.values == b.values).all()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sats', type=int, default=40)
+    parser.add_argument('--mean-len', type=int, default=600)
+    args = parser.parse_args()
+
+    df = make_gp_history(args.sats, args.mean_len)
+    df = pd.concat([detect_maneuver.remove_strange_data(sat_df) for norad, sat_df in df.groupby('NORAD_CAT_ID')])
+    print(f'{args.sats} satellites, {len(df)} TLEs')
+
+    timings = {}
+    for method, detector in [('loop', loop_detector), ('batch', batch_detector)]:
+        start = time.time()
+        events, combined = detector(df, MANEUVER_FUNCTIONS)
+        timings[method] = (time.time() - start, events, combined)
+        print(f'{method:6s} {timings[method][0]:8.3f} s  {len(events)} event ranges, {len(combined)} combined ranges')
+
+    loop_events, loop_combined = timings['loop'][1:]
+    batch_events, batch_combined = timings['batch'][1:]
+    print('Same event ranges:', same_ranges(loop_events, batch_events, ['NORAD_CAT_ID', 'column', 'name', 'threshold', 'start']))
+    print('Same combined ranges:', same_ranges(loop_combined, batch_combined, ['NORAD_CAT_ID', 'start']))
+    print(f'Speedup: {timings["loop"][0] / timings["batch"][0]:.0f}x')
@@ -0,0 +1,100 @@
+'''
+bench_rmm_correlator
+--------------------
+Compares the sorted interval join of rmm_correlator with a merge on the NORAD id
+followed by the overlap filter, over synthetic conjunctions and event ranges,
+and checks both find the same pairs.
+
+    python bench_rmm_correlator.py
+    python bench_rmm_correlator.py --conjunctions 2000000 --sats 5000 --skip-merge
+
+Methods:
+    merge     - pd.merge of the windows and the event ranges on the norad, then filter
+    interval  - rmm_correlator.correlate_rmm (both satellites of every conjunction)
+'''
+
+import argparse
+import time
+import sys
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(join(dirname(abspath(__file__)), '../job/maneuver'))
+import rmm_correlator
+
+
+def make_conjunctions(num_conjunctions, num_sats, seed=0):
+    '''
+    Synthetic conjunction windows (the output of rmm_correlator.conjunction_windows)
+    '''
+    rng = np.random.default_rng(seed)
+    sat1 = rng.integers(0, num_sats, num_conjunctions) + 20000
+    sat2 = rng.integers(0, num_sats, num_conjunctions) + 20000
+    tca = pd.Timestamp('2016-01-01') + pd.to_timedelta(rng.uniform(0, 5 * 365, num_conjunctions), 'D')
+    first_extract = tca - pd.to_timedelta(rng.uniform(0.2, 7, num_conjunctions), 'D')
+    return pd.DataFrame({'group': np.arange(num_conjunctions), 'sat_pair_id': sat1 * 100000 + sat2,
+                         'sat1_norad': sat1, 'sat2_norad': sat2, 'first_extract': first_extract, 'tca': tca,
+                         'num_extracts': rng.integers(1, 20, num_conjunctions),
+                         'max_prob': 10 ** rng.uniform(-9, -2, num_conjunctions),
+                         'min_rng_km': rng.uniform(0, 5, num_conjunctions)})
+
+
+def make_events(num_sats, events_per_sat, seed=0):
+    '''
+    Synthetic disjoint event ranges (NORAD_CAT_ID, start, end)
+    '''
+    rng = np.random.default_rng(seed)
+    norads = np.repeat(np.arange(num_sats) + 20000, events_per_sat)
+    gaps = rng.uniform(2, 2 * 5 * 365 / events_per_sat, len(norads))
+    days = np.cumsum(gaps.reshape(num_sats, events_per_sat), axis=1).ravel()
+    start = pd.Timestamp('2016-01-01') + pd.to_timedelta(days, 'D')
+    return pd.DataFrame({'NORAD_CAT_ID': norads, 'start': start,
+                         'end': start + pd.to_timedelta(rng.uniform(1, 1.9, len(norads)), 'D')})
+
+
+def merge_join(windows, events):
+    '''
+    Candidate pairs from a merge on the norad (every event of the satellite) and the overlap filter
+    '''
+    frames = []
+    for side, other in [(1, 2), (2, 1)]:
+        probe = windows[['group', f'sat{side}_norad', 'first_extract', 'tca']].rename(columns={f'sat{side}_norad': 'NORAD_CAT_ID'})
+        df = probe.merge(events, on='NORAD_CAT_ID')
+        frames.append(df[(df['start'] < df['tca']) & (df['end'] > df['first_extract'])].assign(side=side))
+    return pd.concat(frames, ignore_index=True)
+
+
+def pair_keys(df):
+    '''
+    Sorted (group, side, start) rows of a pair table
+    '''
+    return df[['group', 'side', 'start']].sort_values(['group', 'side', 'start']).astype(str).values
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conjunctions', type=int, default=300000)
+    parser.add_argument('--sats', type=int, default=2000)
+    parser.add_argument('--events-per-sat', type=int, default=150)
+    parser.add_argument('--skip-merge', action='store_true')
+    args = parser.parse_args()
+
+    windows = make_conjunctions(args.conjunctions, args.sats)
+    events = make_events(args.sats, args.events_per_sat)
+    print(f'{len(windows)} conjunctions, {len(events)} event ranges')
+
+    start = time.time()
+    rmm = rmm_correlator.correlate_rmm(windows, events)
+    interval_time = time.time() - start
+    print(f'interval {interval_time:8.3f} s  {len(rmm)} candidate pairs')
+
+    if not args.skip_merge:
+        start = time.time()
+        merged = merge_join(windows, events)
+        merge_time = time.time() - start
+        print(f'merge    {merge_time:8.3f} s  {len(merged)} candidate pairs')
+        a, b = pair_keys(rmm), pair_keys(merged)
+        print('Same pairs:', a.shape == b.shape and (a == b).all())
+        print(f'Speedup: {merge_time / interval_time:.1f}x')
@@ -0,0 +1,100 @@
+'''
+bench_socrates_loader
+---------------------
+Compares the time it takes to build the combined socrates dataframe from
+100 up to 10,000 snapshot files.
+
+The snapshots are symlinks to the files in data/socrates/ (cycled over and
+renamed with increasing timestamps), so no extra disk space is used.
+
+    python bench_socrates_loader.py
+    python bench_socrates_loader.py --sizes 100 1000 --workers 8
+
+Methods:
+    concat_loop  - the previous loader (pd.concat inside the loop, parse dates after)
+    serial       - get_all_socrates_data(path)
+    parallel     - get_all_socrates_data(path, parallel=True)
+'''
+
+import argparse
+import shutil
+import tempfile
+import time
+import sys
+from datetime import datetime, timedelta
+from os import listdir, symlink
+from os.path import abspath, dirname, join
+
+import pandas as pd
+
+sys.path.append(join(dirname(abspath(__file__)), '..'))
+from pkg.orbital_congestion import socrates
+
+
+def concat_loop_loader(path):
+    '''
+    The loader as it was before, kept here as the baseline
+    '''
+    files = sorted(f for f in listdir(path) if f.startswith('socrates_'))
+    df = pd.DataFrame()
+    for file in files:
+        tmp_df = pd.read_csv(join(path, file))
+        df = pd.concat([df,tmp_df])
+    df['extract_date'] = pd.to_datetime(df['extract_date'], format='%Y-%m-%d %H:%M:%S.%f')
+    df['start_time'] = pd.to_datetime(df['start_time'], format='%Y %b %d %H:%M:%S.%f')
+    df['tca_time'] = pd.to_datetime(df['tca_time'], format='%Y %b %d %H:%M:%S.%f')
+    df['stop_time'] = pd.to_datetime(df['stop_time'], format='%Y %b %d %H:%M:%S.%f')
+    df['sat1_days_epoch'] = pd.to_timedelta(df['sat1_days_epoch'], 'd')
+    df['sat2_days_epoch'] = pd.to_timedelta(df['sat2_days_epoch'], 'd')
+    df['sat1_last_epoch'] = df['tca_time'] - df['sat1_days_epoch']
+    df['sat2_last_epoch'] = df['tca_time'] - df['sat2_days_epoch']
+    df['sat_pair'] = df.apply(lambda x: x['sat1_name'] + '-' + x['sat2_name'], axis=1)
+    return df
+
+
+def build_snapshot_dir(source_path, num_files):
+    '''
+    Creates a temporary directory with num_files socrates snapshot symlinks
+    '''
+    sources = sorted(f for f in listdir(source_path) if f.startswith('socrates_'))
+    tmp_dir = tempfile.mkdtemp(prefix='socrates_bench_')
+    start = datetime(2020, 12, 9)
+    for i in range(num_files):
+        name = 'socrates_' + (start + timedelta(hours=12*i)).strftime('%Y%m%d%H%M%S') + '.csv.gz'
+        symlink(abspath(join(source_path, sources[i % len(sources)])), join(tmp_dir, name))
+    return tmp_dir + '/'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=join(dirname(abspath(__file__)), '..', 'data', 'socrates'))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--baseline-limit', type=int, default=1000,
+                        help='skip the concat_loop baseline above this many files (it grows quadratically)')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        path = build_snapshot_dir(args.source, size)
+        try:
+            methods = {'serial': lambda: socrates.get_all_socrates_data(path),
+                       'parallel': lambda: socrates.get_all_socrates_data(path, parallel=True, max_workers=args.workers)}
+            if size <= args.baseline_limit:
+                methods['concat_loop'] = lambda: concat_loop_loader(path)
+            for name, func in methods.items():
+                start = time.perf_counter()
+                df = func()
+                elapsed = time.perf_counter() - start
+                results.append({'files': size, 'method': name, 'rows': len(df), 'seconds': round(elapsed, 2)})
+                print(results[-1])
+                del df
+        finally:
+            shutil.rmtree(path)
+
+    print()
+    print(pd.DataFrame(results).pivot(index='files', columns='method', values='seconds').to_string())
+
+
+if __name__ == '__main__':
+    main()
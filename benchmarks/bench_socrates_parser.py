@@ -0,0 +1,92 @@
+'''
+bench_socrates_parser
+---------------------
+Compares the streaming SOCRATES page parser (socrates_page.parse_socrates_page)
+with the BeautifulSoup parsing the scraper used before, on pages rendered from
+the most recent data/socrates snapshot (repeated up to --records rows).
+
+Both outputs are checked to hold the same values before timing.
+
+    python bench_socrates_parser.py
+    python bench_socrates_parser.py --records 1000 5000 20000
+'''
+
+import argparse
+import sys
+import time
+import tracemalloc
+from os.path import abspath, dirname, join
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from socrates_pages import load_recorded_pages
+
+sys.path.append(join(dirname(abspath(__file__)), '..'))
+from pkg.orbital_congestion import socrates_page
+from pkg.orbital_congestion.socrates_page import SOCRATES_COLUMNS
+
+
+def parse_page_soup(html):
+    '''
+    The BeautifulSoup parsing of socrates_scrapper_nm before the streaming parser
+    '''
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find_all('table')[3]
+    rows = []
+
+    for record in table.find_all('form'):
+        row = {}
+        for idx, cell in enumerate(record.find_all('td')):
+            if idx in SOCRATES_COLUMNS.keys():
+                row[SOCRATES_COLUMNS[idx]] = cell.text
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def measure(func, page):
+    '''
+    Times func(page), then runs it again under tracemalloc for the peak memory
+    (tracing slows the parsers down too much to time them at the same time)
+    '''
+    start = time.perf_counter()
+    df = func(page)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(page)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return df, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socrates-path', default=join(dirname(abspath(__file__)), '../data/socrates/'))
+    parser.add_argument('--records', type=int, nargs='+', default=[1000, 5000])
+    args = parser.parse_args()
+
+    results = []
+    for records in args.records:
+        page = load_recorded_pages(args.socrates_path, records)['MAXPROB']
+
+        soup_df, soup_time, soup_peak = measure(parse_page_soup, page)
+        text_df, text_time, text_peak = measure(lambda p: socrates_page.parse_socrates_page(p, typed=False), page)
+        typed_df, typed_time, typed_peak = measure(socrates_page.parse_socrates_page, page)
+
+        # Same values from every parser
+        assert soup_df.equals(text_df)
+        assert socrates_page.format_socrates_times(typed_df)['tca_time'].equals(soup_df['tca_time'])
+        assert (typed_df['max_prob'].values == soup_df['max_prob'].astype(float).values).all()
+
+        for name, elapsed, peak in [('beautifulsoup', soup_time, soup_peak), ('stream text', text_time, text_peak), ('stream typed', typed_time, typed_peak)]:
+            results.append({'records': records, 'page_mb': round(len(page) / 1e6, 1), 'parser': name,
+                            'seconds': round(elapsed, 3), 'peak_mb': round(peak / 1e6, 1)})
+            print(results[-1])
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
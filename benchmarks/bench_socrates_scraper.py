@@ -0,0 +1,79 @@
+'''
+bench_socrates_scraper
+----------------------
+Runs socrates_scrapper_nm.scrape_socrates against a local HTTP stub serving
+search results pages rendered from the most recent data/socrates snapshot, once
+fetching the sort orders one after the other and once concurrently.
+
+The stub waits --latency seconds before answering, like the live site does
+while it builds the results.  The scraper prints the fetch/parse/write time of
+each run.
+
+    python bench_socrates_scraper.py
+    python bench_socrates_scraper.py --records 5000 --latency 3
+'''
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import abspath, dirname, join
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from socrates_pages import load_recorded_pages
+
+sys.path.append(join(dirname(abspath(__file__)), '../job/socrates/nm_win'))
+from socrates_scrapper_nm import scrape_socrates
+
+
+def start_stub_server(pages, latency):
+    '''
+    Serves pages[ORDER] for search-results.php on a free local port
+    '''
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            sort = parse_qs(urlparse(self.path).query).get('ORDER', [''])[0]
+            body = pages.get(sort, '').encode()
+            self.send_response(200 if sort in pages else 404)
+            self.send_header('Content-Type', 'text/html; charset=UTF-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socrates-path', default=join(dirname(abspath(__file__)), '../data/socrates/'))
+    parser.add_argument('--records', type=int, default=1000, help='records per sort order')
+    parser.add_argument('--latency', type=float, default=1.0, help='seconds before the stub answers')
+    args = parser.parse_args()
+
+    pages = load_recorded_pages(args.socrates_path, args.records)
+    server = start_stub_server(pages, args.latency)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/SOCRATES/'
+
+    results = []
+    for concurrent in [False, True]:
+        start = time.perf_counter()
+        df = scrape_socrates(args.records, 0, tempfile.mkdtemp() + '/', list(pages), base_url=base_url, concurrent=concurrent)
+        results.append({'concurrent': concurrent, 'rows': len(df), 'seconds': round(time.perf_counter() - start, 2)})
+        print()
+
+    server.shutdown()
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
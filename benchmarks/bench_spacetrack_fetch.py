@@ -0,0 +1,104 @@
+'''
+bench_spacetrack_fetch
+----------------------
+Measures the throughput of GpHistoryFetcher against a local stub of the
+SpaceTrackClient interface (no network, no credentials).
+
+The stub sleeps for a configurable latency per request, fails a fraction of
+the requests and returns one fake gp_history record per requested norad.
+A second run with the same checkpoint shows that completed bins are skipped.
+
+    python bench_spacetrack_fetch.py
+    python bench_spacetrack_fetch.py --bins 200 --latency 1.5 --rpm 30 --workers 1 2 4 8
+'''
+
+import argparse
+import random
+import sys
+import tempfile
+import threading
+import time
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(join(dirname(abspath(__file__)), '..'))
+from pkg.orbital_congestion.spacetrack_fetch import GpHistoryFetcher, build_fetch_requests
+
+
+class StubSpaceTrackClient():
+    '''
+    Stands in for SpaceTrackClient.gp_history
+    '''
+
+    def __init__(self, latency=1.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def gp_history(self, norad_cat_id, epoch):
+        with self.lock:
+            self.calls += 1
+            fail = self.random.random() < self.failure_rate
+        time.sleep(self.latency)
+        if fail:
+            raise ConnectionError('stub failure')
+        return [{'NORAD_CAT_ID': str(n), 'EPOCH': '2020-12-10T00:00:00.000000',
+                 'TLE_LINE1': '1 ' + str(n), 'TLE_LINE2': '2 ' + str(n)} for n in norad_cat_id]
+
+
+def make_missing_tles(num_bins, bin_size=100, seed=0):
+    '''
+    Fake missing TLE entries split into num_bins bins
+    '''
+    rng = np.random.default_rng(seed)
+    n = num_bins * bin_size
+    df = pd.DataFrame({'norad': rng.integers(1, 48000, n),
+                       'last_epoch': pd.Timestamp('2020-12-09') + pd.to_timedelta(rng.uniform(0, 40, n), 'D')})
+    df = df.sort_values('last_epoch')
+    df['bin'] = np.arange(n) // bin_size
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bins', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=1.0, help='seconds per stub request')
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    parser.add_argument('--rpm', type=float, default=120, help='requests per minute budget')
+    parser.add_argument('--rph', type=int, default=300, help='requests per hour budget')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    requests = build_fetch_requests(make_missing_tles(args.bins))
+    results = []
+    for workers in args.workers:
+        client = StubSpaceTrackClient(args.latency, args.failure_rate)
+        checkpoint = tempfile.mktemp(suffix='.checkpoint')
+        fetcher = GpHistoryFetcher(client, requests_per_minute=args.rpm, requests_per_hour=args.rph, max_workers=workers,
+                                   checkpoint_path=checkpoint, max_retries=3, backoff=0.1)
+        received = []
+
+        start = time.perf_counter()
+        failed = fetcher.fetch(requests, lambda request, records: received.append(len(records)))
+        elapsed = time.perf_counter() - start
+
+        # A restart with the same checkpoint only runs what is left
+        restart_start = time.perf_counter()
+        fetcher.fetch(requests, lambda request, records: received.append(len(records)))
+        restart_elapsed = time.perf_counter() - restart_start
+
+        results.append({'workers': workers, 'requests': len(requests), 'stub_calls': client.calls, 'failed': len(failed),
+                        'seconds': round(elapsed, 2), 'requests_per_minute': round(60 * len(requests) / elapsed, 1),
+                        'restart_seconds': round(restart_elapsed, 2)})
+        print(results[-1])
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+'''
+bench_threshold_sweep
+---------------------
+Times a threshold sweep over a synthetic fleet: threshold_sweep.sweep_thresholds
+against the per-satellite way (find_maneuvers for each satellite, as
+explore_maneuvers_thresholds does).  The per-satellite loop is timed on
+--loop-sats satellites and extrapolated to the fleet.
+
+    python bench_threshold_sweep.py
+    python bench_threshold_sweep.py --sats 1000 --mean-len 3000 --processes 8
+'''
+
+import argparse
+import tempfile
+import time
+import sys
+from os.path import abspath, dirname, join
+
+sys.path.append(join(dirname(abspath(__file__)), '../job/maneuver'))
+import detect_maneuver
+import element_store
+import threshold_sweep
+from gp_history_synth import MANEUVER_FUNCTIONS, make_gp_history
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sats', type=int, default=1000)
+    parser.add_argument('--mean-len', type=int, default=1500)
+    parser.add_argument('--loop-sats', type=int, default=20)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    store = element_store.build_element_store(make_gp_history(args.sats, args.mean_len))
+    store_path = tempfile.mkdtemp(prefix='element_store_bench_')
+    store.save(store_path)
+    num_thresholds = sum(len(t) for funcs in MANEUVER_FUNCTIONS.values() for n, f, t in funcs)
+    print(f'{args.sats} satellites, {len(store)} TLEs, {num_thresholds} function x threshold pairs')
+
+    start = time.time()
+    for norad in store.norads[:args.loop_sats]:
+        fixed = detect_maneuver.remove_strange_data(store.view(norad).get_frame())
+        detect_maneuver.find_maneuvers(fixed, MANEUVER_FUNCTIONS)
+    loop_time = (time.time() - start) / args.loop_sats * args.sats
+    print(f'per satellite loop  {loop_time:8.1f} s  (extrapolated from {args.loop_sats} satellites)')
+
+    start = time.time()
+    results = threshold_sweep.sweep_thresholds(store_path, list(store.norads), MANEUVER_FUNCTIONS, processes=args.processes)
+    sweep_time = time.time() - start
+    print(f'sweep               {sweep_time:8.1f} s  ({len(results)} result rows)')
+    print(f'Speedup: {loop_time / sweep_time:.0f}x')
@@ -0,0 +1,104 @@
+'''
+bench_time_kernels
+------------------
+Compares the time based detection functions of time_kernels with the same
+functions written with pandas (time window rolling, one satellite at a time)
+over a synthetic GP history with repeated epochs, and checks they give the
+same values.
+
+    python bench_time_kernels.py
+    python bench_time_kernels.py --sats 500 --mean-len 1000 --days 3
+
+Methods:
+    pandas  - drop the duplicate epochs, .diff() / .rolling('3D') for each satellite
+    series  - the time_kernels functions called for each satellite (find_maneuvers)
+    batch   - the time_kernels functions over a BatchLayout of all satellites
+'''
+
+import argparse
+import time
+import sys
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(join(dirname(abspath(__file__)), '../job/maneuver'))
+import maneuver_batch
+import time_kernels
+from gp_history_synth import make_gp_history
+
+
+def pandas_rate_per_day(x):
+    '''
+    Change per day since the previous TLE, NaN for the duplicate epochs
+    '''
+    unique = x[~x.index.duplicated(keep='last')]
+    days = unique.index.to_series().diff().dt.total_seconds() / 86400
+    rate = unique.diff() / days
+    return pd.Series(np.where(x.index.duplicated(keep='last'), np.nan, rate.reindex(x.index).values), index=x.index)
+
+
+def pandas_neighbor_diff(x, days):
+    '''
+    Mean over [t, t + days) minus mean over (t - days, t], NaN for the duplicate epochs
+    '''
+    unique = x[~x.index.duplicated(keep='last')]
+    behind = unique.rolling(f'{days}D').mean()
+    # Forward window: roll over the reversed series, with time running backwards
+    reverse = unique[::-1]
+    reverse.index = unique.index[-1] - reverse.index + pd.Timestamp(0)
+    ahead = pd.Series(reverse.rolling(f'{days}D').mean().values[::-1], index=unique.index)
+    diff = ahead - behind
+    return pd.Series(np.where(x.index.duplicated(keep='last'), np.nan, diff.reindex(x.index).values), index=x.index)
+
+
+def add_duplicates(df, share, seed=0):
+    '''
+    Repeats a share of the TLEs with the same epoch and a slightly different value
+    '''
+    rng = np.random.default_rng(seed)
+    repeated = df.iloc[rng.random(len(df)) < share].copy()
+    repeated['SEMIMAJOR_AXIS'] += rng.normal(0, 0.01, len(repeated))
+    return pd.concat([repeated, df]).sort_index(kind='mergesort')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sats', type=int, default=200)
+    parser.add_argument('--mean-len', type=int, default=800)
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--duplicates', type=float, default=0.02)
+    args = parser.parse_args()
+
+    df = add_duplicates(make_gp_history(args.sats, args.mean_len), args.duplicates)
+    print(f'{args.sats} satellites, {len(df)} TLEs ({df.reset_index().duplicated(["NORAD_CAT_ID", "EPOCH"]).sum()} duplicate epochs)')
+
+    funcs = {
+        'rate_per_day': (pandas_rate_per_day, time_kernels.RatePerDay()),
+        f'{args.days}_day_neighbor_diff': (lambda x: pandas_neighbor_diff(x, args.days), time_kernels.TimeNeighborDiff(args.days)),
+    }
+    groups = [sat_df['SEMIMAJOR_AXIS'] for norad, sat_df in df.groupby('NORAD_CAT_ID')]
+    layout = maneuver_batch.BatchLayout(df)
+
+    for name, (pandas_func, kernel) in funcs.items():
+        timings = {}
+        start = time.time()
+        values = np.concatenate([pandas_func(x).values for x in groups])
+        timings['pandas'] = (time.time() - start, values)
+        start = time.time()
+        values = np.concatenate([kernel(x).values for x in groups])
+        timings['series'] = (time.time() - start, values)
+        start = time.time()
+        values = layout.apply('SEMIMAJOR_AXIS', kernel)
+        timings['batch'] = (time.time() - start, values)
+
+        # The layout keeps the satellites longest first: compare in NORAD order
+        by_norad = pd.Series(timings['batch'][1]).groupby(layout.norads).apply(lambda v: v.values)
+        timings['batch'] = (timings['batch'][0], np.concatenate(list(by_norad.sort_index().values)))
+
+        reference = timings['pandas'][1]
+        print(name)
+        for method, (seconds, values) in timings.items():
+            same = np.allclose(values, reference, rtol=0, atol=1e-9, equal_nan=True)
+            print(f'  {method:7s} {seconds:8.3f} s  same values: {same}  speedup: {timings["pandas"][0] / seconds:6.0f}x')
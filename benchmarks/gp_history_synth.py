@@ -0,0 +1,49 @@
+'''
+gp_history_synth
+----------------
+Synthetic GP history (NORAD_CAT_ID, SEMIMAJOR_AXIS and INCLINATION indexed by
+EPOCH) for the maneuver benchmarks, so they run without the Space-Track data.
+
+Each satellite gets a random walk of its elements, a few step changes (the
+maneuvers) and a few single-TLE spikes (the strange data remove_strange_data
+drops).  MANEUVER_FUNCTIONS are the detection functions of
+maneuvers_detection_method.ipynb.
+'''
+
+import numpy as np
+import pandas as pd
+
+MANEUVER_FUNCTIONS = {
+    'INCLINATION': [
+        ("diff", lambda x:x - x.shift(), [0.002,0.005,0.008]),
+        ("rolling_4_neighbor_diff", lambda x:x.rolling(4, min_periods=1).mean().shift(-3) - x.rolling(4, min_periods=1).mean(), [0.002,0.005,0.008]),
+        ("rolling_20_neighbor_diff", lambda x:x.rolling(20, min_periods=1).mean().shift(-19) - x.rolling(20, min_periods=1).mean(), [0.002,0.005,0.008]),
+    ],
+    'SEMIMAJOR_AXIS': [
+        ("diff", lambda x:x - x.shift(), [0.008, 0.025, 0.06]),
+        ("neighbors_diff", lambda x:x.shift(-1) - x.shift(), [0.008, 0.025, 0.06]),
+        ("rolling_5_neighbor_diff", lambda x:x.rolling(5, min_periods=1).mean().shift(-4) - x.rolling(5, min_periods=1).mean(), [0.008, 0.025, 0.06]),
+    ],
+}
+
+
+def make_gp_history(num_sats=50, mean_len=800, seed=0):
+    '''
+    Returns a synthetic GP history of num_sats satellites (mean_len TLEs each on average)
+    '''
+    rng = np.random.default_rng(seed)
+    frames = []
+    for k in range(num_sats):
+        n = int(rng.integers(mean_len // 4, mean_len * 2))
+        epochs = pd.Timestamp('2019-01-01') + pd.to_timedelta(np.cumsum(rng.uniform(0.2, 1.0, n)), 'D')
+        sma = 7000 + k + np.cumsum(rng.normal(0, 0.003, n))
+        inc = 50 + k / 10 + np.cumsum(rng.normal(0, 0.0005, n))
+        for j in rng.integers(0, n, 5):
+            sma[j:] += rng.choice([-1, 1]) * rng.uniform(0.05, 0.5)
+        for j in rng.integers(0, n, 2):
+            inc[j:] += rng.uniform(0.005, 0.02)
+        for j in rng.integers(1, n - 1, 3):
+            sma[j] += 50
+        frames.append(pd.DataFrame({'NORAD_CAT_ID': 40000 + k, 'SEMIMAJOR_AXIS': sma, 'INCLINATION': inc},
+                                   index=pd.Index(epochs, name='EPOCH')))
+    return pd.concat(frames)
@@ -0,0 +1,85 @@
+'''
+socrates_pages
+--------------
+Renders SOCRATES search results pages from a saved snapshot, so the scraper can
+be run against a local server (bench_socrates_scraper.py) and the page parsers
+compared on recorded data (bench_socrates_parser.py).
+
+Each conjunction is a form holding two table rows, laid out like the live site:
+the first td is the report button, then the 13 cells of SOCRATES_COLUMNS.
+'''
+
+import gzip
+import html
+from os import listdir
+from os.path import join
+
+import pandas as pd
+
+CELL_COLUMNS = ['sat1_norad', 'sat1_name', 'sat1_days_epoch', 'max_prob', 'dil_thr_km', 'min_rng_km', 'rel_velo_kms',
+                'sat2_norad', 'sat2_name', 'sat2_days_epoch', 'start_time', 'tca_time', 'stop_time']
+
+PAGE_HEADER = '''<!DOCTYPE html>
+<html><head><title>SOCRATES Search Results</title></head>
+<body>
+<table><tr><td><a href="/">CelesTrak</a></td></tr></table>
+<table><tr><td>SOCRATES: Satellite Orbital Conjunction Reports Assessing Threatening Encounters in Space</td></tr></table>
+<table><tr><td>Search results sorted by {sort}</td></tr></table>
+<table class="center outline" style="width: 100%">
+<tr><th rowspan=2>Report</th><th>NORAD<br>Catalog<br>Number</th><th>Name</th><th>Days Since<br>Epoch</th>
+<th>Max<br>Probability</th><th>Dilution<br>Threshold (km)</th><th>Min Range<br>(km)</th><th>Relative<br>Velocity (km/sec)</th></tr>
+<tr><th>NORAD<br>Catalog<br>Number</th><th>Name</th><th>Days Since<br>Epoch</th><th>Start (UTC)</th><th>TCA (UTC)</th><th>Stop (UTC)</th></tr>
+'''
+
+PAGE_FOOTER = '''</table>
+<p>Last updated</p>
+</body></html>
+'''
+
+RECORD = '''<form name="{idx}" action="/SOCRATES/sat-report.php" method="post" target="_blank">
+<input type="hidden" name="CATNR1" value="{sat1_norad}"><input type="hidden" name="CATNR2" value="{sat2_norad}">
+<tr class="{parity}"><td rowspan=2 class="center"><input type="submit" value="Report"></td>
+<td class="center">{sat1_norad}</td><td>{sat1_name}</td><td class="center">{sat1_days_epoch}</td>
+<td class="center">{max_prob}</td><td class="center">{dil_thr_km}</td><td class="center">{min_rng_km}</td><td class="center">{rel_velo_kms}</td></tr>
+<tr class="{parity}"><td class="center">{sat2_norad}</td><td>{sat2_name}</td><td class="center">{sat2_days_epoch}</td>
+<td class="center">{start_time}</td><td class="center">{tca_time}</td><td class="center">{stop_time}</td></tr>
+</form>
+'''
+
+
+def render_results_page(df, sort):
+    '''
+    Returns the html of a search results page with the rows of df (CELL_COLUMNS as text)
+    '''
+    records = []
+    for idx, row in enumerate(df[CELL_COLUMNS].astype(str).itertuples(index=False)):
+        values = {col: html.escape(value) for col, value in zip(CELL_COLUMNS, row)}
+        records.append(RECORD.format(idx=idx, parity='odd' if idx % 2 else 'even', **values))
+    return PAGE_HEADER.format(sort=sort) + ''.join(records) + PAGE_FOOTER
+
+
+def load_recorded_pages(socrates_path, num_of_records=None):
+    '''
+    Renders the pages of each sort order of the most recent snapshot in socrates_path
+
+    Returns
+    -------
+    pages : dict
+        sort -> html
+    '''
+    file = sorted(f for f in listdir(socrates_path) if f.startswith('socrates_') and f.endswith('.csv.gz'))[-1]
+    with gzip.open(join(socrates_path, file), 'rt') as f:
+        df = pd.read_csv(f, dtype=str, keep_default_na=False)
+    pages = {}
+    for sort, sort_df in df.groupby('extract_sort', sort=False):
+        pages[sort] = render_results_page(repeat_rows(sort_df, num_of_records), sort)
+    return pages
+
+
+def repeat_rows(df, num_of_records=None):
+    '''
+    Repeats the rows of df up to num_of_records (pages larger than the recorded ones)
+    '''
+    if num_of_records is None:
+        return df
+    return pd.concat([df] * (num_of_records // len(df) + 1), ignore_index=True).iloc[:num_of_records]
@@ -10,6 +10,7 @@ try:
     import sys
     sys.path.append('..')
     from pkg.orbital_congestion import socrates
+    from pkg.orbital_congestion.socrates_store import SocratesStore
 except:
     pass
 
@@ -21,8 +22,9 @@ def load_intercept_data():
     '''
     socrates_files_path = '../data/socrates/'
     tle_file_path = '../data/space-track-gp-history/gp_history_socrates_tca_tles.pkl.gz'
+    store = SocratesStore('../data/socrates_store/')
 
-    soc_df, tle_df = socrates.get_all_socrates_and_tle_data(socrates_files_path, tle_file_path)
+    soc_df, tle_df = socrates.get_all_socrates_and_tle_data(socrates_files_path, tle_file_path, store=store)
     tle_df = socrates.assign_socrates_category(tle_df, True)
     tle_df = tle_df[tle_df['rel_velo_kms'] > 0.01].sort_values(by='max_prob', ascending=False)
 
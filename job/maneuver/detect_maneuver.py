@@ -4,6 +4,9 @@ import matplotlib.pyplot as plt
 import matplotlib
 import matplotlib.ticker as mtick
 
+import element_store
+import event_intervals
+
 def remove_strange_data(input_df):
     # remove points that randomly spiked
     df = input_df.reset_index()
@@ -15,24 +18,11 @@ def remove_strange_data(input_df):
     return (df.loc[~(((s_diff_diff > 0) & (s_diff_sum / s_diff_diff > 1000)) | ((i_diff_diff > 0) & (i_diff_sum / i_diff_diff > 1000)))]).set_index("EPOCH")
 
 def generate_event_ranges(all_maneuvered):
+    # flagged rows of any detector -> runs padded by 25 hours and merged (see event_intervals)
     df = pd.DataFrame(all_maneuvered)
-    mdf = df.any(axis='columns')
-    mdf.name = "maneuvered"
-    mdf = mdf.to_frame()
-    mdf['maneuvere_group'] = (mdf.maneuvered != mdf.maneuvered.shift())
-    mdf['maneuvere_group'] = mdf['maneuvere_group'].fillna(False).astype(int).cumsum()
-    grouped = mdf.reset_index().groupby('maneuvere_group')
-    events = pd.DataFrame({'start' : grouped.EPOCH.first(),
-                           'end' : grouped.EPOCH.last(),
-                           'v' : grouped.maneuvered.first()}).reset_index(drop=True)
-    events = events[events.v==True][['start','end']]
-    interval = pd.offsets.Hour() * 25 # we use 25 hours because 24 sometimes barely misses some daily TLE updates
-    events['start'] = events['start'] - interval
-    events['end'] = events['end'] + interval
-    events['group'] = (events.start >= events.end.shift()).cumsum()
-    event_ranges = pd.DataFrame({'start' : events.groupby('group').start.first(),
-                                 'end' : events.groupby('group').end.last()}).reset_index(drop=True)
-    return event_ranges
+    maneuvered = df.any(axis='columns').values
+    event_ranges = event_intervals.event_ranges(np.zeros(len(df), dtype=np.int8), df.index.values, maneuvered)
+    return event_ranges[['start','end']]
 
 
 def find_maneuvers(df, maneuver_functions):
@@ -109,13 +99,21 @@ def plot_combined_maneuvers(fig, ax, df, event_range, sat_name):
         ax.axvspan(er.start, er.end, alpha=0.5, color="#ffd2ae", label="_")
     
                     
-def explore_maneuvers_thresholds(norad_id, df_slice, maneuver_functions):
+def get_satellite_data(df, norad_id, df_slice):
+    # df is either the full GP history frame (scaled columns) or an element_store.ElementStore
+    if isinstance(df, element_store.ElementStore):
+        return df.view(norad_id)[df_slice].get_frame()
+
     raw = df[df.NORAD_CAT_ID == norad_id][df_slice].copy()
 
     # revert back the scaling
     raw["SEMIMAJOR_AXIS"] = raw["SEMIMAJOR_AXIS_x1000"].astype(np.float64)/1000
     raw["INCLINATION"] = raw["INCLINATION_x10000"].astype(np.float64)/10000
     raw = raw.drop(columns=["SEMIMAJOR_AXIS_x1000","INCLINATION_x10000"])
+    return raw
+
+def explore_maneuvers_thresholds(df, satcat, norad_id, df_slice, maneuver_functions):
+    raw = get_satellite_data(df, norad_id, df_slice)
 
     fixed = remove_strange_data(raw)
 
@@ -130,12 +128,7 @@ def explore_maneuvers_thresholds(norad_id, df_slice, maneuver_functions):
 
                     
 def plot_maneuver_results(df, satcat, norad_id, df_slice, maneuver_functions, combined=False):
-    raw = df[df.NORAD_CAT_ID == norad_id][df_slice].copy()
-
-    # revert back the scaling
-    raw["SEMIMAJOR_AXIS"] = raw["SEMIMAJOR_AXIS_x1000"].astype(np.float64)/1000
-    raw["INCLINATION"] = raw["INCLINATION_x10000"].astype(np.float64)/10000
-    raw = raw.drop(columns=["SEMIMAJOR_AXIS_x1000","INCLINATION_x10000"])
+    raw = get_satellite_data(df, norad_id, df_slice)
 
     fixed = remove_strange_data(raw)
 
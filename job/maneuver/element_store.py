@@ -0,0 +1,234 @@
+'''
+element_store
+-------------
+Compact store of the GP history elements used by the maneuver detection.
+
+The elements keep the integer scaling of filter_raw_data_payload_maneuvers.ipynb
+(SEMIMAJOR_AXIS_x1000 and INCLINATION_x10000 as uint32) and the epoch is stored
+as uint32 seconds since 1970.  Rows are sorted by NORAD id and epoch, and an
+offset index gives the rows of each satellite, so a satellite is a slice of
+the arrays (a view, nothing is copied) that only decodes the values it is
+asked for.
+
+Saved as one .npy file per array, which load memory mapped:
+
+    store_path/norads.npy
+    store_path/offsets.npy
+    store_path/epochs.npy
+    store_path/SEMIMAJOR_AXIS_x1000.npy
+    store_path/INCLINATION_x10000.npy
+'''
+
+import numpy as np
+import pandas as pd
+from os import makedirs
+from os.path import join
+
+# Element column -> (scaled column, scale)
+ELEMENT_SCALES = {'SEMIMAJOR_AXIS': ('SEMIMAJOR_AXIS_x1000', 1000),
+                  'INCLINATION': ('INCLINATION_x10000', 10000)}
+
+
+class SatelliteElements():
+    '''
+    View of the elements of one satellite (slices of the store arrays)
+    '''
+
+    norad = None
+    epochs = None
+    scaled = None
+
+    def __init__(self, norad, epochs, scaled):
+        '''
+        Initialize
+
+        Parameters:
+        -----------
+        norad : int
+            NORAD_CAT_ID of the satellite
+
+        epochs : array(uint32)
+            Epochs in seconds since 1970
+
+        scaled : dict
+            Element column -> scaled uint32 values
+        '''
+        self.norad = norad
+        self.epochs = epochs
+        self.scaled = scaled
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def __getitem__(self, key):
+        '''
+        Positional slice of the rows (like df_slice in the notebooks), still a view
+        '''
+        return SatelliteElements(self.norad, self.epochs[key], {col: v[key] for col, v in self.scaled.items()})
+
+    def get_epochs(self):
+        '''
+        Returns the epochs as datetime64
+        '''
+        return self.epochs.astype('datetime64[s]')
+
+    def get_column(self, col):
+        '''
+        Returns an element column scaled back to float64
+        '''
+        return self.scaled[col].astype(np.float64) / ELEMENT_SCALES[col][1]
+
+    def get_frame(self):
+        '''
+        Returns the satellite as a dataframe (NORAD_CAT_ID, SEMIMAJOR_AXIS and INCLINATION indexed
+        by EPOCH), the frame detect_maneuver works on
+        '''
+        df = pd.DataFrame({'NORAD_CAT_ID': np.full(len(self), self.norad, dtype=np.uint32)},
+                          index=pd.Index(self.get_epochs(), name='EPOCH'))
+        for col in self.scaled:
+            df[col] = self.get_column(col)
+        return df
+
+
+class ElementStore():
+    '''
+    Scaled GP history elements of many satellites with a per NORAD offset index
+    '''
+
+    norads = None
+    offsets = None
+    epochs = None
+    scaled = None
+
+    def __init__(self, norads, offsets, epochs, scaled):
+        '''
+        Initialize (see build_element_store and load_element_store)
+
+        Parameters:
+        -----------
+        norads : array(uint32)
+            Sorted NORAD_CAT_IDs
+
+        offsets : array(int64)
+            First row of each satellite (and the number of rows at the end)
+
+        epochs : array(uint32)
+            Epochs in seconds since 1970
+
+        scaled : dict
+            Element column -> scaled uint32 values
+        '''
+        self.norads = norads
+        self.offsets = offsets
+        self.epochs = epochs
+        self.scaled = scaled
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def __contains__(self, norad):
+        i = np.searchsorted(self.norads, norad)
+        return i < len(self.norads) and self.norads[i] == norad
+
+    def view(self, norad):
+        '''
+        Returns the elements of one satellite (a view of the store arrays)
+
+        Parameters:
+        -----------
+        norad : int
+            NORAD_CAT_ID of the satellite
+
+        Returns
+        -------
+        elements : SatelliteElements
+            Rows of the satellite, empty when it is not in the store
+        '''
+        i = np.searchsorted(self.norads, norad)
+        if i == len(self.norads) or self.norads[i] != norad:
+            start, end = 0, 0
+        else:
+            start, end = self.offsets[i], self.offsets[i + 1]
+        return SatelliteElements(norad, self.epochs[start:end], {col: v[start:end] for col, v in self.scaled.items()})
+
+    def save(self, store_path):
+        '''
+        Writes the store arrays as .npy files
+
+        Parameters:
+        -----------
+        store_path : str
+            Relative path of the store directory (created if missing)
+        '''
+        makedirs(store_path, exist_ok=True)
+        np.save(join(store_path, 'norads.npy'), self.norads)
+        np.save(join(store_path, 'offsets.npy'), self.offsets)
+        np.save(join(store_path, 'epochs.npy'), self.epochs)
+        for col, values in self.scaled.items():
+            np.save(join(store_path, ELEMENT_SCALES[col][0] + '.npy'), values)
+
+
+def build_element_store(df):
+    '''
+    Builds an element store from a GP history dataframe
+
+    Parameters:
+    -----------
+    df : Pandas Dataframe
+        History indexed by EPOCH with NORAD_CAT_ID and either the scaled columns
+        (SEMIMAJOR_AXIS_x1000, INCLINATION_x10000, like payload.pkl.gz) or the float ones
+
+    Returns
+    -------
+    store : ElementStore
+        Store of the history
+    '''
+    norads = df['NORAD_CAT_ID'].values.astype(np.uint32)
+    epochs = (df.index.values.astype('datetime64[s]').astype(np.int64)).astype(np.uint32)
+    order = np.lexsort((epochs, norads))
+
+    scaled = {}
+    for col, (scaled_col, scale) in ELEMENT_SCALES.items():
+        if scaled_col in df.columns:
+            scaled[col] = df[scaled_col].values.astype(np.uint32)[order]
+        else:
+            scaled[col] = np.round(df[col].values * scale).astype(np.uint32)[order]
+
+    sat_norads, starts = np.unique(norads[order], return_index=True)
+    offsets = np.append(starts, len(norads)).astype(np.int64)
+    return ElementStore(sat_norads, offsets, epochs[order], scaled)
+
+
+def load_element_store(store_path, mmap=True):
+    '''
+    Loads a saved element store
+
+    Parameters:
+    -----------
+    store_path : str
+        Relative path of the store directory
+
+    mmap : bool
+        Memory map the arrays instead of reading them
+
+    Returns
+    -------
+    store : ElementStore
+        Store of the history
+    '''
+    mmap_mode = 'r' if mmap else None
+    scaled = {col: np.load(join(store_path, scaled_col + '.npy'), mmap_mode=mmap_mode)
+              for col, (scaled_col, scale) in ELEMENT_SCALES.items()}
+    return ElementStore(np.load(join(store_path, 'norads.npy')), np.load(join(store_path, 'offsets.npy')),
+                        np.load(join(store_path, 'epochs.npy'), mmap_mode=mmap_mode), scaled)
+
+
+payload_path = '../../../siads591 data/filtered_raw/payload.pkl.gz'
+element_store_path = '../../data/maneuver/element_store/'
+
+if __name__ == '__main__':
+    # Converts the filtered payload history (filter_raw_data_payload_maneuvers.ipynb) to a store
+    df = pd.read_pickle(payload_path, compression='gzip')
+    store = build_element_store(df)
+    store.save(element_store_path)
+    print(f'Saved {len(store)} rows of {len(store.norads)} satellites to {element_store_path}')
@@ -0,0 +1,169 @@
+'''
+event_intervals
+---------------
+Interval engine for the maneuver event ranges.
+
+Intervals are kept as three arrays (key, start, end), sorted by key then start,
+where the key is usually the NORAD_CAT_ID, so the intervals of many satellites
+are handled at once.  Every step is a single pass over the arrays:
+
+    flags_to_runs     - runs of flagged rows -> intervals
+    pad_intervals     - widen each interval (25 hours by default)
+    merge_intervals   - merge the overlapping intervals of each key
+    union_intervals   - merge the intervals of several detectors
+
+generate_event_ranges (detect_maneuver) is flags_to_runs + pad_intervals +
+merge_intervals for a single key.
+'''
+
+import numpy as np
+import pandas as pd
+
+# we use 25 hours because 24 sometimes barely misses some daily TLE updates
+EVENT_PADDING = pd.Timedelta(hours=25)
+
+
+def flags_to_runs(keys, epochs, flags):
+    '''
+    Returns the runs of consecutive flagged rows of each key as intervals
+
+    Parameters:
+    -----------
+    keys : array
+        Key of each row (rows of a key are contiguous and sorted by epoch)
+
+    epochs : array
+        Epoch of each row (datetime64)
+
+    flags : array
+        Boolean flag of each row
+
+    Returns
+    -------
+    intervals : tuple(array, array, array)
+        (keys, starts, ends): first and last epoch of each run
+    '''
+    keys = np.asarray(keys)
+    epochs = np.asarray(epochs).astype('datetime64[ns]')
+    flags = np.asarray(flags, dtype=bool)
+
+    new_key = np.ones(len(keys), dtype=bool)
+    new_key[1:] = keys[1:] != keys[:-1]
+    last_of_key = np.append(new_key[1:], True)
+    prev_flag = np.append(False, flags[:-1])
+    next_flag = np.append(flags[1:], False)
+    starts = np.flatnonzero(flags & (new_key | ~prev_flag))
+    ends = np.flatnonzero(flags & (last_of_key | ~next_flag))
+    return keys[starts], epochs[starts], epochs[ends]
+
+
+def pad_intervals(intervals, padding=EVENT_PADDING):
+    '''
+    Widens each interval by padding on both sides
+    '''
+    keys, starts, ends = intervals
+    padding = pd.Timedelta(padding).to_timedelta64()
+    return keys, starts - padding, ends + padding
+
+
+def merge_intervals(intervals):
+    '''
+    Merges the overlapping intervals of each key (intervals that only touch are kept apart,
+    like generate_event_ranges)
+
+    Parameters:
+    -----------
+    intervals : tuple(array, array, array)
+        (keys, starts, ends) sorted by key then start
+
+    Returns
+    -------
+    intervals : tuple(array, array, array)
+        Merged (keys, starts, ends)
+    '''
+    keys, starts, ends = intervals
+    if len(keys) == 0:
+        return intervals
+
+    # Running max of the ends within each key: an interval opens a new range when it starts
+    # at or after every previous end of its key
+    new_key = np.ones(len(keys), dtype=bool)
+    new_key[1:] = keys[1:] != keys[:-1]
+    reach = _segmented_cummax(ends.astype(np.int64), new_key)
+    new_range = new_key.copy()
+    new_range[1:] |= starts[1:].astype(np.int64) >= reach[:-1]
+
+    first = np.flatnonzero(new_range)
+    last = np.append(first[1:], len(keys)) - 1
+    return keys[first], starts[first], reach[last].astype(ends.dtype)
+
+def _segmented_cummax(values, new_segment):
+    '''
+    Running maximum that restarts at every new_segment row
+    '''
+    return pd.Series(values).groupby(np.cumsum(new_segment)).cummax().values
+
+
+def union_intervals(interval_list):
+    '''
+    Union of the intervals of several detectors (each sorted by key then start)
+
+    Parameters:
+    -----------
+    interval_list : list(tuple(array, array, array))
+        (keys, starts, ends) of each detector
+
+    Returns
+    -------
+    intervals : tuple(array, array, array)
+        Merged (keys, starts, ends)
+    '''
+    keys = np.concatenate([i[0] for i in interval_list])
+    starts = np.concatenate([i[1] for i in interval_list])
+    ends = np.concatenate([i[2] for i in interval_list])
+    # lexsort is a stable merge sort, cheap on the already sorted runs of each detector
+    order = np.lexsort((starts, keys))
+    return merge_intervals((keys[order], starts[order], ends[order]))
+
+
+def event_ranges(keys, epochs, flags, padding=EVENT_PADDING):
+    '''
+    Event ranges of every key from per-row flags: runs, padded and merged
+
+    Parameters:
+    -----------
+    keys : array
+        Key of each row (rows of a key are contiguous and sorted by epoch)
+
+    epochs : array
+        Epoch of each row (datetime64)
+
+    flags : array
+        Boolean flag of each row
+
+    padding : Timedelta
+        Added before the start and after the end of each run
+
+    Returns
+    -------
+    event_ranges : Pandas Dataframe
+        NORAD_CAT_ID, start and end of each range
+    '''
+    return to_frame(merge_intervals(pad_intervals(flags_to_runs(keys, epochs, flags), padding)))
+
+
+def to_frame(intervals):
+    '''
+    Returns intervals as a NORAD_CAT_ID, start, end dataframe
+    '''
+    keys, starts, ends = intervals
+    return pd.DataFrame({'NORAD_CAT_ID': keys, 'start': starts, 'end': ends})
+
+
+def from_frame(df):
+    '''
+    Returns the intervals of a NORAD_CAT_ID, start, end dataframe (sorted by key then start)
+    '''
+    df = df.sort_values(['NORAD_CAT_ID', 'start'], kind='mergesort')
+    return (df['NORAD_CAT_ID'].values, df['start'].values.astype('datetime64[ns]'),
+            df['end'].values.astype('datetime64[ns]'))
@@ -0,0 +1,332 @@
+'''
+maneuver_batch
+--------------
+Maneuver detection over many satellites at once.
+
+The GP history of all satellites is kept in flat arrays, one contiguous epoch
+sorted segment per satellite (BatchLayout).  To run a detection function of
+detect_maneuver (shift / rolling lambdas) the segments are placed side by side
+as the columns of a 2D block, right aligned and NaN padded at the top, and the
+function runs once over the whole block: pandas shifts and rolls each column on
+its own, the NaN rows above a satellite behave like the start of its series
+and nothing follows its last row, so the values are the same as running the
+function one satellite at a time.  Satellites of similar length share a block
+(longest first) so the padding and the block size stay bounded.
+
+The spike test of remove_strange_data (find_strange_data), the threshold
+comparisons (all thresholds of a function in one broadcast) and the event ranges
+of every satellite are each computed in a single pass over the flat arrays.
+'''
+
+import numpy as np
+import pandas as pd
+
+import event_intervals
+
+# Padding added before and after the maneuvers (detect_maneuver.generate_event_ranges)
+EVENT_PADDING = event_intervals.EVENT_PADDING
+
+
+class BatchLayout():
+    '''
+    GP history of many satellites in flat, satellite contiguous arrays
+    '''
+
+    columns = None
+    norads = None
+    epochs = None
+    values = None
+    sat_norads = None
+    offsets = None
+    lengths = None
+    blocks = None
+    max_block_cells = None
+
+    def __init__(self, df, columns=['SEMIMAJOR_AXIS', 'INCLINATION'], max_block_cells=20000000):
+        '''
+        Initialize
+
+        Parameters:
+        -----------
+        df : Pandas Dataframe
+            GP history indexed by EPOCH with NORAD_CAT_ID and the columns (several satellites,
+            in any order)
+
+        columns : list(str)
+            Element columns to keep
+
+        max_block_cells : int
+            Largest block (rows x satellites) a function runs on at once
+        '''
+        norads = df['NORAD_CAT_ID'].values.astype(np.int64)
+        epochs = df.index.values.astype('datetime64[ns]')
+        order = np.lexsort((epochs, norads))
+        sat_norads, starts, lengths = np.unique(norads[order], return_index=True, return_counts=True)
+
+        # Longest satellites first, so each block holds satellites of similar length
+        sat_order = np.argsort(-lengths, kind='mergesort')
+        self.sat_norads = sat_norads[sat_order]
+        self.lengths = lengths[sat_order]
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)])
+        rows = order[np.concatenate([np.arange(s, s + n) for s, n in zip(starts[sat_order], self.lengths)])] if len(norads) > 0 else order
+
+        self.columns = list(columns)
+        self.norads = norads[rows]
+        self.epochs = epochs[rows]
+        self.values = {col: df[col].values.astype(np.float64)[rows] for col in columns}
+        self.max_block_cells = max_block_cells
+        self.blocks = self.__plan_blocks(max_block_cells)
+
+    def __len__(self):
+        return len(self.norads)
+
+    def sat_index(self):
+        '''
+        Returns the satellite number (position in sat_norads) of each row
+        '''
+        return np.repeat(np.arange(len(self.lengths)), self.lengths)
+
+    def apply(self, col, func):
+        '''
+        Runs func over the column of every satellite, once per block
+
+        Parameters:
+        -----------
+        col : str
+            Element column
+
+        func : function
+            Series -> Series function of detect_maneuver (positional shift / rolling operations),
+            or a time based kernel of time_kernels (runs over the flat arrays with the epochs)
+
+        Returns
+        -------
+        result : array
+            func value of each row (same order as the layout)
+        '''
+        return self.apply_values(self.values[col], func)
+
+    def apply_values(self, values, func):
+        '''
+        Runs func over any per-row values of the layout (see apply)
+        '''
+        if hasattr(func, 'apply_segmented'):
+            return func.apply_segmented(self.offsets, self.epochs, values)
+
+        result = np.empty(len(values), dtype=np.float64)
+        for first, last, num_rows in self.blocks:
+            start, end = self.offsets[first], self.offsets[last]
+            cols, rows = self.__block_positions(first, last, num_rows)
+            block = np.full((num_rows, last - first), np.nan)
+            block[rows, cols] = values[start:end]
+            result[start:end] = np.asarray(func(pd.DataFrame(block)), dtype=np.float64)[rows, cols]
+        return result
+
+    def take(self, rows):
+        '''
+        Returns a layout of some of the rows (keeps the satellite order, like a filter)
+
+        Parameters:
+        -----------
+        rows : array
+            Increasing row positions (or a boolean mask) to keep
+
+        Returns
+        -------
+        layout : BatchLayout
+            Layout of the kept rows
+        '''
+        rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows)
+        lengths = np.bincount(self.sat_index()[rows], minlength=len(self.lengths))
+
+        layout = BatchLayout.__new__(BatchLayout)
+        layout.columns = self.columns
+        layout.norads = self.norads[rows]
+        layout.epochs = self.epochs[rows]
+        layout.values = {col: v[rows] for col, v in self.values.items()}
+        layout.sat_norads = self.sat_norads[lengths > 0]
+        layout.lengths = lengths[lengths > 0]
+        layout.offsets = np.concatenate([[0], np.cumsum(layout.lengths)])
+        layout.max_block_cells = self.max_block_cells
+        layout.blocks = layout.__plan_blocks(self.max_block_cells)
+        return layout
+
+    def to_frame(self):
+        '''
+        Returns the layout as a dataframe indexed by EPOCH (satellite contiguous)
+        '''
+        df = pd.DataFrame(dict({'NORAD_CAT_ID': self.norads}, **self.values), index=pd.Index(self.epochs, name='EPOCH'))
+        return df
+
+    def __block_positions(self, first, last, num_rows):
+        '''
+        Column and row of each layout row of a block (right aligned)
+        '''
+        lengths = self.lengths[first:last]
+        cols = np.repeat(np.arange(last - first), lengths)
+        within = np.arange(lengths.sum()) - np.repeat(self.offsets[first:last] - self.offsets[first], lengths)
+        rows = within + np.repeat(num_rows - lengths, lengths)
+        return cols, rows
+
+    def __plan_blocks(self, max_block_cells):
+        '''
+        Groups consecutive satellites into blocks: a block is at most max_block_cells and its
+        shortest satellite is at least half as long as its longest one
+        '''
+        blocks = []
+        first = 0
+        while first < len(self.lengths):
+            num_rows = min_rows = int(self.lengths[first])
+            last = first + 1
+            while last < len(self.lengths):
+                length = int(self.lengths[last])
+                if (min(min_rows, length) * 2 < max(num_rows, length)
+                        or max(num_rows, length) * (last + 1 - first) > max_block_cells):
+                    break
+                num_rows, min_rows = max(num_rows, length), min(min_rows, length)
+                last += 1
+            blocks.append((first, last, num_rows))
+            first = last
+        return blocks
+
+
+def find_strange_data(layout, columns=['SEMIMAJOR_AXIS', 'INCLINATION'], ratio=1000):
+    '''
+    Spike test of detect_maneuver.remove_strange_data over every satellite of a layout in one pass:
+    a row is strange when it jumps away from both neighbors and back, i.e. for a column
+    |diff + diff(-1)| / (|diff - diff(-1)| + 1) > ratio.  The first and last rows of a satellite
+    (no neighbor on one side) are always kept
+
+    Parameters:
+    -----------
+    layout : BatchLayout
+        GP history of the satellites
+
+    columns : list(str)
+        Columns tested (a row is strange when any of them spiked)
+
+    ratio : float
+        Spike ratio above which a row is removed
+
+    Returns
+    -------
+    kept : array
+        Row positions of the layout that are kept (layout.take(kept) gives the filtered layout)
+
+    removed : Pandas Dataframe
+        NORAD_CAT_ID, EPOCH, the tested column values and their spike ratios of the removed rows
+    '''
+    # Neighbors within the same satellite only
+    has_prev = np.ones(len(layout), dtype=bool)
+    has_prev[layout.offsets[:-1]] = False
+    has_next = np.ones(len(layout), dtype=bool)
+    has_next[layout.offsets[1:] - 1] = False
+    inner = has_prev & has_next
+
+    strange = np.zeros(len(layout), dtype=bool)
+    ratios = {}
+    for col in columns:
+        x = layout.values[col]
+        diff = np.empty(len(x))
+        diff[1:] = x[1:] - x[:-1]
+        diff[0] = np.nan
+        diff_next = np.empty(len(x))
+        diff_next[:-1] = x[:-1] - x[1:]
+        diff_next[-1:] = np.nan
+
+        with np.errstate(invalid='ignore'):
+            col_ratio = np.abs(diff + diff_next) / (np.abs(diff - diff_next) + 1)
+            col_strange = inner & (col_ratio > ratio)
+        ratios[col] = col_ratio
+        strange |= col_strange
+
+    removed_rows = np.flatnonzero(strange)
+    removed = pd.DataFrame({'NORAD_CAT_ID': layout.norads[removed_rows], 'EPOCH': layout.epochs[removed_rows]})
+    for col in columns:
+        removed[col] = layout.values[col][removed_rows]
+        removed[col + '_ratio'] = ratios[col][removed_rows]
+    return np.flatnonzero(~strange), removed
+
+
+def find_event_ranges(norads, epochs, flags, padding=EVENT_PADDING):
+    '''
+    Builds the event ranges of every satellite from per-row maneuver flags in a single pass:
+    each run of flagged rows becomes a range padded by `padding` on both sides and the
+    overlapping ranges of a satellite are merged (same as detect_maneuver.generate_event_ranges)
+
+    Parameters:
+    -----------
+    norads : array
+        NORAD_CAT_ID of each row (rows of a satellite are contiguous and sorted by epoch)
+
+    epochs : array
+        EPOCH of each row (datetime64)
+
+    flags : array
+        Boolean maneuver flag of each row
+
+    padding : Timedelta
+        Added before the start and after the end of each run
+
+    Returns
+    -------
+    event_ranges : Pandas Dataframe
+        NORAD_CAT_ID, start and end of each range
+    '''
+    return event_intervals.event_ranges(norads, epochs, flags, padding)
+
+
+def find_maneuvers_batch(layout, maneuver_functions, return_values=False):
+    '''
+    Runs the maneuver functions over a batch layout: each function once per column and
+    all of its thresholds in one comparison
+
+    Parameters:
+    -----------
+    layout : BatchLayout
+        GP history of the satellites
+
+    maneuver_functions : dict
+        column -> list of (name, func, thresholds), as for detect_maneuver.find_maneuvers
+
+    return_values : bool
+        Also return the function values (to plot them)
+
+    Returns
+    -------
+    events : Pandas Dataframe
+        NORAD_CAT_ID, column, name, threshold, start and end of every event range
+
+    combined : Pandas Dataframe
+        NORAD_CAT_ID, start and end of the event ranges of all functions combined (each
+        function with its last threshold, like detect_maneuver.find_maneuvers; functions with
+        an empty thresholds list are left out)
+
+    values : dict
+        (column, name) -> function value of each row of the layout (only when return_values is set)
+    '''
+    events = []
+    combined_flags = np.zeros(len(layout), dtype=bool)
+    values = {}
+    for col, funcs in maneuver_functions.items():
+        for name, func, thresholds in funcs:
+            maneuvers = layout.apply(col, func)
+            if return_values:
+                values[(col, name)] = maneuvers
+
+            # Every threshold at once (NaN compares False, like the original)
+            with np.errstate(invalid='ignore'):
+                exceeded = np.abs(maneuvers)[:, None] > np.asarray(thresholds, dtype=np.float64)[None, :]
+            for k, threshold in enumerate(thresholds):
+                ranges = find_event_ranges(layout.norads, layout.epochs, exceeded[:, k])
+                events.append(ranges.assign(column=col, name=name, threshold=threshold))
+            # A function without thresholds has no ranges, like in find_maneuvers
+            if len(thresholds) > 0:
+                combined_flags |= exceeded[:, -1]
+
+    columns = ['NORAD_CAT_ID', 'column', 'name', 'threshold', 'start', 'end']
+    events = pd.concat(events, ignore_index=True)[columns] if len(events) > 0 else pd.DataFrame(columns=columns)
+    combined = find_event_ranges(layout.norads, layout.epochs, combined_flags)
+    if return_values:
+        return events, combined, values
+    return events, combined
@@ -0,0 +1,472 @@
+'''
+maneuver_online
+---------------
+Online maneuver detection: new TLEs update a per-NORAD state instead of running
+the detection over the whole history again.
+
+The state of a satellite holds only what the next TLEs need:
+    - the last two raw TLEs (the spike test of remove_strange_data needs both
+      neighbors, so the last TLE is only kept or dropped when the next arrives)
+    - the last back + fwd filtered TLEs, where back / fwd are the number of rows
+      the detection functions look behind / ahead (found by probing them).  The
+      last fwd rows are pending: their values need TLEs that have not arrived yet
+    - the last finalized row and its flag, and the last event range (the only
+      one the new TLEs can extend)
+
+The state is split into NORAD buckets (NORAD_CAT_ID % num_buckets, as in
+maneuver_pipeline).  An update only loads the buckets of the satellites in the
+batch, runs the spike test and the detection functions over their state + new
+rows (maneuver_batch), writes those buckets back and emits the event ranges
+that are new or extended, so its cost follows the batch and not the whole
+state.  Once all the TLEs of a
+range have their look-ahead, it is the same range find_maneuvers gives for the
+combined detector (each function with its last threshold).  TLEs older than
+the last TLE of their satellite are skipped; maneuver_pipeline rebuilds
+everything when older TLEs are backfilled.
+
+The archive parts already read are tracked by name.  A part that compaction
+(GpHistoryArchive.compact) wrote over parts that were all read is not read
+again; one that also holds unread records is read in full, and its records
+that are not newer than the state are skipped.
+
+Layout of the state directory:
+    state.json                       - detector settings and the archive parts already read
+    bucket=NNNN/satellites.parquet   - one row per satellite of the bucket
+    bucket=NNNN/tails.parquet        - raw and filtered tail rows of the bucket
+    events/part-*.parquet            - emitted event ranges (status new / extended)
+
+    python maneuver_online.py
+'''
+
+import json
+import time
+import sys
+import uuid
+from datetime import datetime
+from os import listdir, makedirs, replace
+from os.path import abspath, dirname, isfile, join
+
+import numpy as np
+import pandas as pd
+
+import event_intervals
+import maneuver_batch
+from maneuver_pipeline import COMBINED_MANEUVER_FUNCTIONS
+
+ELEMENT_COLUMNS = ['SEMIMAJOR_AXIS', 'INCLINATION']
+
+# Tail row kinds
+RAW_PREVIOUS, RAW_PENDING, FILTERED = 1, 2, 3
+
+
+def function_context(func, max_context=256):
+    '''
+    Finds how many rows a detection function looks behind and ahead by running it over an
+    impulse (works for the shift / rolling functions of detect_maneuver)
+
+    Parameters:
+    -----------
+    func : function
+        Series -> Series detection function
+
+    max_context : int
+        Largest context probed
+
+    Returns
+    -------
+    context : tuple(int, int)
+        (back, fwd): the value of row i only depends on rows i - back to i + fwd
+    '''
+    if hasattr(func, 'apply_segmented'):
+        raise ValueError(f'{func} is time based, its context is not a number of rows')
+    x = np.zeros(2 * max_context + 1)
+    base = np.asarray(func(pd.Series(x)), dtype=np.float64)
+    x[max_context] = 1
+    impulse = np.asarray(func(pd.Series(x)), dtype=np.float64)
+    changed = np.flatnonzero(~((impulse == base) | (np.isnan(impulse) & np.isnan(base))))
+    if len(changed) == 0:
+        return 0, 0
+    if changed[0] == 0 or changed[-1] == len(x) - 1:
+        raise ValueError(f'{func} looks further than {max_context} rows')
+    return int(changed[-1] - max_context), int(max_context - changed[0])
+
+
+class OnlineManeuverDetector():
+    '''
+    Per NORAD rolling state of the combined maneuver detection
+    '''
+
+    maneuver_functions = None
+    back = None
+    fwd = None
+    num_buckets = None
+    state_path = None
+    buckets = None
+    changed = None
+    parts_read = None
+
+    def __init__(self, maneuver_functions=COMBINED_MANEUVER_FUNCTIONS, num_buckets=64, state_path=None):
+        '''
+        Initialize an empty state (see load_online_detector to continue a saved one)
+
+        Parameters:
+        -----------
+        maneuver_functions : dict
+            column -> list of (name, func, thresholds), as for detect_maneuver.find_maneuvers
+            (each function is used with its last threshold)
+
+        num_buckets : int
+            Number of NORAD buckets of the state
+
+        state_path : str
+            Relative path of a saved state, its buckets are loaded when a batch needs them
+            (None for an empty state)
+        '''
+        self.maneuver_functions = maneuver_functions
+        contexts = [function_context(func) for funcs in maneuver_functions.values() for name, func, thresholds in funcs]
+        self.back = max([c[0] for c in contexts], default=0)
+        self.fwd = max([c[1] for c in contexts], default=0)
+        self.num_buckets = num_buckets
+        self.state_path = state_path
+        self.buckets = {}
+        self.changed = set()
+        self.parts_read = []
+
+    def __empty_bucket(self):
+        '''
+        Returns empty (satellites, tails) frames
+        '''
+        satellites = pd.DataFrame({'last_epoch': pd.Series(dtype='datetime64[ns]'),
+                                   'pending': pd.Series(dtype=np.int64),
+                                   'last_final_epoch': pd.Series(dtype='datetime64[ns]'),
+                                   'last_final_flag': pd.Series(dtype=bool),
+                                   'event_start': pd.Series(dtype='datetime64[ns]'),
+                                   'event_end': pd.Series(dtype='datetime64[ns]')},
+                                  index=pd.Index([], dtype=np.int64, name='NORAD_CAT_ID'))
+        tails = pd.DataFrame({'NORAD_CAT_ID': pd.Series(dtype=np.int64), 'EPOCH': pd.Series(dtype='datetime64[ns]'),
+                              'SEMIMAJOR_AXIS': pd.Series(dtype=np.float64), 'INCLINATION': pd.Series(dtype=np.float64),
+                              'kind': pd.Series(dtype=np.int8)})
+        return satellites, tails
+
+    def __bucket(self, bucket):
+        '''
+        Returns the (satellites, tails) state of a bucket, read from the saved state the first time
+        '''
+        if bucket not in self.buckets:
+            bucket_path = join(self.state_path, f'bucket={bucket:04d}') if self.state_path is not None else None
+            if bucket_path is not None and isfile(join(bucket_path, 'satellites.parquet')):
+                self.buckets[bucket] = (pd.read_parquet(join(bucket_path, 'satellites.parquet')).set_index('NORAD_CAT_ID'),
+                                        pd.read_parquet(join(bucket_path, 'tails.parquet')))
+            else:
+                self.buckets[bucket] = self.__empty_bucket()
+        return self.buckets[bucket]
+
+    def get_satellites(self):
+        '''
+        Returns the state of every satellite (loads every bucket)
+        '''
+        for bucket in range(self.num_buckets):
+            self.__bucket(bucket)
+        return pd.concat([self.buckets[b][0] for b in sorted(self.buckets)]).sort_index()
+
+    def update(self, df):
+        '''
+        Adds a batch of TLEs to the state
+
+        Parameters:
+        -----------
+        df : Pandas Dataframe
+            NORAD_CAT_ID, EPOCH, SEMIMAJOR_AXIS and INCLINATION of the new TLEs (any order, EPOCH
+            as a column or as the index)
+
+        Returns
+        -------
+        events : Pandas Dataframe
+            NORAD_CAT_ID, start, end and status (new / extended) of the event ranges that changed
+        '''
+        df = df.reset_index() if 'EPOCH' not in df.columns else df
+        new = pd.DataFrame({'NORAD_CAT_ID': df['NORAD_CAT_ID'].values.astype(np.int64),
+                            'EPOCH': df['EPOCH'].values.astype('datetime64[ns]'),
+                            'SEMIMAJOR_AXIS': df['SEMIMAJOR_AXIS'].values.astype(np.float64),
+                            'INCLINATION': df['INCLINATION'].values.astype(np.float64)})
+        new = new.dropna().drop_duplicates(subset=['NORAD_CAT_ID', 'EPOCH'], keep='last')
+        if len(new) == 0:
+            return _empty_events()
+
+        # Only the buckets of the satellites in the batch are read and changed
+        buckets = np.unique(new['NORAD_CAT_ID'].values % self.num_buckets)
+        satellites = pd.concat([self.__bucket(b)[0] for b in buckets])
+        tails = pd.concat([self.__bucket(b)[1] for b in buckets], ignore_index=True)
+
+        # Skip the TLEs that are not newer than what the state already holds
+        last_epoch = satellites['last_epoch'].reindex(new['NORAD_CAT_ID'].values).values
+        late = ~pd.isnull(last_epoch) & (new['EPOCH'].values <= last_epoch)
+        if late.any():
+            print(f'Skipping {late.sum()} TLEs older than the last TLE of their satellite')
+        new = new[~late]
+        if len(new) == 0:
+            return _empty_events()
+
+        norads = np.unique(new['NORAD_CAT_ID'].values)
+        in_batch = tails['NORAD_CAT_ID'].isin(norads).values
+        tails, other_tails = tails[in_batch], tails[~in_batch]
+        state = satellites.reindex(norads)
+        state['pending'] = state['pending'].fillna(0).astype(np.int64)
+        state['last_final_flag'] = state['last_final_flag'].astype(object).fillna(False).astype(bool)
+
+        accepted, raw_tail = self.__filter_raw(tails[tails['kind'] != FILTERED], new)
+        filtered_tail, finals = self.__detect(tails[tails['kind'] == FILTERED], accepted, state)
+        events = self.__update_events(finals, state)
+
+        state['last_epoch'] = new.groupby('NORAD_CAT_ID')['EPOCH'].max().reindex(norads).values
+        satellites = pd.concat([satellites.drop(index=norads, errors='ignore'), state]).sort_index()
+        tails = pd.concat([other_tails, raw_tail, filtered_tail], ignore_index=True)
+
+        # Back into their buckets
+        satellite_buckets = satellites.index.values % self.num_buckets
+        tail_buckets = tails['NORAD_CAT_ID'].values % self.num_buckets
+        for bucket in buckets:
+            self.buckets[bucket] = (satellites[satellite_buckets == bucket], tails[tail_buckets == bucket].reset_index(drop=True))
+        self.changed.update(buckets)
+        return events
+
+    def __filter_raw(self, raw_tail, new):
+        '''
+        Spike test of the pending raw TLEs, now that their next TLE is known
+
+        Returns the filtered rows that were decided and kept, and the new raw tail
+        '''
+        rows = pd.concat([raw_tail, new.assign(kind=0)], ignore_index=True)
+        layout = maneuver_batch.BatchLayout(rows.set_index('EPOCH'), ELEMENT_COLUMNS + ['kind'])
+        kept = np.zeros(len(layout), dtype=bool)
+        kept[maneuver_batch.find_strange_data(layout, ELEMENT_COLUMNS)[0]] = True
+
+        # The previous raw row was decided before, the last row of each satellite is decided next time
+        last = np.zeros(len(layout), dtype=bool)
+        last[layout.offsets[1:] - 1] = True
+        before_last = np.zeros(len(layout), dtype=bool)
+        before_last[layout.offsets[1:][layout.lengths > 1] - 2] = True
+        decided = ~last & (layout.values['kind'] != RAW_PREVIOUS)
+
+        frame = self.__layout_frame(layout)
+        accepted = frame[decided & kept].assign(kind=FILTERED)
+        raw_tail = frame[last | before_last].assign(kind=np.where(last[last | before_last], RAW_PENDING, RAW_PREVIOUS))
+        return accepted, raw_tail
+
+    def __detect(self, filtered_tail, accepted, state):
+        '''
+        Runs the detection functions over the filtered tail + accepted rows of each satellite
+
+        Returns the new filtered tail and the rows that were finalized (with their flag)
+        '''
+        rows = pd.concat([filtered_tail, accepted], ignore_index=True)
+        if len(rows) == 0:
+            return rows, rows.assign(flag=np.zeros(0, dtype=bool))
+        layout = maneuver_batch.BatchLayout(rows.set_index('EPOCH'), ELEMENT_COLUMNS)
+        flags = np.zeros(len(layout), dtype=bool)
+        for col, funcs in self.maneuver_functions.items():
+            for name, func, thresholds in funcs:
+                if len(thresholds) == 0:
+                    continue
+                with np.errstate(invalid='ignore'):
+                    flags |= np.abs(layout.apply(col, func)) > thresholds[-1]
+
+        # Rows that were pending before (or are new) and now have their look-ahead
+        position = np.arange(len(layout)) - np.repeat(layout.offsets[:-1], layout.lengths)
+        length = np.repeat(layout.lengths, layout.lengths)
+        num_tail = filtered_tail['NORAD_CAT_ID'].value_counts().reindex(layout.sat_norads, fill_value=0).values
+        first_open = np.repeat(num_tail - state['pending'].reindex(layout.sat_norads).values, layout.lengths)
+        final = (position >= first_open) & (position < length - self.fwd)
+
+        frame = self.__layout_frame(layout)
+        finals = frame[final].assign(flag=flags[final])
+        keep = position >= length - (self.back + self.fwd)
+        new_tail = frame[keep].assign(kind=FILTERED)
+        pending = np.minimum(layout.lengths - (first_open[layout.offsets[:-1]]), self.fwd)
+        state.loc[layout.sat_norads, 'pending'] = np.maximum(pending, 0)
+        return new_tail, finals
+
+    def __update_events(self, finals, state):
+        '''
+        Turns the finalized rows into event ranges, merged with the last range of each satellite
+        '''
+        if len(finals) == 0:
+            return _empty_events()
+        norads = np.unique(finals['NORAD_CAT_ID'].values)
+        previous = state.loc[norads]
+
+        # The last finalized row goes first, so a run that was open continues
+        last_rows = pd.DataFrame({'NORAD_CAT_ID': norads, 'EPOCH': previous['last_final_epoch'].values,
+                                  'flag': previous['last_final_flag'].values})
+        rows = pd.concat([last_rows.dropna(subset=['EPOCH']), finals[['NORAD_CAT_ID', 'EPOCH', 'flag']]], ignore_index=True)
+        rows = rows.sort_values(['NORAD_CAT_ID', 'EPOCH'], kind='mergesort')
+        runs = event_intervals.pad_intervals(event_intervals.flags_to_runs(rows['NORAD_CAT_ID'].values, rows['EPOCH'].values,
+                                                                            rows['flag'].values.astype(bool)))
+
+        open_ranges = previous.dropna(subset=['event_start'])
+        opened = (open_ranges.index.values, open_ranges['event_start'].values.astype('datetime64[ns]'),
+                  open_ranges['event_end'].values.astype('datetime64[ns]'))
+        ranges = event_intervals.to_frame(event_intervals.union_intervals([opened, runs]))
+
+        # Only the ranges that are new or were extended are emitted
+        known = ranges.merge(open_ranges[['event_start', 'event_end']], left_on='NORAD_CAT_ID', right_index=True, how='left')
+        status = np.where(known['start'].values != known['event_start'].values, 'new',
+                          np.where(known['end'].values != known['event_end'].values, 'extended', ''))
+        events = ranges.assign(status=status)[status != '']
+
+        last_range = ranges.groupby('NORAD_CAT_ID').last()
+        last_final = finals.groupby('NORAD_CAT_ID').last()
+        state.loc[last_range.index, 'event_start'] = last_range['start'].values
+        state.loc[last_range.index, 'event_end'] = last_range['end'].values
+        state.loc[last_final.index, 'last_final_epoch'] = last_final['EPOCH'].values
+        state.loc[last_final.index, 'last_final_flag'] = last_final['flag'].values
+        return events.reset_index(drop=True)
+
+    def __layout_frame(self, layout):
+        df = pd.DataFrame({'NORAD_CAT_ID': layout.norads, 'EPOCH': layout.epochs})
+        for col in ELEMENT_COLUMNS:
+            df[col] = layout.values[col]
+        return df
+
+    def save(self, state_path):
+        '''
+        Writes the state: the settings and the buckets that changed (every bucket when the state
+        goes to another directory)
+
+        Parameters:
+        -----------
+        state_path : str
+            Relative path of the state directory (created if missing)
+        '''
+        if state_path != self.state_path:
+            for bucket in range(self.num_buckets):
+                self.__bucket(bucket)
+            self.changed = set(self.buckets)
+            self.state_path = state_path
+
+        makedirs(state_path, exist_ok=True)
+        for bucket in sorted(self.changed):
+            satellites, tails = self.buckets[bucket]
+            bucket_path = join(state_path, f'bucket={bucket:04d}')
+            makedirs(bucket_path, exist_ok=True)
+            _write_parquet(satellites.reset_index(), join(bucket_path, 'satellites.parquet'))
+            _write_parquet(tails, join(bucket_path, 'tails.parquet'))
+        self.changed = set()
+
+        # The settings go last, a state is only loaded once they are there
+        settings = {'functions': _describe_functions(self.maneuver_functions), 'back': self.back, 'fwd': self.fwd,
+                    'num_buckets': self.num_buckets, 'parts_read': self.parts_read}
+        with open(join(state_path, 'state.json.tmp'), 'w') as f:
+            json.dump(settings, f, indent=1)
+        replace(join(state_path, 'state.json.tmp'), join(state_path, 'state.json'))
+
+
+def load_online_detector(state_path, maneuver_functions=COMBINED_MANEUVER_FUNCTIONS):
+    '''
+    Loads a saved detector state (a new state when there is none)
+
+    Parameters:
+    -----------
+    state_path : str
+        Relative path of the state directory
+
+    maneuver_functions : dict
+        Detection functions, the same ones (names and thresholds) the state was built with
+
+    Returns
+    -------
+    detector : OnlineManeuverDetector
+        Detector with the saved state
+    '''
+    if not isfile(join(state_path, 'state.json')):
+        return OnlineManeuverDetector(maneuver_functions)
+    with open(join(state_path, 'state.json')) as f:
+        settings = json.load(f)
+    if settings['functions'] != _describe_functions(maneuver_functions):
+        raise ValueError(f'{state_path} was built with other detection functions: {settings["functions"]}')
+    if 'num_buckets' not in settings:
+        raise ValueError(f'{state_path} was saved without NORAD buckets, delete it to rebuild the state')
+    detector = OnlineManeuverDetector(maneuver_functions, settings['num_buckets'], state_path)
+    detector.parts_read = settings['parts_read']
+    return detector
+
+
+def _describe_functions(maneuver_functions):
+    return [[col, name, thresholds[-1]] for col, funcs in maneuver_functions.items() for name, func, thresholds in funcs
+            if len(thresholds) > 0]
+
+def _empty_events():
+    return pd.DataFrame({'NORAD_CAT_ID': pd.Series(dtype=np.int64), 'start': pd.Series(dtype='datetime64[ns]'),
+                         'end': pd.Series(dtype='datetime64[ns]'), 'status': pd.Series(dtype=object)})
+
+def _write_parquet(df, path):
+    df.to_parquet(path + '.tmp', index=False)
+    replace(path + '.tmp', path)
+
+
+def update_from_archive(archive, state_path, maneuver_functions=COMBINED_MANEUVER_FUNCTIONS):
+    '''
+    Runs the online detector over the gp_history archive parts it has not read yet and saves
+    the state and the emitted events
+
+    Parameters:
+    -----------
+    archive : GpHistoryArchive
+        Local gp_history archive (filled by the gp_history grab)
+
+    state_path : str
+        Relative path of the state directory
+
+    maneuver_functions : dict
+        Detection functions
+
+    Returns
+    -------
+    events : Pandas Dataframe
+        Event ranges that are new or were extended
+    '''
+    start = time.time()
+    detector = load_online_detector(state_path, maneuver_functions)
+    read = set(detector.parts_read)
+    parts = [p for p in archive.list_parts() if p not in read]
+
+    # A compacted part over parts that were all read holds no new records
+    compactions = archive.compacted_parts()
+    compacted = [p for p in parts if p in compactions and set(compactions[p]) - {p} <= read]
+    parts = [p for p in parts if p not in compacted]
+    df = archive.read_parts(parts)
+    print(f'Updating the maneuver state with {len(df)} TLEs of {len(parts)} archive parts...')
+
+    events = detector.update(df[['NORAD_CAT_ID', 'EPOCH', 'SEMIMAJOR_AXIS', 'INCLINATION']])
+    detector.parts_read = detector.parts_read + compacted + parts
+    if len(events) > 0:
+        makedirs(join(state_path, 'events'), exist_ok=True)
+        part = 'part-' + datetime.utcnow().strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8] + '.parquet'
+        _write_parquet(events, join(state_path, 'events', part))
+    num_changed = len(detector.changed)
+    detector.save(state_path)
+    print(f'{(events.status == "new").sum()} new and {(events.status == "extended").sum()} extended maneuver events '
+          f'in {time.time() - start:.1f} s ({num_changed} of {detector.num_buckets} state buckets changed)')
+    return events
+
+
+def get_online_events(state_path):
+    '''
+    Returns the current event ranges of the online detector (the last version of each range)
+    '''
+    events_path = join(state_path, 'events')
+    parts = sorted(f for f in listdir(events_path) if f.endswith('.parquet')) if isfile(join(state_path, 'state.json')) else []
+    if len(parts) == 0:
+        return _empty_events().drop(columns=['status'])
+    df = pd.concat([pd.read_parquet(join(events_path, f)) for f in parts], ignore_index=True)
+    df = df.drop_duplicates(subset=['NORAD_CAT_ID', 'start'], keep='last')
+    return df.sort_values(['NORAD_CAT_ID', 'start']).drop(columns=['status']).reset_index(drop=True)
+
+
+gp_archive_path = '../../data/gp_history_archive/'
+maneuver_state_path = '../../data/maneuver/online_state/'
+
+if __name__ == '__main__':
+    sys.path.append(join(dirname(abspath(__file__)), '../..'))
+    from pkg.orbital_congestion.gp_archive import GpHistoryArchive
+    update_from_archive(GpHistoryArchive(gp_archive_path), maneuver_state_path)
@@ -0,0 +1,401 @@
+'''
+maneuver_pipeline
+-----------------
+Out-of-core maneuver detection over the whole GP history.
+
+The history is first split by NORAD id into buckets (NORAD_CAT_ID % num_buckets)
+of parquet parts, reading the source one chunk at a time:
+
+    partition_path/bucket=0000/part-00000.parquet
+    partition_path/bucket=0000/part-00001.parquet
+    ...
+    partition_path/partition.json   - number of buckets and rows (written last)
+
+An interrupted partitioning resumes where its last flushed parts end
+(partition.progress.json) when it is run again over the same source.
+
+Every satellite is then in a single bucket, so the detection runs bucket by
+bucket across a process pool (the spike filter and the batch detector of
+maneuver_batch).  Each bucket writes its event ranges and removed rows to the
+output directory and the parts are gathered into output_path/events.parquet,
+output_path/removed.parquet and output_path/combined.parquet at the end.  Memory is bounded by the chunk size
+while partitioning and by the largest bucket (times the number of processes)
+while detecting, whatever the size of the history.
+
+    python maneuver_pipeline.py partition "../../../siads591 data/space_track_raw/csv/"
+    python maneuver_pipeline.py detect --processes 8
+'''
+
+import argparse
+import json
+import multiprocessing
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import cpu_count, listdir, makedirs, remove, replace
+from os.path import isdir, isfile, join
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+import maneuver_batch
+
+# Columns of the partitioned history (scaled like filter_raw_data_payload_maneuvers.ipynb)
+PARTITION_COLUMNS = ['EPOCH', 'NORAD_CAT_ID', 'SEMIMAJOR_AXIS_x1000', 'INCLINATION_x10000']
+RAW_COLUMNS = ['NORAD_CAT_ID', 'MEAN_MOTION', 'ECCENTRICITY', 'SEMIMAJOR_AXIS', 'INCLINATION', 'OBJECT_TYPE', 'EPOCH']
+BUCKET_PATTERN = '^bucket=([0-9]{4})$'
+PART_PATTERN = '^part-([0-9]{5})\\.parquet'
+
+
+def inclination_rolling_10_neighbor_diff(x):
+    return x.rolling(10, min_periods=1).mean().shift(-9) - x.rolling(10, min_periods=1).mean()
+
+def semimajor_axis_rolling_3_neighbor_diff(x):
+    return x.rolling(3, min_periods=1).mean().shift(-2) - x.rolling(3, min_periods=1).mean()
+
+# combined_maneuver_functions of maneuvers_detection_method.ipynb (named functions, so they can be pickled)
+COMBINED_MANEUVER_FUNCTIONS = {
+    'INCLINATION': [
+        ("rolling_10_neighbor_diff", inclination_rolling_10_neighbor_diff, [0.008]),
+    ],
+    'SEMIMAJOR_AXIS': [
+        ("rolling_3_neighbor_diff", semimajor_axis_rolling_3_neighbor_diff, [0.025]),
+    ],
+}
+
+
+def scale_raw_gp_data(df):
+    '''
+    Keeps the LEO payloads of raw gp_history rows and scales their elements the way
+    filter_raw_data_payload_maneuvers.ipynb does (SEMIMAJOR_AXIS_x1000, INCLINATION_x10000)
+    '''
+    # LEO = Mean Motion > 11.25 and Eccentricity < 0.25
+    df = df[(df.MEAN_MOTION > 11.25) & (df.ECCENTRICITY < 0.25) & (df.OBJECT_TYPE == "PAYLOAD")]
+    return pd.DataFrame({'EPOCH': pd.to_datetime(df['EPOCH']).values,
+                         'NORAD_CAT_ID': df['NORAD_CAT_ID'].values.astype(np.uint32),
+                         'SEMIMAJOR_AXIS_x1000': (df['SEMIMAJOR_AXIS'].values * 1000).astype(np.uint32),
+                         'INCLINATION_x10000': (df['INCLINATION'].values * 10000).astype(np.uint32)})
+
+
+def iter_gp_history_chunks(source_path, chunksize=1000000):
+    '''
+    Reads a GP history one chunk at a time
+
+    Parameters:
+    -----------
+    source_path : str
+        One of:
+        - directory of the raw gp_history csv.gz files (download_all_gp_history.ipynb), filtered
+          to the LEO payloads
+        - parquet file with the PARTITION_COLUMNS
+        - pickle of the filtered history (payload.pkl.gz), which can only be loaded as a whole
+
+    chunksize : int
+        Rows per chunk
+
+    Returns
+    -------
+    chunks : generator(Pandas Dataframe)
+        Chunks with the PARTITION_COLUMNS
+    '''
+    if isdir(source_path):
+        files = sorted(f for f in listdir(source_path) if f.endswith('.csv.gz'))
+        for f in tqdm(files):
+            for df in pd.read_csv(join(source_path, f), usecols=RAW_COLUMNS, chunksize=chunksize, compression='gzip'):
+                yield scale_raw_gp_data(df)
+    elif source_path.endswith('.parquet'):
+        # One row group at a time (ParquetFile.iter_batches needs pyarrow >= 3)
+        parquet_file = pq.ParquetFile(source_path)
+        for i in range(parquet_file.num_row_groups):
+            df = parquet_file.read_row_group(i, columns=PARTITION_COLUMNS).to_pandas()
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+    else:
+        print(f'{source_path} is a pickle, loading it whole')
+        df = pd.read_pickle(source_path, compression='infer').reset_index()
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize][PARTITION_COLUMNS]
+
+
+def partition_gp_history(chunks, partition_path, num_buckets=256, max_buffer_rows=5000000):
+    '''
+    Splits a GP history into NORAD id buckets of parquet parts
+
+    Parameters:
+    -----------
+    chunks : iterable(Pandas Dataframe)
+        History chunks with the PARTITION_COLUMNS (see iter_gp_history_chunks)
+
+    partition_path : str
+        Relative path of the partitioned history.  A complete partitioning is kept as is, an
+        interrupted one (same chunks) is resumed
+
+    num_buckets : int
+        Number of NORAD id buckets
+
+    max_buffer_rows : int
+        Rows buffered across all buckets before they are written out
+
+    Returns
+    -------
+    num_rows : int
+        Rows written
+    '''
+    makedirs(partition_path, exist_ok=True)
+    if isfile(join(partition_path, 'partition.json')):
+        with open(join(partition_path, 'partition.json')) as f:
+            partition = json.load(f)
+        print(f'{partition_path} is already partitioned')
+        return partition['rows']
+
+    # Resume after the last flush of an interrupted run, or start from an empty directory
+    progress_file = join(partition_path, 'partition.progress.json')
+    progress = None
+    if isfile(progress_file):
+        with open(progress_file) as f:
+            progress = json.load(f)
+    if progress is None or progress['num_buckets'] != num_buckets:
+        for bucket in list_buckets(partition_path):
+            shutil.rmtree(join(partition_path, bucket))
+        progress = {'num_buckets': num_buckets, 'chunks': 0, 'rows': 0, 'flushes': 0}
+    else:
+        print(f'Resuming the partitioning after {progress["chunks"]} chunks ({progress["rows"]} rows)')
+    _remove_parts(partition_path, progress['flushes'])
+
+    buffers, buffered = {}, 0
+    num_rows, flushes = progress['rows'], progress['flushes']
+    for k, chunk in enumerate(chunks):
+        if k < progress['chunks']:
+            continue
+        buckets = chunk['NORAD_CAT_ID'].values % num_buckets
+        for bucket, bucket_df in chunk.groupby(buckets):
+            buffers.setdefault(bucket, []).append(bucket_df)
+        buffered += len(chunk)
+        num_rows += len(chunk)
+        if buffered >= max_buffer_rows:
+            _flush_buffers(buffers, partition_path, flushes)
+            buffers, buffered, flushes = {}, 0, flushes + 1
+            _write_json({'num_buckets': num_buckets, 'chunks': k + 1, 'rows': num_rows, 'flushes': flushes}, progress_file)
+    _flush_buffers(buffers, partition_path, flushes)
+
+    # The marker goes last: a partitioning without it is incomplete
+    _write_json({'num_buckets': num_buckets, 'rows': num_rows}, join(partition_path, 'partition.json'))
+    if isfile(progress_file):
+        remove(progress_file)
+    return num_rows
+
+def _flush_buffers(buffers, partition_path, part):
+    for bucket, frames in buffers.items():
+        bucket_path = join(partition_path, f'bucket={bucket:04d}')
+        makedirs(bucket_path, exist_ok=True)
+        _write_parquet(pd.concat(frames, ignore_index=True), join(bucket_path, f'part-{part:05d}.parquet'))
+
+def _remove_parts(partition_path, first_part):
+    '''
+    Removes the parts from first_part on (and the temporary files) of every bucket
+    '''
+    for bucket in list_buckets(partition_path):
+        bucket_path = join(partition_path, bucket)
+        for f in listdir(bucket_path):
+            match = re.search(PART_PATTERN, f)
+            if f.endswith('.tmp') or (match is not None and int(match.group(1)) >= first_part):
+                remove(join(bucket_path, f))
+
+def _write_json(data, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    replace(path + '.tmp', path)
+
+
+def list_buckets(partition_path):
+    '''
+    Returns the bucket directory names of a partitioned history
+    '''
+    if not isdir(partition_path):
+        return []
+    return sorted(f for f in listdir(partition_path) if re.search(BUCKET_PATTERN, f))
+
+
+def read_bucket(bucket_path, norads=None):
+    '''
+    Reads a bucket of the partitioned history, with the elements scaled back
+
+    Parameters:
+    -----------
+    bucket_path : str
+        Relative path of the bucket directory
+
+    norads : list(int)
+        Only read these satellites (None reads the whole bucket)
+
+    Returns
+    -------
+    df : Pandas Dataframe
+        NORAD_CAT_ID, SEMIMAJOR_AXIS and INCLINATION indexed by EPOCH, sorted by satellite and epoch
+    '''
+    filters = [('NORAD_CAT_ID', 'in', list(norads))] if norads is not None else None
+    parts = [join(bucket_path, f) for f in sorted(listdir(bucket_path)) if f.endswith('.parquet')]
+    df = pd.concat([pd.read_parquet(p, filters=filters) for p in parts], ignore_index=True)
+    df = df.sort_values(['NORAD_CAT_ID', 'EPOCH'], kind='mergesort')
+
+    # revert back the scaling
+    return pd.DataFrame({'NORAD_CAT_ID': df['NORAD_CAT_ID'].values.astype(np.int64),
+                         'SEMIMAJOR_AXIS': df['SEMIMAJOR_AXIS_x1000'].values.astype(np.float64) / 1000,
+                         'INCLINATION': df['INCLINATION_x10000'].values.astype(np.float64) / 10000},
+                        index=pd.Index(df['EPOCH'].values, name='EPOCH'))
+
+
+def read_norad_history(partition_path, norad_id):
+    '''
+    Reads the history of one satellite from its bucket only
+    '''
+    with open(join(partition_path, 'partition.json')) as f:
+        num_buckets = json.load(f)['num_buckets']
+    return read_bucket(join(partition_path, f'bucket={norad_id % num_buckets:04d}'), [norad_id])
+
+
+def detect_bucket(bucket_path, output_path, maneuver_functions):
+    '''
+    Removes the strange data and runs the batch detector over one bucket, and writes its event
+    ranges and removed rows
+
+    Parameters:
+    -----------
+    bucket_path : str
+        Relative path of the bucket directory
+
+    output_path : str
+        Relative path of the output directory
+
+    maneuver_functions : dict
+        column -> list of (name, func, thresholds), as for detect_maneuver.find_maneuvers
+
+    Returns
+    -------
+    stats : tuple
+        (bucket name, rows read, rows kept, event ranges, combined ranges)
+    '''
+    bucket = bucket_path.rstrip('/').split('/')[-1]
+    df = read_bucket(bucket_path)
+
+    layout = maneuver_batch.BatchLayout(df, list(maneuver_functions.keys()))
+    kept, removed = maneuver_batch.find_strange_data(layout)
+    layout = layout.take(kept)
+
+    events, combined = maneuver_batch.find_maneuvers_batch(layout, maneuver_functions)
+    _write_parquet(events, join(output_path, 'events', bucket + '.parquet'))
+    _write_parquet(removed, join(output_path, 'removed', bucket + '.parquet'))
+    _write_parquet(combined, join(output_path, 'combined', bucket + '.parquet'))
+    return (bucket, len(df), len(layout), len(events), len(combined))
+
+def _write_parquet(df, path):
+    df.to_parquet(path + '.tmp', index=False)
+    replace(path + '.tmp', path)
+
+
+_worker_functions = None
+
+def _init_worker(maneuver_functions):
+    global _worker_functions
+    _worker_functions = maneuver_functions
+
+def _detect_bucket_worker(bucket_path, output_path):
+    return detect_bucket(bucket_path, output_path, _worker_functions)
+
+
+def run_detection(partition_path, output_path, maneuver_functions=COMBINED_MANEUVER_FUNCTIONS, processes=None, resume=True):
+    '''
+    Runs the detection over every bucket of a partitioned history across a process pool
+
+    The maneuver functions are handed to the workers when they start; with the fork start
+    method (Linux) they can be lambdas, otherwise they have to be module level functions.
+
+    Parameters:
+    -----------
+    partition_path : str
+        Relative path of the partitioned history
+
+    output_path : str
+        Relative path of the output directory
+
+    maneuver_functions : dict
+        column -> list of (name, func, thresholds), as for detect_maneuver.find_maneuvers
+
+    processes : int
+        Number of processes (defaults to the cpu count, 1 runs in this process)
+
+    resume : bool
+        Skip the buckets that already have their output
+
+    Returns
+    -------
+    events : Pandas Dataframe
+        NORAD_CAT_ID, column, name, threshold, start and end of every event range
+
+    combined : Pandas Dataframe
+        NORAD_CAT_ID, start and end of the combined event ranges
+    '''
+    for name in ['events', 'removed', 'combined']:
+        makedirs(join(output_path, name), exist_ok=True)
+    buckets = list_buckets(partition_path)
+    if resume:
+        buckets = [b for b in buckets if not isfile(join(output_path, 'combined', b + '.parquet'))]
+    print(f'Detecting maneuvers in {len(buckets)} buckets...')
+
+    processes = processes or cpu_count() or 1
+    start = time.time()
+    stats = []
+    if processes == 1:
+        for b in tqdm(buckets):
+            stats.append(detect_bucket(join(partition_path, b), output_path, maneuver_functions))
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                 initializer=_init_worker, initargs=(maneuver_functions,)) as executor:
+            futures = [executor.submit(_detect_bucket_worker, join(partition_path, b), output_path) for b in buckets]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                stats.append(future.result())
+    if len(stats) > 0:
+        rows, kept = sum(s[1] for s in stats), sum(s[2] for s in stats)
+        print(f'{rows} rows ({rows - kept} strange rows removed) in {time.time() - start:.1f} s')
+
+    # Gather the output table of every bucket
+    tables = []
+    for name, sort in [('events', 'start'), ('removed', 'EPOCH'), ('combined', 'start')]:
+        parts = sorted(f for f in listdir(join(output_path, name)) if f.endswith('.parquet'))
+        df = pd.concat([pd.read_parquet(join(output_path, name, f)) for f in parts], ignore_index=True) if len(parts) > 0 else pd.DataFrame()
+        if len(df) > 0:
+            df = df.sort_values(['NORAD_CAT_ID', sort], kind='mergesort').reset_index(drop=True)
+        _write_parquet(df, join(output_path, name + '.parquet'))
+        tables.append(df)
+    print(f'{len(tables[0])} event ranges, {len(tables[2])} combined ranges')
+    return tables[0], tables[2]
+
+
+partition_path = '../../data/gp_history_partitioned/'
+output_path = '../../data/maneuver/events/'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    partition_parser = subparsers.add_parser('partition', help='split a GP history into NORAD id buckets')
+    partition_parser.add_argument('source', help='raw csv.gz directory, parquet file or pickle of the history')
+    partition_parser.add_argument('--partition-path', default=partition_path)
+    partition_parser.add_argument('--num-buckets', type=int, default=256)
+    partition_parser.add_argument('--chunksize', type=int, default=1000000)
+    detect_parser = subparsers.add_parser('detect', help='detect the maneuvers of every bucket')
+    detect_parser.add_argument('--partition-path', default=partition_path)
+    detect_parser.add_argument('--output-path', default=output_path)
+    detect_parser.add_argument('--processes', type=int, default=None)
+    detect_parser.add_argument('--no-resume', action='store_true', help='detect again the buckets that have an output')
+    args = parser.parse_args()
+
+    if args.command == 'partition':
+        num_rows = partition_gp_history(iter_gp_history_chunks(args.source, args.chunksize), args.partition_path, args.num_buckets)
+        print(f'Partitioned {num_rows} rows into {len(list_buckets(args.partition_path))} buckets')
+    else:
+        run_detection(args.partition_path, args.output_path, processes=args.processes, resume=not args.no_resume)
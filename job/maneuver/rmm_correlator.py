@@ -0,0 +1,206 @@
+'''
+rmm_correlator
+--------------
+Batch search of risk mitigation maneuvers (RMM): joins every SOCRATES
+conjunction with the maneuver event ranges of both of its satellites.
+
+A conjunction group (socrates.get_socrates_cleaned_data) is warned about from its
+first extract_date until its TCA (the green and red lines of
+detect_maneuver.plot_extra_lines).  An event range of either satellite that
+overlaps [first extract, TCA] is a candidate RMM.
+
+The join is a sorted interval join: the event ranges of each satellite are
+merged (disjoint and sorted, so their ends are sorted too) and every window
+finds its first and last candidate with two binary searches over
+(NORAD_CAT_ID, time) keys.  The candidate pairs are then expanded with
+np.repeat, so the cost is O((windows + pairs) log events) and millions of pairs
+stay a few flat arrays.
+
+Each candidate gets a score in [0, 1]:
+
+    score = probability weight * timing weight * (1 - chance)
+
+    probability weight - max_prob of the conjunction on a log scale, 1e-8 -> 0, 1e-2 -> 1
+    timing weight      - 1 when the maneuver starts after the first warning, 0.5 when it
+                         was already under way
+    chance             - probability that a window this long holds an event range of the
+                         satellite by chance, from its number of event ranges over the
+                         period of the event table (satellites that maneuver all the
+                         time score low)
+
+    python rmm_correlator.py
+'''
+
+import argparse
+import time
+import sys
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pandas as pd
+
+import event_intervals
+
+RMM_COLUMNS = ['group', 'sat_pair_id', 'side', 'NORAD_CAT_ID', 'other_norad', 'first_extract', 'tca',
+               'num_extracts', 'max_prob', 'min_rng_km', 'start', 'end', 'lead_days', 'chance', 'score']
+
+
+def conjunction_windows(soc_df):
+    '''
+    Warning window of each conjunction group
+
+    Parameters:
+    -----------
+    soc_df : Pandas Dataframe
+        Cleaned socrates data (get_socrates_cleaned_data)
+
+    Returns
+    -------
+    windows : Pandas Dataframe
+        group, sat_pair_id, sat1_norad, sat2_norad, first_extract, tca (mean TCA of the group),
+        num_extracts, max_prob and min_rng_km of each group
+    '''
+    aggs = {'sat_pair_id': ('sat_pair_id', 'first'), 'sat1_norad': ('sat1_norad', 'first'),
+            'sat2_norad': ('sat2_norad', 'first'), 'first_extract': ('extract_date', 'min'),
+            'tca': ('tca_time', 'mean'), 'num_extracts': ('extract_date', 'size')}
+    if 'max_prob' in soc_df.columns:
+        aggs['max_prob'] = ('max_prob', 'max')
+    if 'min_rng_km' in soc_df.columns:
+        aggs['min_rng_km'] = ('min_rng_km', 'min')
+    windows = soc_df.groupby('group', sort=False).agg(**aggs).reset_index()
+    for col in ['max_prob', 'min_rng_km']:
+        if col not in windows.columns:
+            windows[col] = np.nan
+    return windows
+
+
+def interval_join(keys, starts, ends, interval_keys, interval_starts, interval_ends):
+    '''
+    Finds the intervals that overlap each window (same key, start < window end and end > window start)
+
+    Parameters:
+    -----------
+    keys, starts, ends : array
+        Windows (int keys, datetime64 bounds), in any order
+
+    interval_keys, interval_starts, interval_ends : array
+        Disjoint intervals of each key, sorted by key then start (event_intervals.merge_intervals)
+
+    Returns
+    -------
+    pairs : tuple(array, array)
+        (window positions, interval positions) of the overlapping pairs
+    '''
+    interval_keys = np.asarray(interval_keys, dtype=np.int64)
+    interval_starts = np.asarray(interval_starts).astype('datetime64[ns]').astype(np.int64)
+    interval_ends = np.asarray(interval_ends).astype('datetime64[ns]').astype(np.int64)
+    keys = np.asarray(keys, dtype=np.int64)
+    starts = np.asarray(starts).astype('datetime64[ns]').astype(np.int64)
+    ends = np.asarray(ends).astype('datetime64[ns]').astype(np.int64)
+
+    # (key, second) search keys: the searches are widened by a second and the pairs are then
+    # checked on the exact times.  Sorted probes keep the binary searches cache friendly
+    probe_starts = _join_keys(keys, starts)
+    order = np.argsort(probe_starts, kind='stable')
+    first = np.searchsorted(_join_keys(interval_keys, interval_ends), probe_starts[order], side='left')
+    last = np.searchsorted(_join_keys(interval_keys, interval_starts), _join_keys(keys[order], ends[order]), side='right')
+    counts = np.maximum(last - first, 0)
+
+    windows = np.repeat(order, counts)
+    intervals = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+    overlap = ((interval_keys[intervals] == keys[windows]) & (interval_starts[intervals] < ends[windows]) &
+               (interval_ends[intervals] > starts[windows]))
+    return windows[overlap], intervals[overlap]
+
+def _join_keys(keys, times):
+    '''
+    Single int64 sort key of (key, time): seconds since 1900 in the low 34 bits
+    '''
+    seconds = np.clip((times // 10 ** 9) + 2208988800, 0, (1 << 34) - 1)
+    return (keys << 34) + seconds
+
+
+def correlate_rmm(soc_df, events, min_score=0):
+    '''
+    Scored table of the candidate RMMs of every conjunction
+
+    Parameters:
+    -----------
+    soc_df : Pandas Dataframe
+        Cleaned socrates data (get_socrates_cleaned_data), or the output of conjunction_windows
+
+    events : Pandas Dataframe
+        Maneuver event ranges: NORAD_CAT_ID, start and end (combined ranges of
+        maneuver_pipeline / find_maneuvers_batch, or get_online_events)
+
+    min_score : float
+        Lowest score kept
+
+    Returns
+    -------
+    rmm : Pandas Dataframe
+        One row per conjunction group, satellite (side 1 or 2) and overlapping event range,
+        highest score first (see the module docstring)
+    '''
+    windows = soc_df if 'first_extract' in soc_df.columns else conjunction_windows(soc_df)
+    windows = windows[windows['first_extract'] < windows['tca']]
+    if len(windows) == 0 or len(events) == 0:
+        return pd.DataFrame(columns=RMM_COLUMNS)
+
+    event_keys, event_starts, event_ends = event_intervals.merge_intervals(event_intervals.from_frame(events))
+
+    # Both satellites of each conjunction probe the event ranges
+    sides = np.repeat([1, 2], len(windows))
+    norads = np.concatenate([windows['sat1_norad'].values, windows['sat2_norad'].values]).astype(np.int64)
+    others = np.concatenate([windows['sat2_norad'].values, windows['sat1_norad'].values]).astype(np.int64)
+    rows = np.tile(np.arange(len(windows)), 2)
+    first_extract = windows['first_extract'].values.astype('datetime64[ns]')[rows]
+    tca = windows['tca'].values.astype('datetime64[ns]')[rows]
+
+    probes, matches = interval_join(norads, first_extract, tca, event_keys, event_starts, event_ends)
+
+    rmm = windows[['group', 'sat_pair_id', 'num_extracts', 'max_prob', 'min_rng_km']].iloc[rows[probes]].reset_index(drop=True)
+    rmm['side'] = sides[probes]
+    rmm['NORAD_CAT_ID'] = norads[probes]
+    rmm['other_norad'] = others[probes]
+    rmm['first_extract'] = first_extract[probes]
+    rmm['tca'] = tca[probes]
+    rmm['start'] = event_starts[matches]
+    rmm['end'] = event_ends[matches]
+    rmm['lead_days'] = (rmm['tca'] - rmm['start']) / pd.Timedelta(days=1)
+
+    # Chance of an event range in a window of this length: Poisson rate of the satellite's ranges
+    period_days = (event_ends.max() - event_starts.min()) / np.timedelta64(1, 'D')
+    ranges_per_day = pd.Series(event_keys).value_counts() / max(period_days, 1)
+    window_days = (rmm['tca'] - rmm['first_extract']) / pd.Timedelta(days=1)
+    rmm['chance'] = 1 - np.exp(-ranges_per_day.reindex(rmm['NORAD_CAT_ID']).values * window_days.values)
+
+    prob_weight = np.clip((np.log10(rmm['max_prob'].astype(np.float64).clip(lower=1e-12)) + 8) / 6, 0, 1).fillna(0)
+    timing_weight = np.where(rmm['start'] + event_intervals.EVENT_PADDING >= rmm['first_extract'], 1, 0.5)
+    rmm['score'] = prob_weight * timing_weight * (1 - rmm['chance'])
+
+    rmm = rmm[rmm['score'] >= min_score]
+    order = np.lexsort((rmm['side'].values, rmm['group'].values, -rmm['score'].values))
+    return rmm[RMM_COLUMNS].iloc[order].reset_index(drop=True)
+
+
+socrates_files_path = '../../data/socrates/'
+events_path = '../../data/maneuver/events/combined.parquet'
+rmm_path = '../../data/maneuver/rmm.parquet'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Joins the SOCRATES conjunctions with the maneuver event ranges')
+    parser.add_argument('--socrates', default=socrates_files_path, help='socrates files directory')
+    parser.add_argument('--events', default=events_path, help='parquet file of the event ranges (NORAD_CAT_ID, start, end)')
+    parser.add_argument('--output', default=rmm_path)
+    parser.add_argument('--min-score', type=float, default=0)
+    args = parser.parse_args()
+
+    sys.path.append(join(dirname(abspath(__file__)), '../..'))
+    from pkg.orbital_congestion import socrates
+
+    start = time.time()
+    soc_df = socrates.get_socrates_cleaned_data(args.socrates, parallel=True)
+    rmm = correlate_rmm(soc_df, pd.read_parquet(args.events), args.min_score)
+    rmm.to_parquet(args.output, index=False)
+    print(f'{len(rmm)} candidate RMMs of {rmm["group"].nunique()} conjunctions in {time.time() - start:.1f} s')
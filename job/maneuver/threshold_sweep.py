@@ -0,0 +1,277 @@
+'''
+threshold_sweep
+---------------
+Sweeps the maneuver detection thresholds over many satellites.
+
+For a grid of detection functions x thresholds x satellites, each function is
+computed once per satellite chunk (maneuver_batch) and every threshold is then
+evaluated from the same values.  Chunks of satellites run across a process
+pool and the result is a tidy table, one row per satellite, function and
+threshold:
+
+    NORAD_CAT_ID, column, name, threshold, events, event_days,
+    labels, labels_detected, events_labeled
+
+labels / labels_detected / events_labeled compare the event ranges with labeled
+ground truth maneuvers (NORAD_CAT_ID, start, end): a label is detected when an
+event range overlaps it, and an event is labeled when it overlaps a label.
+summarize_sweep aggregates the table per function and threshold.
+
+GROUND_TRUTH_MANEUVERS holds the documented risk mitigation maneuvers (RMM) used
+in the report; labels for other satellites (e.g. AQUA) can be added with
+make_labels.
+'''
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import cpu_count
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import element_store
+import event_intervals
+import maneuver_batch
+
+
+def make_labels(maneuvers):
+    '''
+    Builds a labels table of ground truth maneuvers
+
+    Parameters:
+    -----------
+    maneuvers : list(tuple)
+        (NORAD_CAT_ID, day) for a maneuver known by its date (the whole day is labeled), or
+        (NORAD_CAT_ID, start, end)
+
+    Returns
+    -------
+    labels : Pandas Dataframe
+        NORAD_CAT_ID, start and end of each label
+    '''
+    rows = []
+    for m in maneuvers:
+        start = pd.Timestamp(m[1])
+        end = pd.Timestamp(m[2]) if len(m) > 2 else start + pd.Timedelta(days=1)
+        rows.append((int(m[0]), start, end))
+    return pd.DataFrame(rows, columns=['NORAD_CAT_ID', 'start', 'end'])
+
+# Documented RMMs: FERMI (GLAST) avoiding COSMOS 1805 and GCOM W1
+GROUND_TRUTH_MANEUVERS = make_labels([
+    (33053, '2012-04-03'),  # FERMI
+    (38337, '2017-05-30'),  # GCOM W1
+])
+
+
+def count_overlaps(ranges, others):
+    '''
+    For each range, whether it overlaps a range of others (same NORAD_CAT_ID)
+
+    Parameters:
+    -----------
+    ranges : Pandas Dataframe
+        NORAD_CAT_ID, start and end
+
+    others : Pandas Dataframe
+        NORAD_CAT_ID, start and end
+
+    Returns
+    -------
+    overlaps : array(bool)
+        Overlap flag of each row of ranges (same order)
+    '''
+    if len(ranges) == 0 or len(others) == 0:
+        return np.zeros(len(ranges), dtype=bool)
+
+    # Once merged, the ranges of others are disjoint and sorted, so only the last one that
+    # starts before a range ends can reach it
+    keys, starts, ends = event_intervals.merge_intervals(event_intervals.from_frame(others))
+    merged = pd.DataFrame({'NORAD_CAT_ID': keys.astype(np.int64), 'start': starts, 'other_end': ends})
+    probe = pd.DataFrame({'NORAD_CAT_ID': ranges['NORAD_CAT_ID'].values.astype(np.int64),
+                          'start': ranges['end'].values.astype('datetime64[ns]'),
+                          'range_start': ranges['start'].values.astype('datetime64[ns]'),
+                          'row': np.arange(len(ranges))})
+    joined = pd.merge_asof(probe.sort_values('start'), merged.sort_values('start'), on='start',
+                           by='NORAD_CAT_ID', direction='backward', allow_exact_matches=False)
+    overlaps = np.zeros(len(ranges), dtype=bool)
+    overlaps[joined['row'].values] = (joined['other_end'] > joined['range_start']).values
+    return overlaps
+
+
+def sweep_layout(layout, maneuver_functions, labels=None):
+    '''
+    Evaluates every threshold of every function over a batch layout
+
+    Parameters:
+    -----------
+    layout : BatchLayout
+        GP history of the satellites (strange data already removed)
+
+    maneuver_functions : dict
+        column -> list of (name, func, thresholds), the thresholds being the grid
+
+    labels : Pandas Dataframe
+        Ground truth maneuvers (NORAD_CAT_ID, start, end), None for no labels
+
+    Returns
+    -------
+    results : Pandas Dataframe
+        One row per satellite, function and threshold (see the module docstring)
+    '''
+    labels = labels if labels is not None else make_labels([])
+    labels = labels[labels['NORAD_CAT_ID'].isin(layout.sat_norads)]
+    num_labels = labels['NORAD_CAT_ID'].value_counts()
+
+    results = []
+    for col, funcs in maneuver_functions.items():
+        for name, func, thresholds in funcs:
+            # The detection values are computed once, every threshold is compared with them
+            maneuvers = np.abs(layout.apply(col, func))
+            with np.errstate(invalid='ignore'):
+                exceeded = maneuvers[:, None] > np.asarray(thresholds, dtype=np.float64)[None, :]
+
+            for k, threshold in enumerate(thresholds):
+                ranges = maneuver_batch.find_event_ranges(layout.norads, layout.epochs, exceeded[:, k])
+                ranges['days'] = (ranges['end'] - ranges['start']) / pd.Timedelta(days=1)
+                ranges['labeled'] = count_overlaps(ranges, labels)
+                detected = labels[count_overlaps(labels, ranges)]['NORAD_CAT_ID'].value_counts()
+
+                by_sat = ranges.groupby('NORAD_CAT_ID').agg(events=('start', 'size'), event_days=('days', 'sum'),
+                                                             events_labeled=('labeled', 'sum'))
+                df = pd.DataFrame({'NORAD_CAT_ID': layout.sat_norads, 'column': col, 'name': name, 'threshold': threshold})
+                df['events'] = by_sat['events'].reindex(layout.sat_norads, fill_value=0).values
+                df['event_days'] = by_sat['event_days'].reindex(layout.sat_norads, fill_value=0).values
+                df['labels'] = num_labels.reindex(layout.sat_norads, fill_value=0).values
+                df['labels_detected'] = detected.reindex(layout.sat_norads, fill_value=0).values
+                df['events_labeled'] = by_sat['events_labeled'].reindex(layout.sat_norads, fill_value=0).values
+                results.append(df)
+    return pd.concat(results, ignore_index=True)
+
+
+def sweep_satellites(store, norads, maneuver_functions, labels=None):
+    '''
+    Sweeps the thresholds of a chunk of satellites of an element store
+
+    Parameters:
+    -----------
+    store : ElementStore
+        GP history
+
+    norads : list(int)
+        Satellites of the chunk
+
+    maneuver_functions : dict
+        column -> list of (name, func, thresholds), the thresholds being the grid
+
+    labels : Pandas Dataframe
+        Ground truth maneuvers (NORAD_CAT_ID, start, end), None for no labels
+
+    Returns
+    -------
+    results : Pandas Dataframe
+        One row per satellite, function and threshold
+    '''
+    df = pd.concat([store.view(norad).get_frame() for norad in norads])
+    layout = maneuver_batch.BatchLayout(df, list(element_store.ELEMENT_SCALES.keys()))
+    kept, removed = maneuver_batch.find_strange_data(layout)
+    return sweep_layout(layout.take(kept), maneuver_functions, labels)
+
+
+_worker_args = None
+
+def _init_worker(store, maneuver_functions, labels):
+    global _worker_args
+    if isinstance(store, str):
+        store = element_store.load_element_store(store)
+    _worker_args = (store, maneuver_functions, labels)
+
+def _sweep_worker(norads):
+    store, maneuver_functions, labels = _worker_args
+    return sweep_satellites(store, norads, maneuver_functions, labels)
+
+
+def sweep_thresholds(store, norads, maneuver_functions, labels=GROUND_TRUTH_MANEUVERS, processes=None, chunk_size=100):
+    '''
+    Sweeps the detection thresholds of many satellites across a process pool
+
+    Parameters:
+    -----------
+    store : ElementStore or str
+        GP history, or the path of a saved element store (each worker memory maps it)
+
+    norads : list(int)
+        Satellites to sweep (the ones that are not in the store are skipped)
+
+    maneuver_functions : dict
+        column -> list of (name, func, thresholds), the thresholds being the grid.  With the
+        fork start method (Linux) the functions can be lambdas, otherwise they have to be
+        module level functions
+
+    labels : Pandas Dataframe
+        Ground truth maneuvers (NORAD_CAT_ID, start, end), None for no labels
+
+    processes : int
+        Number of processes (defaults to the cpu count, 1 runs in this process)
+
+    chunk_size : int
+        Satellites per task
+
+    Returns
+    -------
+    results : Pandas Dataframe
+        One row per satellite, function and threshold (see the module docstring)
+    '''
+    lookup = element_store.load_element_store(store) if isinstance(store, str) else store
+    norads = [norad for norad in norads if norad in lookup]
+    chunks = [norads[i:i + chunk_size] for i in range(0, len(norads), chunk_size)]
+    print(f'Sweeping {len(norads)} satellites in {len(chunks)} chunks...')
+
+    start = time.time()
+    processes = processes or cpu_count() or 1
+    results = []
+    if processes == 1:
+        for chunk in tqdm(chunks):
+            results.append(sweep_satellites(lookup, chunk, maneuver_functions, labels))
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                 initializer=_init_worker, initargs=(store, maneuver_functions, labels)) as executor:
+            futures = [executor.submit(_sweep_worker, chunk) for chunk in chunks]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                results.append(future.result())
+    print(f'Swept in {time.time() - start:.1f} s')
+
+    if len(results) == 0:
+        return pd.DataFrame()
+    return pd.concat(results, ignore_index=True).sort_values(['column', 'name', 'threshold', 'NORAD_CAT_ID'],
+                                                             kind='mergesort').reset_index(drop=True)
+
+
+def summarize_sweep(results):
+    '''
+    Aggregates a sweep per function and threshold
+
+    Parameters:
+    -----------
+    results : Pandas Dataframe
+        Output of sweep_thresholds
+
+    Returns
+    -------
+    summary : Pandas Dataframe
+        column, name, threshold, satellites, events, events_per_sat, event_days, labels,
+        labels_detected, recall (labels detected / labels) and labeled_share (events labeled / events)
+    '''
+    summary = results.groupby(['column', 'name', 'threshold']).agg(satellites=('NORAD_CAT_ID', 'nunique'),
+                                                                    events=('events', 'sum'),
+                                                                    event_days=('event_days', 'sum'),
+                                                                    labels=('labels', 'sum'),
+                                                                    labels_detected=('labels_detected', 'sum'),
+                                                                    events_labeled=('events_labeled', 'sum')).reset_index()
+    summary['events_per_sat'] = summary['events'] / summary['satellites']
+    summary['recall'] = summary['labels_detected'] / summary['labels'].where(summary['labels'] > 0)
+    summary['labeled_share'] = summary['events_labeled'] / summary['events'].where(summary['events'] > 0)
+    return summary
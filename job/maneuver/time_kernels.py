@@ -0,0 +1,157 @@
+'''
+time_kernels
+------------
+Time based maneuver detection functions.
+
+The TLE interval of a satellite goes from a couple of hours to months, so the
+row based .diff() / .rolling() functions of find_maneuvers do not measure the
+same thing from one satellite (or one year) to the next, and TLEs repeated with
+the same epoch shorten their windows.  These kernels work on the epochs
+instead:
+
+    RatePerDay()              - change per day since the previous TLE
+    TimeNeighborDiff(days)    - mean over [t, t + days) minus mean over (t - days, t]
+
+Each kernel is one vectorized pass over sorted epoch arrays (binary searches
+and cumulative sums).  TLEs with a duplicate epoch are dropped (the last one
+is kept) with a mask, and get a NaN value.
+
+The kernels are callables that fit the maneuver_functions dict
+(col -> [(name, func, thresholds)]): called with a Series indexed by EPOCH
+they return a Series, and BatchLayout.apply runs them over every satellite at
+once with apply_segmented.
+
+    maneuver_functions = {
+        'SEMIMAJOR_AXIS': [("rate_per_day", RatePerDay(), [0.05]),
+                           ("3_day_neighbor_diff", TimeNeighborDiff(3), [0.025])],
+    }
+'''
+
+import numpy as np
+import pandas as pd
+
+NS_PER_DAY = 86400 * 10 ** 9
+
+
+class TimeKernel():
+    '''
+    Base of the time based detection functions (kernel() does the work)
+    '''
+
+    def __call__(self, x):
+        '''
+        Runs the kernel over a Series indexed by EPOCH (one satellite)
+        '''
+        epochs = x.index.values.astype('datetime64[ns]')
+        order = np.argsort(epochs, kind='mergesort')
+        result = np.empty(len(x))
+        result[order] = self.apply_segmented(np.array([0, len(x)]), epochs[order], x.values.astype(np.float64)[order])
+        return pd.Series(result, index=x.index)
+
+    def apply_segmented(self, offsets, epochs, values):
+        '''
+        Runs the kernel over many satellites at once
+
+        Parameters:
+        -----------
+        offsets : array
+            First row of each satellite (and the number of rows at the end)
+
+        epochs : array
+            Epoch of each row (datetime64, sorted within each satellite)
+
+        values : array
+            Value of each row
+
+        Returns
+        -------
+        result : array
+            Kernel value of each row, NaN for the dropped duplicate epochs
+        '''
+        epochs = np.asarray(epochs).astype('datetime64[ns]').astype(np.int64)
+        segment = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+        # Drop the duplicate epochs, keeping the last row
+        keep = np.ones(len(epochs), dtype=bool)
+        keep[:-1] = (segment[1:] != segment[:-1]) | (epochs[1:] != epochs[:-1])
+
+        result = np.full(len(epochs), np.nan)
+        if keep.any():
+            result[keep] = self.kernel(segment[keep], epochs[keep], np.asarray(values, dtype=np.float64)[keep])
+        return result
+
+    def kernel(self, segment, epochs, values):
+        '''
+        Kernel values of de-duplicated rows (segment ids, epochs in ns, values)
+        '''
+        raise NotImplementedError
+
+
+class RatePerDay(TimeKernel):
+    '''
+    Change per day since the previous TLE of the satellite
+    '''
+
+    def kernel(self, segment, epochs, values):
+        result = np.full(len(values), np.nan)
+        same = segment[1:] == segment[:-1]
+        days = (epochs[1:] - epochs[:-1]) / NS_PER_DAY
+        result[1:][same] = (values[1:] - values[:-1])[same] / days[same]
+        return result
+
+
+class TimeNeighborDiff(TimeKernel):
+    '''
+    Time window version of the rolling_k_neighbor_diff functions: mean of the TLEs in
+    [t, t + days) minus the mean of the TLEs in (t - days, t]
+    '''
+
+    days = None
+    min_periods = None
+
+    def __init__(self, days, min_periods=1):
+        '''
+        Initialize
+
+        Parameters:
+        -----------
+        days : float
+            Window length in days
+
+        min_periods : int
+            Fewest TLEs in each window, NaN otherwise
+        '''
+        self.days = days
+        self.min_periods = min_periods
+
+    def kernel(self, segment, epochs, values):
+        keys = _segment_keys(segment, epochs)
+        window = int(round(self.days * 86400 * 10 ** 3))
+
+        # Sums relative to the first value of each satellite (keeps the cumulative sums small)
+        starts = np.flatnonzero(np.append(True, segment[1:] != segment[:-1]))
+        relative = values - np.repeat(values[starts], np.diff(np.append(starts, len(values))))
+        sums = np.concatenate([[0], np.cumsum(relative)])
+
+        behind = np.searchsorted(keys, keys - window, side='right')
+        ahead = np.searchsorted(keys, keys + window, side='left')
+        here = np.arange(len(keys))
+        count_behind = here + 1 - behind
+        count_ahead = ahead - here
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_behind = (sums[here + 1] - sums[behind]) / count_behind
+            mean_ahead = (sums[ahead] - sums[here]) / count_ahead
+        result = mean_ahead - mean_behind
+        result[(count_behind < self.min_periods) | (count_ahead < self.min_periods)] = np.nan
+        return result
+
+
+def _segment_keys(segment, epochs):
+    '''
+    Sort keys of (satellite, epoch) in a single int64: milliseconds since the first epoch of the
+    satellite, each satellite 2^42 ms (~139 years) above the previous one
+    '''
+    starts = np.flatnonzero(np.append(True, segment[1:] != segment[:-1]))
+    first = np.repeat(epochs[starts], np.diff(np.append(starts, len(epochs))))
+    return segment.astype(np.int64) * (1 << 42) + (epochs - first) // 10 ** 6
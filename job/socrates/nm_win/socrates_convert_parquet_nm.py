@@ -0,0 +1,98 @@
+'''
+socrates_convert_parquet_nm
+---------------------------
+Converts the SOCRATES snapshot csv files to the parquet format (typed, compressed
+columns that load without parsing any dates).
+
+Each converted file is read back and compared with the csv file before the csv
+file is (optionally) removed.  Snapshots that are already in parquet are skipped.
+
+    python socrates_convert_parquet_nm.py
+    python socrates_convert_parquet_nm.py --remove-csv
+'''
+
+import argparse
+import numpy as np
+import pandas as pd
+from os import remove
+from os.path import abspath, dirname, getsize, join
+
+from tqdm import tqdm
+
+import sys
+sys.path.append(join(dirname(abspath(__file__)), '../../..'))
+from pkg.orbital_congestion import socrates
+
+def convert_socrates_file(csv_path, parquet_path):
+    '''
+    Writes a socrates csv file as parquet and checks the parquet file holds the same data
+
+    Parameters:
+    -----------
+    csv_path : str
+        Relative file path of the csv file
+
+    parquet_path : str
+        Relative file path of the parquet file
+
+    Returns
+    -------
+    ok : bool
+        True when both files hold the same data (metrics within float32 precision)
+    '''
+    # The parquet files hold one row per conjunction, like the snapshots the scraper writes now
+    df = socrates._read_socrates_file(csv_path, dedup=True)
+    socrates.write_socrates_parquet(df, parquet_path)
+
+    check_df = socrates._read_socrates_file(parquet_path)
+    df = df.reset_index(drop=True)
+    for col in df.columns:
+        if col in socrates.SOCRATES_METRIC_COLUMNS:
+            same = np.allclose(df[col].values, check_df[col].values.astype(np.float64), rtol=1e-6, equal_nan=True)
+        else:
+            same = (df[col].astype(object).values == check_df[col].astype(object).values).all()
+        if not same:
+            print(f'{parquet_path}: column {col} does not match the csv file')
+            return False
+    return True
+
+def convert_socrates_files(path, remove_csv=False):
+    '''
+    Converts every socrates csv file that has no parquet file yet
+
+    Parameters:
+    -----------
+    path : str
+        Relative file path of socrates files
+
+    remove_csv : bool
+        Remove each csv file once its parquet file is checked
+    '''
+    files = [file for file,date in socrates.list_socrates_files(path) if not file.endswith('.parquet')]
+    print(f'Converting {len(files)} socrates files...')
+
+    csv_size, parquet_size, failed = 0, 0, []
+    for file in tqdm(files):
+        parquet_file = file.split('.')[0] + '.parquet'
+        if not convert_socrates_file(join(path, file), join(path, parquet_file)):
+            failed.append(file)
+            remove(join(path, parquet_file))
+            continue
+        csv_size += getsize(join(path, file))
+        parquet_size += getsize(join(path, parquet_file))
+        if remove_csv:
+            remove(join(path, file))
+
+    print(f'Converted {len(files) - len(failed)} files: {csv_size / 1e6:.1f} MB of csv to {parquet_size / 1e6:.1f} MB of parquet')
+    if len(failed) > 0:
+        print(f'{len(failed)} files were not converted: {failed}')
+
+
+socrates_files_path = '../../../data/socrates/'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=socrates_files_path)
+    parser.add_argument('--remove-csv', action='store_true', help='remove each csv file once it is converted')
+    args = parser.parse_args()
+    convert_socrates_files(args.path, args.remove_csv)
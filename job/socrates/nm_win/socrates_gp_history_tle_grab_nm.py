@@ -19,8 +19,9 @@ Date   21 Dec 2020
 '''
 
 import pandas as pd
+import numpy as np
 from os import listdir, remove
-from os.path import isfile, join
+from os.path import abspath, dirname, isfile, join
 import re
 
 import spacetrack.operators as op
@@ -29,9 +30,146 @@ from datetime import datetime, timedelta
 
 from tqdm import tqdm
 
-from orbital_congestion import socrates
+import sys
+sys.path.append(join(dirname(abspath(__file__)), '../../..'))
+from pkg.orbital_congestion import socrates, socrates_tle
+from pkg.orbital_congestion.socrates_store import SocratesStore
+from pkg.orbital_congestion.gp_history import GpHistoryIndex, nearest_positions
+from pkg.orbital_congestion.gp_archive import GpHistoryArchive, EPOCH_FORMAT
+from pkg.orbital_congestion.spacetrack_fetch import GpHistoryFetcher, build_fetch_requests
+from pkg.orbital_congestion.gp_history_plan import compare_plans, describe_plan, plan_adaptive_bins, plan_qcut_bins
 
-def grab_gp_history_data(socrates_files_path, tle_file_path, spacetrack_key_file='./spacetrack_pwd.key'):
+def merge_new_tle_data(tle_df, new_tle_df, tolerance=pd.Timedelta('5 min')):
+    '''
+    Updates the TLEs of the socrates entries with the TLEs grabbed from Space Track.
+    Both the sat1 and sat2 sides are matched in one sorted join: on norad and the
+    nearest last_epoch within the tolerance.
+
+    Parameters:
+    -----------
+    tle_df : Pandas Dataframe
+        Socrates data with TLE data (from socrates.get_socrates_with_tle_data), updated in place
+
+    new_tle_df : Pandas Dataframe
+        TLEs from Space Track with norad, last_epoch, tle_line1, tle_line2 and tle_epoch
+
+    tolerance : Timedelta
+        Largest difference between the socrates last epoch and the requested last epoch
+
+    Returns
+    -------
+    count : int
+        Number of sat1/sat2 TLEs updated
+
+    unmatched_df : Pandas Dataframe
+        Rows of new_tle_df that did not match any socrates entry
+    '''
+    new_tle_df = new_tle_df.reset_index(drop=True)
+    new_tle_df = new_tle_df.assign(norad=new_tle_df['norad'].astype(np.int64),
+                                   last_epoch=new_tle_df['last_epoch'].astype('datetime64[ns]'),
+                                   tle=new_tle_df['tle_line1'] + ',' + new_tle_df['tle_line2'],
+                                   new_row=np.arange(len(new_tle_df)))
+
+    # Stack the sat1 and sat2 sides so they are matched together
+    sides = pd.concat([pd.DataFrame({'side': sat, 'row': tle_df.index,
+                                     'norad': tle_df[sat + '_norad'].astype(np.int64).values,
+                                     'last_epoch': tle_df[sat + '_last_epoch'].astype('datetime64[ns]').values}) for sat in ['sat1', 'sat2']], ignore_index=True)
+    sides = sides.dropna(subset=['last_epoch']).sort_values('last_epoch')
+
+    matched = pd.merge_asof(sides, new_tle_df[['norad','last_epoch','tle','tle_epoch','new_row']].sort_values('last_epoch'),
+                            on='last_epoch', by='norad', tolerance=tolerance, direction='nearest')
+    matched = matched.dropna(subset=['new_row'])
+
+    for sat in ['sat1', 'sat2']:
+        m = matched[matched['side'] == sat]
+        for col in ['tle', 'tle_epoch']:
+            tle_df[sat + '_' + col] = tle_df[sat + '_' + col].astype(object)
+            tle_df.loc[m['row'].values, sat + '_' + col] = m[col].values
+
+    # A TLE record is unmatched when no socrates entry is within the tolerance (duplicate
+    # records of the same norad/epoch lose the nearest match above but are still found here)
+    found = pd.merge_asof(new_tle_df[['norad','last_epoch','new_row']].sort_values('last_epoch'), sides[['norad','last_epoch','row']],
+                          on='last_epoch', by='norad', tolerance=tolerance, direction='nearest')
+    unmatched_df = new_tle_df[new_tle_df['new_row'].isin(found.loc[found['row'].isnull(), 'new_row'])]
+    return len(matched), unmatched_df.drop(columns=['tle', 'new_row'])
+
+def save_bin_tle_data(bin_df, gp_records, tmp_tle_file, tolerance=pd.Timedelta('5 min')):
+    '''
+    Finds the TLE of each missing entry of a bin in the gp_history response and
+    appends them to the temporary TLE file (in a single write)
+
+    Parameters:
+    -----------
+    bin_df : Pandas Dataframe
+        Missing TLE entries (norad, last_epoch) of the bin
+
+    gp_records : list(dict)
+        Response of SpaceTrackClient.gp_history for the bin
+
+    tmp_tle_file : str
+        Relative file path of the temporary TLE file
+
+    tolerance : Timedelta
+        Largest difference between the requested and returned epochs
+
+    Returns
+    -------
+    not_found_df : Pandas Dataframe
+        Entries of bin_df without a TLE in the response
+    '''
+    # All the entries of the bin are searched at once
+    index = GpHistoryIndex(gp_records)
+    positions = nearest_positions(index.epochs, index.norad_ranges, bin_df['norad'].values, bin_df['last_epoch'].values, tolerance)
+    found = positions >= 0
+
+    lines = [','.join([str(norad), last_epoch.strftime('%Y%m%d%H%M%S%f'), d['TLE_LINE1'], d['TLE_LINE2'], d['EPOCH']]) + '\n'
+             for norad, last_epoch, d in zip(bin_df.loc[found, 'norad'], bin_df.loc[found, 'last_epoch'],
+                                             [index.records[p] for p in positions[found]])]
+    with open(tmp_tle_file, 'a') as f:
+        f.write(''.join(lines))
+
+    return bin_df[~found]
+
+def save_archive_tle_data(miss_tle_df, archive, tmp_tle_file, tolerance=pd.Timedelta('5 min')):
+    '''
+    Finds the TLE of the missing entries in the local gp_history archive and appends
+    them to the temporary TLE file
+
+    Parameters:
+    -----------
+    miss_tle_df : Pandas Dataframe
+        Missing TLE entries (norad, last_epoch)
+
+    archive : GpHistoryArchive
+        Local archive of the gp_history records
+
+    tmp_tle_file : str
+        Relative file path of the temporary TLE file, None only finds the entries
+
+    tolerance : Timedelta
+        Largest difference between the requested and archived epochs
+
+    Returns
+    -------
+    not_found_df : Pandas Dataframe
+        Entries of miss_tle_df without a TLE in the archive
+    '''
+    found_df = archive.nearest(miss_tle_df['norad'], miss_tle_df['last_epoch'], tolerance)
+    found = found_df['EPOCH'].notnull().values
+    if tmp_tle_file is None:
+        return miss_tle_df[~found]
+
+    lines = [','.join([str(norad), last_epoch.strftime('%Y%m%d%H%M%S%f'), line1, line2, epoch.strftime(EPOCH_FORMAT)]) + '\n'
+             for norad, last_epoch, line1, line2, epoch in zip(miss_tle_df.loc[found, 'norad'], miss_tle_df.loc[found, 'last_epoch'],
+                                                               found_df.loc[found, 'TLE_LINE1'], found_df.loc[found, 'TLE_LINE2'], found_df.loc[found, 'EPOCH'])]
+    with open(tmp_tle_file, 'a') as f:
+        f.write(''.join(lines))
+
+    return miss_tle_df[~found]
+
+def grab_gp_history_data(socrates_files_path, tle_file_path, spacetrack_key_file='./spacetrack_pwd.key', socrates_store_path=None, gp_archive_path=None,
+                         requests_per_minute=20, requests_per_hour=300, max_workers=4, max_norads=100, max_span=timedelta(days=2), dry_run=False,
+                         maneuver_state_path=None):
     '''
     Determines which TLE data is missing and grabs it from Space Track
 
@@ -46,6 +184,36 @@ def grab_gp_history_data(socrates_files_path, tle_file_path, spacetrack_key_file
     spacetrack_key_file : str
         Relative file path of login credentials for spacetrack.
         File format: email,password
+
+    socrates_store_path : str
+        Relative path of the incremental socrates store (only new socrates files are read).
+        None rebuilds from all the socrates files
+
+    gp_archive_path : str
+        Relative path of the local gp_history archive.  Missing TLEs are looked up there first and every
+        Space Track response is added to it.  None always goes to Space Track
+
+    requests_per_minute : float
+        Space Track request budget per minute (Space Track allows 30 per minute)
+
+    requests_per_hour : int
+        Space Track request budget per hour (Space Track allows 300 per hour)
+
+    max_workers : int
+        Number of Space Track requests in flight at the same time
+
+    max_norads : int
+        Most norads in a single Space Track request
+
+    max_span : timedelta
+        Largest epoch range of a single Space Track request
+
+    dry_run : bool
+        Only prints the planned requests (adaptive vs the old fixed size bins) without logging in to Space Track
+
+    maneuver_state_path : str
+        Relative path of the online maneuver detector state (job/maneuver/maneuver_online.py), updated with
+        the new archive records at the end.  None skips the maneuver update (needs gp_archive_path)
     
     Returns
     -------
@@ -53,14 +221,12 @@ def grab_gp_history_data(socrates_files_path, tle_file_path, spacetrack_key_file
     '''
 
     print('Building socrates dataframe...')
-    soc_df, tle_df = socrates.get_all_socrates_and_tle_data(socrates_files_path, tle_file_path)
+    store = SocratesStore(socrates_store_path) if socrates_store_path is not None else None
+    soc_df, tle_df = socrates.get_all_socrates_and_tle_data(socrates_files_path, tle_file_path, store=store)
     print('Complete')
 
-    # Get space track login data
-    spacetrack_usr, spacetrack_pwd = open(spacetrack_key_file).read()[:-1].split(',')
-    st = SpaceTrackClient(identity=spacetrack_usr, password=spacetrack_pwd)
-
     tmp_tle_file = './tle2.csv'
+    checkpoint_file = './tle2.checkpoint'
 
     # Create a new df of the socrates entries with missing TLE data
     mtle_df1 = tle_df[tle_df['sat1_tle'].isnull()][['sat1_norad','sat1_last_epoch']].rename(columns={'sat1_norad':'norad','sat1_last_epoch':'last_epoch'})
@@ -68,76 +234,98 @@ def grab_gp_history_data(socrates_files_path, tle_file_path, spacetrack_key_file
     miss_tle_df = pd.concat([mtle_df1, mtle_df2])
     miss_tle_df = miss_tle_df.sort_values('last_epoch')
 
-    # Split the missing TLE dataset into bins
-    bin_size = 100
-    num_bins = round(len(miss_tle_df) / bin_size + 0.49999)
-    miss_tle_df['bin'] = pd.qcut(miss_tle_df['last_epoch'], num_bins, labels=list(range(num_bins)))
+    # Use the TLEs we already fetched before going to Space Track
+    archive = GpHistoryArchive(gp_archive_path) if gp_archive_path is not None else None
+    if archive is not None:
+        num_missing = len(miss_tle_df)
+        miss_tle_df = save_archive_tle_data(miss_tle_df, archive, tmp_tle_file if not dry_run else None)
+        print(f'Found {num_missing - len(miss_tle_df)} of the {num_missing} missing TLE entries in the local archive ({len(archive)} records)')
+
+    # Split the missing TLE dataset into bins, bounding the norads and epoch span of each request
+    # so sparse missing entries do not turn into requests covering weeks of TLEs
+    miss_tle_df = miss_tle_df.assign(bin=plan_adaptive_bins(miss_tle_df, max_norads=max_norads, max_span=max_span))
+    num_bins = miss_tle_df['bin'].nunique()
     print(f'There are {len(miss_tle_df)} missing TLE entries.  We will make {num_bins} requests for this data.')
+
+    if dry_run:
+        print(compare_plans(miss_tle_df, {'fixed size': plan_qcut_bins(miss_tle_df), 'adaptive': miss_tle_df['bin']}).to_string())
+        print(describe_plan(miss_tle_df, miss_tle_df['bin']).to_string())
+        return None
+
+    # Get space track login data
+    spacetrack_usr, spacetrack_pwd = open(spacetrack_key_file).read()[:-1].split(',')
+    st = SpaceTrackClient(identity=spacetrack_usr, password=spacetrack_pwd)
+    st.authenticate()
+
     print('Getting missing TLE data from Space Track...')
 
-    # For each bin - make a request to SpaceTrack for all norads within that bin with a min/max daterange
-    # This will save the data to a CSV file we will parse next (we save to ensure an interrupted progress
-    # does not result in a massive amount of lost data)
-    count = 0
-    for b in tqdm(range(num_bins)):
-        tmp_df = miss_tle_df[miss_tle_df['bin'] == b]
-        min_epoch = tmp_df['last_epoch'].min().to_pydatetime()
-        max_epoch = tmp_df['last_epoch'].max().to_pydatetime()
-        epoch_range = op.inclusive_range(min_epoch - timedelta(minutes=5), max_epoch + timedelta(minutes=5))
-        all_norads = list(tmp_df['norad'].unique())
-        all_data = st.gp_history(norad_cat_id = all_norads, epoch=epoch_range)
-
-        # Write the data to a file
-        for idx, row in tmp_df.iterrows():
-            d = list(filter(lambda rec: (rec['NORAD_CAT_ID']==str(row['norad'])) & (abs(pd.to_datetime(rec['EPOCH'], format='%Y-%m-%dT%H:%M:%S.%f') - row['last_epoch']) < pd.Timedelta('5 min')), all_data))[0]
-            with open(tmp_tle_file, 'a') as f:
-                    s = ','.join([str(row['norad']), row['last_epoch'].strftime('%Y%m%d%H%M%S%f'), d['TLE_LINE1'], d['TLE_LINE2'], d['EPOCH']]) 
-                    f.write(s + '\n')
+    # Make a request to SpaceTrack for all norads within each bin with a min/max daterange (several at a
+    # time within the rate limit).  Each result is saved to a CSV file we will parse next and its bin is
+    # added to the checkpoint (we save to ensure an interrupted progress does not result in a massive
+    # amount of lost data - a restart skips the bins in the checkpoint)
+    requests = build_fetch_requests(miss_tle_df)
+    fetcher = GpHistoryFetcher(st, requests_per_minute=requests_per_minute, requests_per_hour=requests_per_hour,
+                               max_workers=max_workers, checkpoint_path=checkpoint_file)
+    progress = tqdm(total=len(requests))
+
+    def save_result(request, records):
+        if archive is not None:
+            archive.append(records)
+        not_found_df = save_bin_tle_data(miss_tle_df[miss_tle_df['bin'] == request['bin']], records, tmp_tle_file)
+        if len(not_found_df) > 0:
+            print(f'Space Track did not return {len(not_found_df)} of the TLEs of bin {request["bin"]}')
+        progress.update(1)
+
+    failed = fetcher.fetch(requests, save_result)
+    progress.close()
+    if len(failed) > 0:
+        print(f'{len(failed)} requests failed - run the job again to retry them:')
+        for request in failed:
+            print(f'  bin {request["bin"]} ({request["key"]}): {request["error"]}')
 
     # Open the file created above which contains our new TLE data from SpaceTrack
     new_tle_df = pd.read_csv(tmp_tle_file, names = ['norad','last_epoch', 'tle_line1', 'tle_line2', 'tle_epoch'])
     new_tle_df['last_epoch'] = pd.to_datetime(new_tle_df['last_epoch'], format='%Y%m%d%H%M%S%f')
     print(f'Space Track grabs are complete.')
 
-    # For each TLE record, find the corresponding socrates data and update their TLE
+    # Match the TLE records back to the socrates data and update their TLE
     print(f'Merging {len(new_tle_df)} records with our socrates data...')
-    count = 0
-    all_success = True
-    for index, row in tqdm(new_tle_df.iterrows()):
-        found = False
-        target = tle_df[(tle_df['sat1_norad'] == row['norad']) & (abs(tle_df['sat1_last_epoch']-row['last_epoch']) < pd.Timedelta('5 min'))].index
-        if len(target) > 0:
-            found = True
-            tle_df.at[target,'sat1_tle'] = row['tle_line1'] + ',' + row['tle_line2']
-            tle_df.at[target,'sat1_tle_epoch'] = row['tle_epoch']
-            count += 1
-        target = tle_df[(tle_df['sat2_norad'] == row['norad']) & (abs(tle_df['sat2_last_epoch']-row['last_epoch']) < pd.Timedelta('5 min'))].index
-        if len(target) > 0:
-            found = True
-            tle_df.at[target,'sat2_tle'] = row['tle_line1'] + ',' + row['tle_line2']
-            tle_df.at[target,'sat2_tle_epoch'] = row['tle_epoch']
-            count += 1
-        if not found:
-            print(f'Cant find norad={row["norad"]} for date {row["last_epoch"]} - perhaps we have an updated socrates file?')
-            all_success = False
+    count, unmatched_df = merge_new_tle_data(tle_df, new_tle_df)
+    all_success = len(unmatched_df) == 0
     print(f'Finished merging {count} records')
+    if not all_success:
+        print(f'Cant find {len(unmatched_df)} norad/date records - perhaps we have an updated socrates file?')
+        print(unmatched_df.to_string())
 
     # Save the TLE data to a pickle file
     print(f'Saving results...')
     tle_df[['sat_pair','tca_time','sat1_norad','sat2_norad','sat1_tle','sat1_tle_epoch','sat2_tle','sat2_tle_epoch']].to_pickle(tle_file_path, 'gzip')
     print(f'Save to {tle_file_path} complete')
+    side_table_path = socrates_tle.build_tle_side_table(tle_file_path)
+    print(f'Rebuilt side table {side_table_path}')
 
-    if all_success:
-        remove(tmp_tle_file)
-        print(f'Removed temporary file')
+    if all_success and len(failed) == 0:
+        for file in [tmp_tle_file, checkpoint_file]:
+            if isfile(file):
+                remove(file)
+        print(f'Removed temporary files')
     else:
         print('******************************* WARNING *******************************')
-        print(f'Please check messages and remove {tmp_tle_file} if everything was okay.')
+        print(f'Please check messages and remove {tmp_tle_file} and {checkpoint_file} if everything was okay.')
+
+    # The new TLEs extend the maneuver events of their satellites
+    if archive is not None and maneuver_state_path is not None:
+        sys.path.append(join(dirname(abspath(__file__)), '../../maneuver'))
+        import maneuver_online
+        maneuver_online.update_from_archive(archive, maneuver_state_path)
 
     return None
 
 
 socrates_files_path = '../../../data/socrates/'
 tle_file_path = '../../../data/space-track-gp-history/gp_history_socrates_tca_tles.pkl.gz'
+socrates_store_path = '../../../data/socrates_store/'
+gp_archive_path = '../../../data/gp_history_archive/'
 
-grab_gp_history_data(socrates_files_path, tle_file_path)
+if __name__ == '__main__':
+    grab_gp_history_data(socrates_files_path, tle_file_path, socrates_store_path=socrates_store_path, gp_archive_path=gp_archive_path)
@@ -12,16 +12,25 @@ Date   9 Dec 2020
 '''
 
 import pandas as pd
+import argparse
+import asyncio
+import random
 import requests
 import urllib.request
 import time
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 from datetime import timedelta
 from os import listdir
-from os.path import isfile, join
+from os.path import abspath, dirname, isfile, join
 import re
 
+import sys
+sys.path.append(join(dirname(abspath(__file__)), '../../..'))
+from pkg.orbital_congestion import socrates, socrates_page
+from pkg.orbital_congestion.socrates_store import SocratesStore, acquire_lock
+
 def get_last_save_date(path):
     '''
     Get the date on the most recent file
@@ -40,21 +49,168 @@ def get_last_save_date(path):
         Contains the most recent date
     '''
     
-    files = [ (match[0],match[1]) for f in listdir(path) if isfile(join(path, f))  if (match:=re.search('^socrates_([0-9]{14})\.csv(\.gz)?$', f))]
+    files = socrates.list_socrates_files(path)
     try:
         file,date = sorted(files, reverse=True)[0]
         return file, datetime.strptime(date, '%Y%m%d%H%M%S')
     except:
         return '', datetime.min
 
-def scrape_socrates(num_of_records, min_hours, data_file_path, sort_list):
+SOCRATES_URL = 'https://celestrak.com/SOCRATES/'
+
+def get_search_url(base_url, sort, num_of_records):
+    '''
+    Returns the SOCRATES search results url of a sort order
+    '''
+    return base_url + 'search-results.php?IDENT=NAME&NAME_TEXT1=&NAME_TEXT2=&CATNR_TEXT1=&CATNR_TEXT2=&ORDER=' + sort + '&MAX=' + str(num_of_records) + '&B1=Submit'
+
+def fetch_pages(urls, max_connections=None, timeout=300):
+    '''
+    Downloads the pages concurrently over a pooled session (keep-alive connections are reused)
+
+    Parameters:
+    -----------
+    urls : list(str)
+        Pages to download
+
+    max_connections : int
+        Most requests in flight at the same time, None for one per url
+
+    timeout : float
+        Seconds to wait for each response
+
+    Returns
+    -------
+    pages : list(str)
+        Text of each page, in the order of urls
+    '''
+    max_connections = max_connections or len(urls)
+
+    async def fetch_all():
+        loop = asyncio.get_running_loop()
+        with requests.Session() as session, ThreadPoolExecutor(max_workers=max_connections) as executor:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            return await asyncio.gather(*[loop.run_in_executor(executor, lambda url=url: session.get(url, timeout=timeout).text) for url in urls])
+
+    return asyncio.run(fetch_all())
+
+def download_socrates_data(num_of_records, sort_list, base_url=SOCRATES_URL, concurrent=True):
+    '''
+    Downloads and parses the SOCRATES search results of each sort order
+
+    Parameters:
+    -----------
+    num_of_records : int
+        Number of records to request from SOCRATES (per sort order)
+
+    sort_list : list(str)
+        Each sort order to download
+
+    base_url : str
+        SOCRATES site (a local server can stand in for it, see benchmarks/bench_socrates_scraper.py)
+
+    concurrent : bool
+        Download all the sort orders at the same time, otherwise one after the other
+
+    Returns
+    -------
+    concat_df : Pandas Dataframe
+        One row per conjunction of the snapshot
+
+    extract_date : datetime
+        When the snapshot was taken (UTC)
+    '''
+    # Save the datetime this was scraped
+    extract_date = datetime.utcnow()
+
+    # Scrape data
+    print(f'Making {", ".join(sort_list)} web requests...')
+    start = time.perf_counter()
+    urls = [get_search_url(base_url, sort, num_of_records) for sort in sort_list]
+    if concurrent:
+        pages = fetch_pages(urls)
+    else:
+        pages = [page for url in urls for page in fetch_pages([url])]
+    fetch_time = time.perf_counter() - start
+    print(f'Requests complete ({fetch_time:.2f} s).  Begin Parsing...')
+
+    # Parse Data and convert it into a single Pandas Dataframe
+    start = time.perf_counter()
+    dfs = []
+    for sort, page in zip(sort_list, pages):
+        df = socrates_page.parse_socrates_page(page)
+        df['extract_sort'] = sort
+        dfs.append(df)
+    concat_df = pd.concat(dfs)
+    concat_df['extract_date'] = extract_date
+
+    # One row per conjunction, with the sort orders it was found in as a bitmask
+    concat_df = socrates.dedup_socrates_snapshot(concat_df)
+    parse_time = time.perf_counter() - start
+    print(f'Parsing complete ({parse_time:.2f} s).')
+
+    return concat_df, extract_date
+
+def save_socrates_data(concat_df, extract_date, data_file_path, min_hours, last_save=None, output_format='csv'):
+    '''
+    Saves a snapshot if the last one is older than min_hours
+
+    Parameters:
+    -----------
+    concat_df : Pandas Dataframe
+        Snapshot from download_socrates_data
+
+    extract_date : datetime
+        When the snapshot was taken (UTC)
+
+    data_file_path: str
+        Relative file path
+
+    min_hours : int
+        Minimum number of hours betwen file saves
+
+    last_save : tuple
+        (file, date) of the last saved snapshot, None reads it from data_file_path
+
+    output_format : str
+        'csv' for gzip csv files with text dates, 'parquet' for typed columns (native timestamps,
+        float32 metrics and categorical names) that load without any parsing
+
+    Returns
+    -------
+    saved : bool
+        True if the snapshot was saved
+
+    last_save : tuple
+        (file, date) of the last saved snapshot after this call
+    '''
+    # Save the file if none newer than the min_hours exists
+    start = time.perf_counter()
+    recent_file, recent_date = last_save if last_save is not None else get_last_save_date(data_file_path)
+    time_dif = extract_date - recent_date
+    if time_dif <= timedelta(hours=min_hours):
+        print(f'Not saving file since a file was created {time_dif} ago: {recent_file}')
+        return False, (recent_file, recent_date)
+
+    if output_format == 'parquet':
+        filename = 'socrates_' + extract_date.strftime('%Y%m%d%H%M%S') + '.parquet'
+        socrates.write_socrates_parquet(concat_df, data_file_path + filename)
+    else:
+        filename = 'socrates_' + extract_date.strftime('%Y%m%d%H%M%S') + '.csv.gz'
+        socrates_page.format_socrates_times(concat_df).to_csv(data_file_path + filename, index=False)
+    print(f'Saving of file \'{filename}\' complete ({time.perf_counter() - start:.2f} s).  Please be sure to commit new file!')
+    return True, (filename, extract_date)
+
+def scrape_socrates(num_of_records, min_hours, data_file_path, sort_list, base_url=SOCRATES_URL, concurrent=True, output_format='csv'):
     '''
     Scrape the SOCRATES website for upcoming close flybys
     
     Parameters:
     -----------
     num_of_records : int
-        Number of records to request from SOCRATES
+        Number of records to request from SOCRATES (per sort order)
     
     min_hours : int
         Minimum number of hours betwen file saves
@@ -64,56 +220,108 @@ def scrape_socrates(num_of_records, min_hours, data_file_path, sort_list):
     
     sort_list : list(str)
         Each sort order to download
-    '''
 
-    cidx_map = {1: 'sat1_norad', 2: 'sat1_name', 3: 'sat1_days_epoch', 4: 'max_prob', 5: 'dil_thr_km', 6: 'min_rng_km',
-                7: 'rel_velo_kms', 8: 'sat2_norad', 9: 'sat2_name', 10: 'sat2_days_epoch', 11: 'start_time',
-                12: 'tca_time', 13: 'stop_time'}
+    base_url : str
+        SOCRATES site (a local server can stand in for it, see benchmarks/bench_socrates_scraper.py)
 
-    # Save the datetime this was scraped
-    extract_date = datetime.utcnow()
-    concat_df = pd.DataFrame()
-    print (f'{extract_date} UTC - Job started')
-    
-    for sort in sort_list:
-        # Scrape data
-        print(f'Making {sort} web request...')
-        url = 'https://celestrak.com/SOCRATES/search-results.php?IDENT=NAME&NAME_TEXT1=&NAME_TEXT2=&CATNR_TEXT1=&CATNR_TEXT2=&ORDER=' + sort + '&MAX=' + str(num_of_records) + '&B1=Submit'
-        response = requests.get(url)
-        print('Request complete.  Begin Parsing...')
-
-
-        # Parse Data
-        soup = BeautifulSoup(response.text, "html.parser")
-        table = soup.find_all('table')[3]
-        rows = []
-
-        for record in table.find_all('form'):
-            row = {}
-            for idx, cell in enumerate(record.find_all('td')):
-                if idx in cidx_map.keys():
-                    row[cidx_map[idx]] = cell.text
-            rows.append(row)
-        print('Parsing complete.')
-
-        # Convert the data into a Pandas Dataframe
-        df = pd.DataFrame(rows)
-        df['extract_sort'] = sort
-        df['extract_date'] = extract_date
-        concat_df = concat_df.append(df)
-
-    # Save the file if none newer than the min_hours exists
-    recent_file, recent_date = get_last_save_date(data_file_path)
-    time_dif = extract_date - recent_date
-    if time_dif > timedelta(hours=min_hours):
-        filename = 'socrates_' + extract_date.strftime('%Y%m%d%H%M%S') + '.csv.gz'
-        concat_df.to_csv(data_file_path + filename, index=False)
-        print(f'Saving of file \'{filename}\' complete.  Please be sure to commit new file!')
-    else:
-        print(f'Not saving file since a file was created {time_dif} ago: {recent_file}')
+    concurrent : bool
+        Download all the sort orders at the same time, otherwise one after the other
 
+    output_format : str
+        'csv' or 'parquet', see save_socrates_data
+    '''
+    print (f'{datetime.utcnow()} UTC - Job started')
+    concat_df, extract_date = download_socrates_data(num_of_records, sort_list, base_url, concurrent)
+    save_socrates_data(concat_df, extract_date, data_file_path, min_hours, output_format=output_format)
     print (f'{datetime.utcnow()} UTC - Job ended')
     return concat_df
+
+def update_after_save(data_file_path, socrates_store_path, tle_file_path=None, gp_archive_path=None, spacetrack_key_file='./spacetrack_pwd.key'):
+    '''
+    Ingests the new snapshot into the incremental socrates store (which the dashboard reads)
+    and grabs the TLEs of its new conjunctions
+
+    Parameters:
+    -----------
+    data_file_path : str
+        Relative file path of socrates files
+
+    socrates_store_path : str
+        Relative path of the incremental socrates store
+
+    tle_file_path : str
+        Relative file path of the TLE data, None skips the TLE grab
+
+    gp_archive_path : str
+        Relative path of the local gp_history archive used by the TLE grab
+
+    spacetrack_key_file : str
+        Relative file path of login credentials for spacetrack
+    '''
+    store = SocratesStore(socrates_store_path)
+    new_files = store.refresh(data_file_path)
+    print(f'Added {len(new_files)} snapshots to the socrates store')
+
+    if tle_file_path is not None:
+        from socrates_gp_history_tle_grab_nm import grab_gp_history_data
+        grab_gp_history_data(data_file_path, tle_file_path, spacetrack_key_file, socrates_store_path=socrates_store_path, gp_archive_path=gp_archive_path)
+
+def run_scheduler(num_of_records, min_hours, data_file_path, sort_list, interval=timedelta(hours=6), jitter=timedelta(minutes=20),
+                  lock_file='./socrates_scrapper.lock', on_save=None, output_format='csv', max_runs=None, base_url=SOCRATES_URL):
+    '''
+    Scrapes SOCRATES every interval (plus or minus a random jitter) until interrupted
+
+    Parameters:
+    -----------
+    num_of_records, min_hours, data_file_path, sort_list, output_format, base_url
+        See scrape_socrates
+
+    interval : timedelta
+        Time between the start of two scrapes
+
+    jitter : timedelta
+        Largest random shift of each scrape, so the requests do not always hit the site at the same time
+
+    lock_file : str
+        Relative file path of the lock file, a second scheduler exits if it is locked
+
+    on_save : function
+        Called as on_save() after a snapshot is saved (for instance update_after_save)
+
+    max_runs : int
+        Stop after this many scrapes, None runs forever
+    '''
+    lock = acquire_lock(lock_file)
+    if lock is None:
+        print(f'Another scheduler holds {lock_file} - exiting')
+        return
+
+    # The last save is only read from the directory once, then kept in memory
+    last_save = get_last_save_date(data_file_path)
+    runs = 0
+    try:
+        while max_runs is None or runs < max_runs:
+            started = datetime.utcnow()
+            print (f'{started} UTC - Job started')
+            try:
+                concat_df, extract_date = download_socrates_data(num_of_records, sort_list, base_url)
+                saved, last_save = save_socrates_data(concat_df, extract_date, data_file_path, min_hours, last_save, output_format)
+                if saved and on_save is not None:
+                    on_save()
+            except Exception as e:
+                print(f'Scrape failed, retrying at the next run: {e!r}')
+            print (f'{datetime.utcnow()} UTC - Job ended')
+            runs += 1
+            if max_runs is not None and runs >= max_runs:
+                break
+
+            next_run = started + interval + timedelta(seconds=random.uniform(-1, 1) * jitter.total_seconds())
+            print(f'Next run at {next_run} UTC')
+            time.sleep(max(0, (next_run - datetime.utcnow()).total_seconds()))
+    except KeyboardInterrupt:
+        print('Scheduler stopped')
+    finally:
+        lock.close()
     
 
 # Parameters:
@@ -122,5 +330,32 @@ num_of_records = 1000
 min_hours = 6
 data_file_path = '../../../data/socrates/'
 sort = ['MAXPROB', 'MINRANGE', 'TIMEIN']
+socrates_store_path = '../../../data/socrates_store/'
+tle_file_path = '../../../data/space-track-gp-history/gp_history_socrates_tca_tles.pkl.gz'
+gp_archive_path = '../../../data/gp_history_archive/'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scrapes the SOCRATES website once, or periodically with --daemon')
+    parser.add_argument('--daemon', action='store_true', help='keep running and scrape every --interval-hours')
+    parser.add_argument('--num-of-records', type=int, default=num_of_records)
+    parser.add_argument('--min-hours', type=float, default=min_hours)
+    parser.add_argument('--data-file-path', default=data_file_path)
+    parser.add_argument('--sort', nargs='+', default=sort)
+    parser.add_argument('--output-format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--interval-hours', type=float, default=6)
+    parser.add_argument('--jitter-minutes', type=float, default=20)
+    parser.add_argument('--lock-file', default='./socrates_scrapper.lock')
+    parser.add_argument('--no-update', action='store_true', help='do not refresh the socrates store and grab TLEs after a save')
+    parser.add_argument('--no-tle-grab', action='store_true', help='refresh the socrates store but do not grab TLEs after a save')
+    args = parser.parse_args()
 
-scrape_socrates (num_of_records, min_hours, data_file_path, sort)
+    if args.daemon:
+        on_save = None
+        if not args.no_update:
+            on_save = lambda: update_after_save(args.data_file_path, socrates_store_path,
+                                                None if args.no_tle_grab else tle_file_path, gp_archive_path)
+        run_scheduler(args.num_of_records, args.min_hours, args.data_file_path, args.sort,
+                      interval=timedelta(hours=args.interval_hours), jitter=timedelta(minutes=args.jitter_minutes),
+                      lock_file=args.lock_file, on_save=on_save, output_format=args.output_format)
+    else:
+        scrape_socrates(args.num_of_records, args.min_hours, args.data_file_path, args.sort, output_format=args.output_format)
@@ -0,0 +1,318 @@
+'''
+gp_archive
+----------
+Local append-only archive of every gp_history record (TLE/OMM) received from
+Space-Track, so TLEs that were already fetched are never requested again.
+
+Records are appended as new parquet parts partitioned by epoch year; existing
+parts are never rewritten (except by compact).  A lookup only reads the year
+partitions its epochs fall in: each partition is de-duplicated on
+NORAD_CAT_ID/EPOCH and sorted by norad then epoch once, so the nearest TLE to
+an epoch is a binary search within the norad's range, and the partition is
+only read again when its parts change.
+
+compact() merges the parts of each year into the newest of them (so a reader
+that read every merged part already knows its name) and logs the parts each
+compacted part replaced in compactions.json (see compacted_parts).
+
+Layout of the archive directory:
+    year=YYYY/part-*.parquet   - records with an epoch in that year
+    compactions.json           - compacted part -> parts it replaced
+'''
+
+import json
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import uuid
+from datetime import datetime
+from os import listdir, makedirs, remove, replace
+from os.path import dirname, isdir, isfile, join
+
+from .gp_history import build_epoch_index, nearest_positions
+
+# Columns kept from the gp_history records
+ARCHIVE_COLUMNS = ['NORAD_CAT_ID', 'OBJECT_NAME', 'EPOCH', 'MEAN_MOTION', 'ECCENTRICITY', 'INCLINATION', 'RA_OF_ASC_NODE',
+                   'ARG_OF_PERICENTER', 'MEAN_ANOMALY', 'BSTAR', 'SEMIMAJOR_AXIS', 'PERIOD', 'APOAPSIS', 'PERIAPSIS',
+                   'TLE_LINE0', 'TLE_LINE1', 'TLE_LINE2']
+NUMERIC_COLUMNS = ['MEAN_MOTION', 'ECCENTRICITY', 'INCLINATION', 'RA_OF_ASC_NODE', 'ARG_OF_PERICENTER', 'MEAN_ANOMALY',
+                   'BSTAR', 'SEMIMAJOR_AXIS', 'PERIOD', 'APOAPSIS', 'PERIAPSIS']
+EPOCH_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def records_to_frame(records):
+    '''
+    Converts gp_history records to a typed dataframe with the archive columns
+
+    Parameters:
+    -----------
+    records : list(dict)
+        Records returned by SpaceTrackClient.gp_history
+
+    Returns
+    -------
+    df : Pandas Dataframe
+        One row per record, missing fields are null
+    '''
+    df = pd.DataFrame.from_records(records).reindex(columns=ARCHIVE_COLUMNS)
+    df['NORAD_CAT_ID'] = df['NORAD_CAT_ID'].astype(np.int64)
+    df['EPOCH'] = pd.to_datetime(df['EPOCH'], format=EPOCH_FORMAT).astype('datetime64[ns]')
+    for col in NUMERIC_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    for col in ['OBJECT_NAME', 'TLE_LINE0', 'TLE_LINE1', 'TLE_LINE2']:
+        df[col] = df[col].astype(object)
+    return df
+
+
+class GpHistoryArchive():
+    '''
+    Append-only partitioned archive of gp_history records with a per-norad epoch index
+    '''
+
+    archive_path = None
+    partitions = None
+    data = None
+    data_parts = None
+    epochs = None
+    norad_ranges = None
+
+    def __init__(self, archive_path):
+        '''
+        Initialize
+
+        Parameters:
+        -----------
+        archive_path : str
+            Relative path of the archive directory (created if missing)
+        '''
+        self.archive_path = archive_path
+        self.partitions = {}
+        makedirs(archive_path, exist_ok=True)
+
+    def append(self, records):
+        '''
+        Adds gp_history records to the archive (one new part per epoch year)
+
+        Parameters:
+        -----------
+        records : list(dict) or Pandas Dataframe
+            Records returned by SpaceTrackClient.gp_history, or a frame from records_to_frame
+
+        Returns
+        -------
+        count : int
+            Number of records written
+        '''
+        df = records if isinstance(records, pd.DataFrame) else records_to_frame(records)
+        if len(df) == 0:
+            return 0
+
+        part = 'part-' + datetime.utcnow().strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8] + '.parquet'
+        for year, year_df in df.groupby(df['EPOCH'].dt.year):
+            self.__write_parquet(year_df, join('year=' + str(year), part))
+
+        # The indexes of the years written to are rebuilt on the next lookup
+        return len(df)
+
+    def get_all_data(self):
+        '''
+        Returns all archived records, de-duplicated and sorted by NORAD_CAT_ID then EPOCH (reads
+        every partition)
+        '''
+        self.__load()
+        return self.data
+
+    def get_norad_data(self, norad):
+        '''
+        Returns the archived records of a norad sorted by EPOCH (a slice of the sorted archive,
+        reads every partition)
+
+        Parameters:
+        -----------
+        norad : int
+            NORAD_CAT_ID
+        '''
+        self.__load()
+        start, end = self.norad_ranges.get(int(norad), (0, 0))
+        return self.data.iloc[start:end]
+
+    def nearest(self, norads, epochs, tolerance=pd.Timedelta('5 min')):
+        '''
+        Finds the archived record of each norad with the epoch nearest to the given epoch.  Only
+        the year partitions within the tolerance of the epochs are read
+
+        Parameters:
+        -----------
+        norads : array
+            NORAD_CAT_ID of each target
+
+        epochs : array
+            Epoch of each target
+
+        tolerance : Timedelta
+            Largest allowed difference between the epochs
+
+        Returns
+        -------
+        df : Pandas Dataframe
+            Nearest record of each target (same order and index as the targets when a
+            Series is given), null when none is within the tolerance
+        '''
+        index = epochs.index if isinstance(epochs, pd.Series) else None
+        norads = np.asarray(norads, dtype=np.int64)
+        targets = np.asarray(epochs).astype('datetime64[ns]')
+        tolerance = pd.Timedelta(tolerance)
+        first_years = (targets - tolerance.to_timedelta64()).astype('datetime64[Y]').astype(np.int64) + 1970
+        last_years = (targets + tolerance.to_timedelta64()).astype('datetime64[Y]').astype(np.int64) + 1970
+
+        # Nearest record of each target over the partitions of its years
+        best = np.full(len(norads), -1, dtype=np.int64)
+        best_partition = np.full(len(norads), -1, dtype=np.int64)
+        best_distance = np.full(len(norads), np.iinfo(np.int64).max, dtype=np.int64)
+        frames = []
+        for year in np.unique(np.concatenate([first_years, last_years])):
+            partition = 'year=' + str(year)
+            if not isdir(join(self.archive_path, partition)):
+                continue
+            data, epochs_sorted, norad_ranges = self.__load_partition(partition)
+            q = np.flatnonzero((first_years <= year) & (last_years >= year))
+            positions = nearest_positions(epochs_sorted, norad_ranges, norads[q], targets[q], tolerance)
+            q, positions = q[positions >= 0], positions[positions >= 0]
+            distance = np.abs(epochs_sorted[positions] - targets[q].view(np.int64))
+            closer = distance < best_distance[q]
+            best[q[closer]] = positions[closer]
+            best_partition[q[closer]] = len(frames)
+            best_distance[q[closer]] = distance[closer]
+            frames.append(data)
+
+        found = [frames[k].iloc[best[best_partition == k]].set_index(np.flatnonzero(best_partition == k)) for k in range(len(frames))]
+        df = pd.concat(found) if len(found) > 0 else records_to_frame([])
+        df = df.reindex(np.arange(len(norads)))
+        if index is not None:
+            df.index = index
+        return df
+
+    def list_parts(self):
+        '''
+        Returns the relative paths of the archive parts, oldest first within each year
+        '''
+        return [join(partition, f) for partition in self.__list_partitions() for f in self.__list_parts(partition)]
+
+    def read_parts(self, parts):
+        '''
+        Returns the records of some archive parts (as written, not de-duplicated)
+
+        Parameters:
+        -----------
+        parts : list(str)
+            Relative paths of the parts (see list_parts)
+        '''
+        if len(parts) == 0:
+            return records_to_frame([])
+        return pd.concat([pd.read_parquet(join(self.archive_path, f)) for f in parts], ignore_index=True)
+
+    def compact(self):
+        '''
+        Rewrites each year partition as a single de-duplicated and sorted part, named after the
+        newest part it replaces, and logs the replaced parts (see compacted_parts)
+        '''
+        compactions = self.compacted_parts()
+        for partition in self.__list_partitions():
+            parts = self.__list_parts(partition)
+            if len(parts) < 2:
+                continue
+            df = pd.concat([pd.read_parquet(join(self.archive_path, partition, f)) for f in parts], ignore_index=True)
+            df = df.drop_duplicates(subset=['NORAD_CAT_ID', 'EPOCH'], keep='last').sort_values(['NORAD_CAT_ID', 'EPOCH'])
+
+            # Log first: the replaced parts are only removed once the log knows about them
+            merged = [join(partition, f) for f in parts]
+            replaced = set(merged)
+            for f in merged:
+                replaced |= set(compactions.pop(f, []))
+            compactions[merged[-1]] = sorted(replaced)
+            self.__write_json(compactions, 'compactions.json')
+
+            self.__write_parquet(df, merged[-1])
+            for f in merged[:-1]:
+                remove(join(self.archive_path, f))
+
+    def compacted_parts(self):
+        '''
+        Returns the parts that replaced other parts when they were compacted
+
+        Returns
+        -------
+        compactions : dict
+            Relative path of the compacted part -> relative paths of all the parts it replaced
+            (itself included)
+        '''
+        path = join(self.archive_path, 'compactions.json')
+        if not isfile(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def __len__(self):
+        '''
+        Number of archived records, from the part metadata (duplicates count until compact)
+        '''
+        return sum(pq.read_metadata(join(self.archive_path, f)).num_rows for f in self.list_parts())
+
+    def __load(self):
+        '''
+        Builds the norad/epoch index of the whole archive (only when a partition changed)
+        '''
+        parts = tuple(self.list_parts())
+        if self.data is not None and self.data_parts == parts:
+            return
+        frames = [self.__load_partition(partition)[0] for partition in self.__list_partitions()]
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 0 else records_to_frame([])
+
+        order, self.epochs, self.norad_ranges = build_epoch_index(df['NORAD_CAT_ID'].values, df['EPOCH'].values)
+        self.data = df.iloc[order].reset_index(drop=True)
+        self.data_parts = parts
+
+    def __load_partition(self, partition):
+        '''
+        Reads the parts of a year partition and builds its norad/epoch index (only when its parts
+        changed)
+
+        Returns
+        -------
+        partition : tuple
+            (data sorted by norad then epoch, sorted epochs, norad_ranges)
+        '''
+        parts = tuple(self.__list_parts(partition))
+        cached = self.partitions.get(partition)
+        if cached is not None and cached[0] == parts:
+            return cached[1]
+
+        if len(parts) == 0:
+            df = records_to_frame([])
+        else:
+            # Parts are named by write time, so keeping the last duplicate keeps the newest record
+            df = pd.concat([pd.read_parquet(join(self.archive_path, partition, f)) for f in parts], ignore_index=True)
+            df = df.drop_duplicates(subset=['NORAD_CAT_ID', 'EPOCH'], keep='last')
+
+        order, epochs, norad_ranges = build_epoch_index(df['NORAD_CAT_ID'].values, df['EPOCH'].values)
+        loaded = (df.iloc[order].reset_index(drop=True), epochs, norad_ranges)
+        self.partitions[partition] = (parts, loaded)
+        return loaded
+
+    def __list_partitions(self):
+        return sorted(d for d in listdir(self.archive_path) if d.startswith('year=') and isdir(join(self.archive_path, d)))
+
+    def __list_parts(self, partition):
+        return sorted(f for f in listdir(join(self.archive_path, partition)) if f.endswith('.parquet'))
+
+    def __write_parquet(self, df, name):
+        path = join(self.archive_path, name)
+        makedirs(dirname(path), exist_ok=True)
+        df.to_parquet(path + '.tmp', index=False)
+        replace(path + '.tmp', path)
+
+    def __write_json(self, data, name):
+        path = join(self.archive_path, name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        replace(path + '.tmp', path)
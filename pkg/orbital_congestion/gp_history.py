@@ -0,0 +1,142 @@
+'''
+gp_history
+----------
+Helpers for the Space-Track gp_history records (OMM format, one dict per TLE).
+'''
+
+import numpy as np
+import pandas as pd
+
+
+def build_epoch_index(norads, epochs):
+    '''
+    Sorts records by norad then epoch and finds where each norad starts and ends
+
+    Parameters:
+    -----------
+    norads : array
+        NORAD_CAT_ID of each record
+
+    epochs : array
+        EPOCH of each record (datetime64)
+
+    Returns
+    -------
+    order : array
+        Positions of the records in sorted order
+
+    sorted_epochs : array
+        Epochs in sorted order (int64 nanoseconds)
+
+    norad_ranges : dict
+        norad -> (start, end) in the sorted order
+    '''
+    norads = np.asarray(norads, dtype=np.int64)
+    epochs = np.asarray(epochs).astype('datetime64[ns]').view(np.int64)
+    order = np.lexsort((epochs, norads))
+    norads = norads[order]
+
+    unique_norads, starts = np.unique(norads, return_index=True)
+    ends = np.append(starts[1:], len(norads))
+    return order, epochs[order], dict(zip(unique_norads.tolist(), zip(starts.tolist(), ends.tolist())))
+
+def nearest_positions(sorted_epochs, norad_ranges, norads, epochs, tolerance=pd.Timedelta('5 min')):
+    '''
+    Binary searches the sorted epochs of each norad for the epoch nearest to each target
+
+    Parameters:
+    -----------
+    sorted_epochs, norad_ranges
+        From build_epoch_index
+
+    norads : array
+        NORAD_CAT_ID of each target
+
+    epochs : array
+        Epoch of each target (datetime64)
+
+    tolerance : Timedelta
+        Largest allowed difference between the epochs
+
+    Returns
+    -------
+    positions : array
+        Position in the sorted order of the nearest epoch of each target, -1 if there is
+        none within the tolerance
+    '''
+    norads = np.asarray(norads, dtype=np.int64)
+    targets = np.asarray(epochs).astype('datetime64[ns]').view(np.int64)
+    positions = np.full(len(norads), -1, dtype=np.int64)
+
+    # One binary search per norad for all of its targets
+    query_order = np.argsort(norads, kind='mergesort')
+    unique_norads, starts = np.unique(norads[query_order], return_index=True)
+    ends = np.append(starts[1:], len(norads))
+    for norad, q_start, q_end in zip(unique_norads.tolist(), starts, ends):
+        norad_range = norad_ranges.get(norad)
+        if norad_range is None:
+            continue
+        start, end = norad_range
+        q = query_order[q_start:q_end]
+        i = np.searchsorted(sorted_epochs[start:end], targets[q])
+
+        # The nearest is either the first epoch after the target or the one before it
+        before = np.clip(i - 1, 0, end - start - 1)
+        after = np.clip(i, 0, end - start - 1)
+        d_before = np.abs(sorted_epochs[start + before] - targets[q])
+        d_after = np.abs(sorted_epochs[start + after] - targets[q])
+        best = np.where(d_after < d_before, after, before)
+        positions[q] = np.where(np.minimum(d_before, d_after) <= tolerance.value, start + best, -1)
+
+    return positions
+
+
+class GpHistoryIndex():
+    '''
+    Index of gp_history records by NORAD_CAT_ID with sorted epochs.  Each EPOCH is only
+    parsed once, when the index is built, and nearest epoch lookups are binary searches.
+    '''
+
+    records = None
+    epochs = None
+    norad_ranges = None
+
+    def __init__(self, records):
+        '''
+        Initialize
+
+        Parameters:
+        -----------
+        records : list(dict)
+            Records returned by SpaceTrackClient.gp_history (NORAD_CAT_ID, EPOCH, TLE_LINE1, ...)
+        '''
+        norads = [int(rec['NORAD_CAT_ID']) for rec in records]
+        epochs = pd.to_datetime([rec['EPOCH'] for rec in records], format='%Y-%m-%dT%H:%M:%S.%f').values
+        order, self.epochs, self.norad_ranges = build_epoch_index(norads, epochs)
+        self.records = [records[i] for i in order]
+
+    def __len__(self):
+        return len(self.records)
+
+    def nearest(self, norad, epoch, tolerance=pd.Timedelta('5 min')):
+        '''
+        Returns the record of a norad with the epoch nearest to the given epoch
+
+        Parameters:
+        -----------
+        norad : int
+            NORAD_CAT_ID
+
+        epoch : Timestamp
+            Target epoch
+
+        tolerance : Timedelta
+            Largest allowed difference between the epochs
+
+        Returns
+        -------
+        record : dict
+            The nearest record, None if there is none within the tolerance
+        '''
+        position = nearest_positions(self.epochs, self.norad_ranges, [norad], [np.datetime64(pd.Timestamp(epoch))], tolerance)[0]
+        return self.records[position] if position >= 0 else None
@@ -0,0 +1,188 @@
+'''
+gp_history_plan
+---------------
+Plans how the missing TLEs of the GP-history grab job are split into gp_history
+requests (bins).
+
+A request asks for every TLE of its norads between its first and last epoch,
+so its payload grows with (number of norads) x (epoch span).  The adaptive
+planner walks the missing TLEs in epoch order and only adds an entry to the
+current request when that is cheaper than starting a new one, while bounding
+the norad count and the epoch span of each request.
+'''
+
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+
+# Cost model defaults
+TLES_PER_DAY = 3            # TLEs published per norad per day (LEO objects are updated a few times a day)
+BYTES_PER_RECORD = 1500     # size of one gp_history (OMM JSON) record
+REQUEST_OVERHEAD = 60000    # fixed cost of a request in bytes, covers latency and the rate limit budget
+
+
+def estimate_request_bytes(num_norads, span, tles_per_day=TLES_PER_DAY, bytes_per_record=BYTES_PER_RECORD):
+    '''
+    Returns the expected payload size of a gp_history request
+
+    Parameters:
+    -----------
+    num_norads : int or array
+        Number of norads in the request
+
+    span : Timedelta or array
+        Epoch range of the request (including the margins)
+
+    tles_per_day : float
+        Expected TLEs per norad per day
+
+    bytes_per_record : int
+        Size of a single record
+
+    Returns
+    -------
+    bytes : float or array
+        Expected payload size.  At least one record per norad is returned.
+    '''
+    days = pd.to_timedelta(span) / pd.Timedelta('1 D')
+    return _request_bytes(num_norads, days, tles_per_day, bytes_per_record)
+
+def _request_bytes(num_norads, days, tles_per_day, bytes_per_record):
+    return num_norads * np.maximum(days * tles_per_day, 1) * bytes_per_record
+
+def plan_qcut_bins(miss_tle_df, bin_size=100):
+    '''
+    Splits the missing TLEs into quantile bins of last_epoch (the original plan)
+
+    Parameters:
+    -----------
+    miss_tle_df : Pandas Dataframe
+        Missing TLEs with norad and last_epoch
+
+    bin_size : int
+        Entries per bin
+
+    Returns
+    -------
+    bins : Pandas Series
+        Bin number of each entry
+    '''
+    num_bins = round(len(miss_tle_df) / bin_size + 0.49999)
+    # Equal count bins in epoch order (pd.qcut on datetimes can leave the edge entries without a bin)
+    rank = miss_tle_df['last_epoch'].rank(method='first').values.astype(np.int64) - 1
+    return pd.Series(rank * num_bins // len(miss_tle_df), index=miss_tle_df.index)
+
+def plan_adaptive_bins(miss_tle_df, max_norads=100, max_span=timedelta(days=2), margin=timedelta(minutes=5),
+                       tles_per_day=TLES_PER_DAY, bytes_per_record=BYTES_PER_RECORD, request_overhead=REQUEST_OVERHEAD):
+    '''
+    Splits the missing TLEs into bins that bound the norad count and epoch span of each
+    request, merging entries into a request only when the expected cost is lower than
+    making a separate request
+
+    Parameters:
+    -----------
+    miss_tle_df : Pandas Dataframe
+        Missing TLEs with norad and last_epoch
+
+    max_norads : int
+        Most norads in a single request
+
+    max_span : timedelta
+        Largest epoch range of a single request
+
+    margin : timedelta
+        Added before the first and after the last epoch of each request
+
+    tles_per_day, bytes_per_record, request_overhead
+        Cost model, see estimate_request_bytes
+
+    Returns
+    -------
+    bins : Pandas Series
+        Bin number of each entry
+    '''
+    day_ns = pd.Timedelta('1 D').value
+    def cost(num_norads, span_ns):
+        return request_overhead + _request_bytes(num_norads, span_ns / day_ns, tles_per_day, bytes_per_record)
+
+    order = np.argsort(miss_tle_df['last_epoch'].values, kind='mergesort')
+    norads = miss_tle_df['norad'].values[order]
+    epochs = miss_tle_df['last_epoch'].values.astype('datetime64[ns]').view(np.int64)[order]
+    margin_ns = pd.Timedelta(margin).value * 2
+    max_span_ns = pd.Timedelta(max_span).value
+
+    bins = np.empty(len(order), dtype=np.int64)
+    b = 0
+    bin_norads = set()
+    bin_start = None
+    for i in range(len(order)):
+        if bin_start is not None:
+            num_norads = len(bin_norads | {norads[i]})
+            span = epochs[i] - bin_start + margin_ns
+            merged = cost(num_norads, span)
+            separate = cost(len(bin_norads), epochs[i-1] - bin_start + margin_ns) + cost(1, margin_ns)
+            if num_norads > max_norads or span > max_span_ns or merged > separate:
+                b += 1
+                bin_norads = set()
+                bin_start = None
+        if bin_start is None:
+            bin_start = epochs[i]
+        bin_norads.add(norads[i])
+        bins[i] = b
+
+    result = np.empty(len(order), dtype=np.int64)
+    result[order] = bins
+    return pd.Series(result, index=miss_tle_df.index)
+
+def describe_plan(miss_tle_df, bins, margin=timedelta(minutes=5), tles_per_day=TLES_PER_DAY, bytes_per_record=BYTES_PER_RECORD):
+    '''
+    Returns the planned requests (a dry run) with their expected payload
+
+    Parameters:
+    -----------
+    miss_tle_df : Pandas Dataframe
+        Missing TLEs with norad and last_epoch
+
+    bins : Pandas Series
+        Bin number of each entry (from plan_qcut_bins or plan_adaptive_bins)
+
+    Returns
+    -------
+    plan_df : Pandas Dataframe
+        One row per request: bin, entries, norads, min_epoch, max_epoch, span and est_bytes
+    '''
+    g = miss_tle_df.assign(bin=bins.values).groupby('bin')
+    plan_df = pd.DataFrame({'entries': g.size(),
+                            'norads': g['norad'].nunique(),
+                            'min_epoch': g['last_epoch'].min() - margin,
+                            'max_epoch': g['last_epoch'].max() + margin}).reset_index()
+    plan_df['span'] = plan_df['max_epoch'] - plan_df['min_epoch']
+    plan_df['est_bytes'] = estimate_request_bytes(plan_df['norads'], plan_df['span'], tles_per_day, bytes_per_record).round().astype(np.int64)
+    return plan_df
+
+def compare_plans(miss_tle_df, plans):
+    '''
+    Summarizes several plans side by side
+
+    Parameters:
+    -----------
+    miss_tle_df : Pandas Dataframe
+        Missing TLEs with norad and last_epoch
+
+    plans : dict
+        Plan name -> bins
+
+    Returns
+    -------
+    summary_df : Pandas Dataframe
+        Requests, total expected bytes and the largest norad count / span of each plan
+    '''
+    rows = []
+    for name, bins in plans.items():
+        plan_df = describe_plan(miss_tle_df, bins)
+        rows.append({'plan': name,
+                     'requests': len(plan_df),
+                     'est_total_mb': round(plan_df['est_bytes'].sum() / 1e6, 1),
+                     'max_norads': plan_df['norads'].max(),
+                     'max_span': plan_df['span'].max()})
+    return pd.DataFrame(rows).set_index('plan')
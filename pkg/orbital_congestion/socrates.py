@@ -1,92 +1,402 @@
 import pandas as pd
-from os import listdir, remove
+import numpy as np
+from os import listdir, remove, cpu_count
 from os.path import isfile, join
 import re
 
 import spacetrack.operators as op
 from spacetrack import SpaceTrackClient
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 
 from tqdm import tqdm
 
-def get_all_socrates_data(path):
+from . import socrates_tle
+
+SAT_PAIR_ID_FACTOR = 1000000
+
+# Bit of each SOCRATES sort order in the extract_sorts column
+SOCRATES_SORT_BITS = {'MAXPROB': 1, 'MINRANGE': 2, 'TIMEIN': 4}
+
+# Socrates snapshot files: gzip csv (text dates) or parquet (typed columns)
+SOCRATES_FILE_PATTERN = '^socrates_([0-9]{14})\\.(csv(\\.gz)?|parquet)$'
+SOCRATES_TIME_COLUMNS = ['start_time', 'tca_time', 'stop_time', 'extract_date']
+SOCRATES_METRIC_COLUMNS = ['max_prob', 'dil_thr_km', 'min_rng_km', 'rel_velo_kms']
+
+def dedup_socrates_snapshot(df):
     '''
-    Builds a dataframe out of all the socrates data files
+    Keeps one row per conjunction of a snapshot.  A conjunction is listed once per sort
+    order it was found in (extract_sort), those are combined into an extract_sorts bitmask
+    (see SOCRATES_SORT_BITS).  Duplicates across snapshots are kept, the cleaning needs
+    the first extract_date of each conjunction.
+    
+    Parameters:
+    -----------
+    df : Pandas Dataframe
+        Socrates rows with sat1_norad, sat2_norad, tca_time, extract_date and extract_sort
+    
+    Returns
+    -------
+    df : Pandas Dataframe
+        First row of each (sat1_norad, sat2_norad, tca_time, extract_date) in the original order,
+        with extract_sorts in place of extract_sort
+    '''
+    codes = df.groupby(['sat1_norad','sat2_norad','tca_time','extract_date'], sort=False).ngroup().values
+    bits = df['extract_sort'].map(SOCRATES_SORT_BITS).fillna(0).astype(np.int8).values
+    extract_sorts = np.zeros(codes.max() + 1 if len(codes) > 0 else 0, dtype=np.int8)
+    np.bitwise_or.at(extract_sorts, codes, bits)
+
+    first = ~pd.Series(codes).duplicated().values
+    col = df.columns.get_loc('extract_sort')
+    df = df[first].drop(columns='extract_sort')
+    df.insert(col, 'extract_sorts', extract_sorts[codes[first]])
+    return df
+
+def _read_socrates_file(file_path, columns=None, dedup=False):
+    '''
+    Reads a single socrates data file (runs inside the loader's process pool).  Parquet
+    files are already typed, the date columns of csv files are parsed with their fixed formats.
+    
+    Parameters:
+    -----------
+    file_path : str
+        Relative file path of a single socrates file
+    
+    columns : list(str)
+        Columns to read, None for all
+    
+    dedup : bool
+        Combine the sort orders of the files written before the scraper de-duplicated them
+        (see dedup_socrates_snapshot).  Otherwise their rows are returned as they are, with extract_sort
+    
+    Returns
+    -------
+    df : Pandas Dataframe
+        Socrates data of a single file
+    '''
+    if file_path.endswith('.parquet'):
+        return pd.read_parquet(file_path, columns=columns)
+
+    # Files written before the scraper de-duplicated the sort orders still need extract_sort
+    dedup_columns = ['sat1_norad','sat2_norad','tca_time','extract_date','extract_sort'] if dedup else []
+    usecols = None if columns is None else lambda col: col in columns or col in dedup_columns
+    df = pd.read_csv(file_path, usecols=usecols)
+    for col, date_format in [('extract_date', '%Y-%m-%d %H:%M:%S.%f'), ('start_time', '%Y %b %d %H:%M:%S.%f'),
+                             ('tca_time', '%Y %b %d %H:%M:%S.%f'), ('stop_time', '%Y %b %d %H:%M:%S.%f')]:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format=date_format)
+
+    if dedup and 'extract_sort' in df.columns:
+        df = dedup_socrates_snapshot(df)
+    return df if columns is None else df[[col for col in df.columns if col in columns]]
+
+def to_socrates_columnar(df):
+    '''
+    Converts a socrates snapshot to the types stored in the parquet files: native timestamps,
+    int32 norads, float32 metrics and categorical names
+    
+    Parameters:
+    -----------
+    df : Pandas Dataframe
+        Socrates snapshot (parsed page or csv file) with the times as datetimes
+    
+    Returns
+    -------
+    df : Pandas Dataframe
+        Typed copy of df
+    '''
+    df = df.copy()
+    for col in ['sat1_norad', 'sat2_norad']:
+        df[col] = df[col].astype(np.int32)
+    for col in SOCRATES_METRIC_COLUMNS:
+        df[col] = df[col].astype(np.float32)
+    for col in ['sat1_days_epoch', 'sat2_days_epoch']:
+        df[col] = df[col].astype(np.float64)
+    for col in ['sat1_name', 'sat2_name']:
+        df[col] = df[col].astype('category')
+    for col in SOCRATES_TIME_COLUMNS:
+        df[col] = df[col].astype('datetime64[ns]')
+    if 'extract_sorts' in df.columns:
+        df['extract_sorts'] = df['extract_sorts'].astype(np.int8)
+    return df.reset_index(drop=True)
+
+def write_socrates_parquet(df, file_path):
+    '''
+    Writes a socrates snapshot as a parquet file with typed, compressed columns
+    
+    Parameters:
+    -----------
+    df : Pandas Dataframe
+        Socrates snapshot (see to_socrates_columnar)
+    
+    file_path : str
+        Relative file path of the parquet file (socrates_YYYYMMDDHHMMSS.parquet)
+    '''
+    to_socrates_columnar(df).to_parquet(file_path, index=False, compression='zstd', compression_level=19, coerce_timestamps='us')
+
+def list_socrates_files(path):
+    '''
+    Lists the socrates data files in a directory, oldest first
     
     Parameters:
     -----------
     path : str
         Relative file path of socrates files
     
+    Returns
+    -------
+    files : list(tuple)
+        (filename, timestamp) of each socrates file sorted by timestamp.  When a snapshot is
+        both in csv and parquet format only the parquet file is listed.
+    '''
+    files = [ (match[0],match[1]) for f in listdir(path) if isfile(join(path, f))  if (match:=re.search(SOCRATES_FILE_PATTERN, f))]
+    files = sorted(files, key=lambda x: (x[1], not x[0].endswith('.parquet')))
+    return [file for i, file in enumerate(files) if i == 0 or file[1] != files[i-1][1]]
+
+def read_socrates_files(file_paths, parallel=False, max_workers=None, columns=None, dedup=False):
+    '''
+    Builds a dataframe out of the given socrates data files
+    
+    Parameters:
+    -----------
+    file_paths : list(str)
+        Relative file path of each socrates file to read
+    
+    parallel : bool
+        Read and parse the files across a process pool instead of one at a time
+    
+    max_workers : int
+        Number of processes used when parallel is set (defaults to the cpu count)
+    
+    columns : list(str)
+        Columns to read from the files, None for all.  The derived columns (last epochs,
+        sat_pair_id and sat_pair) are only added when the columns they need are read.
+    
+    dedup : bool
+        Combine the sort orders of each conjunction of the older csv files into extract_sorts
+        (see dedup_socrates_snapshot).  Off by default: the rows are returned as they are in the files
+    
     Returns
     -------
     df : Pandas Dataframe
-        Combined set of all socrates data
+        Combined set of the socrates data
     '''
-    files = [ (match[0],match[1]) for f in listdir(path) if isfile(join(path, f))  if (match:=re.search('^socrates_([0-9]{14})\.csv(\.gz)?$', f))]
-    files
+    # Build single dataset - each file is parsed on its own and everything is concatenated once
+    if parallel:
+        workers = max_workers or cpu_count() or 1
+        chunksize = max(1, len(file_paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            frames = list(tqdm(executor.map(_read_socrates_file, file_paths, [columns] * len(file_paths), [dedup] * len(file_paths), chunksize=chunksize), total=len(file_paths)))
+    else:
+        frames = [_read_socrates_file(file_path, columns, dedup) for file_path in tqdm(file_paths)]
+    df = pd.concat(frames)
 
-    # Build single dataset
-    df = pd.DataFrame()
-    for file,date in tqdm(files):
-        tmp_df = pd.read_csv(path + file)
-        df = pd.concat([df,tmp_df])
+    # Fix timedeltas
+    for sat in ['sat1', 'sat2']:
+        if sat + '_days_epoch' in df.columns:
+            df[sat + '_days_epoch'] = pd.to_timedelta(df[sat + '_days_epoch'], 'd')
+            if 'tca_time' in df.columns:
+                df[sat + '_last_epoch'] = df['tca_time'] - df[sat + '_days_epoch']
 
+    # Add "pair" columns
+    if 'sat1_norad' in df.columns and 'sat2_norad' in df.columns:
+        df['sat_pair_id'] = get_sat_pair_id(df['sat1_norad'], df['sat2_norad'])
+    if 'sat1_name' in df.columns and 'sat2_name' in df.columns:
+        df = intern_socrates_names(df)
+    
+    return df
 
-    # Fix dates and timedeltas
-    df['extract_date'] = pd.to_datetime(df['extract_date'], format='%Y-%m-%d %H:%M:%S.%f')
-    df['start_time'] = pd.to_datetime(df['start_time'], format='%Y %b %d %H:%M:%S.%f')
-    df['tca_time'] = pd.to_datetime(df['tca_time'], format='%Y %b %d %H:%M:%S.%f')
-    df['stop_time'] = pd.to_datetime(df['stop_time'], format='%Y %b %d %H:%M:%S.%f')
-    df['sat1_days_epoch'] = pd.to_timedelta(df['sat1_days_epoch'], 'd')
-    df['sat2_days_epoch'] = pd.to_timedelta(df['sat2_days_epoch'], 'd')
-    df['sat1_last_epoch'] = df['tca_time'] - df['sat1_days_epoch']
-    df['sat2_last_epoch'] = df['tca_time'] - df['sat2_days_epoch']
+def get_sat_pair_id(sat1_norad, sat2_norad):
+    '''
+    Returns an integer id for each satellite pair.  The id reads as both norads
+    next to each other (44421 and 44424 becomes 44421044424).
+    
+    Parameters:
+    -----------
+    sat1_norad : Pandas Series
+        Norad of the first satellite
+    
+    sat2_norad : Pandas Series
+        Norad of the second satellite
+    
+    Returns
+    -------
+    sat_pair_id : Pandas Series
+        int64 id of the pair
+    '''
+    return sat1_norad.astype(np.int64) * SAT_PAIR_ID_FACTOR + sat2_norad.astype(np.int64)
 
-    # Add "pair" column
-    df['sat_pair'] = df.apply(lambda x: x['sat1_name'] + '-' + x['sat2_name'], axis=1)
+def intern_socrates_names(df):
+    '''
+    Stores sat1_name and sat2_name as categoricals and (re)builds the sat_pair
+    categorical from them.  Each distinct name and pair string is only stored once.
     
-    return df
+    Parameters:
+    -----------
+    df : Pandas Dataframe
+        Socrates data with sat1_name and sat2_name
+    
+    Returns
+    -------
+    df : Pandas Dataframe
+        Socrates data with categorical sat1_name, sat2_name and sat_pair
+    '''
+    df['sat1_name'] = df['sat1_name'].astype('category')
+    df['sat2_name'] = df['sat2_name'].astype('category')
+
+    # Build the pair strings once per distinct (sat1_name, sat2_name) combination.  A missing
+    # name has the code -1, its pair is missing too
+    sat1_codes = df['sat1_name'].cat.codes.values.astype(np.int64)
+    sat2_codes = df['sat2_name'].cat.codes.values.astype(np.int64)
+    missing = (sat1_codes < 0) | (sat2_codes < 0)
+    pair_codes, pairs = pd.factorize(np.where(missing, -1, sat1_codes * len(df['sat2_name'].cat.categories) + sat2_codes))
+    sat1_categories = df['sat1_name'].cat.categories.values
+    sat2_categories = df['sat2_name'].cat.categories.values
+    pair_names = [sat1_categories[p // len(sat2_categories)] + '-' + sat2_categories[p % len(sat2_categories)] if p >= 0 else None
+                  for p in pairs]
+    name_codes, names = pd.factorize(pd.Index(pair_names))
+    df['sat_pair'] = pd.Categorical.from_codes(name_codes[pair_codes], categories=names)
 
+    return df
 
-socrates_group_num = 0
-def get_socrates_cleaned_data(path):
+def get_all_socrates_data(path, parallel=False, max_workers=None, columns=None, dedup=False):
     '''
-    Builds a dataframe out of all the socrates data files
-    and remove duplicates and sorts
+    Builds a dataframe out of all the socrates data files (csv and parquet), without any
+    cleaning of duplicate records
     
     Parameters:
     -----------
     path : str
         Relative file path of socrates files
     
+    parallel : bool
+        Read and parse the files across a process pool instead of one at a time
+    
+    max_workers : int
+        Number of processes used when parallel is set (defaults to the cpu count)
+    
+    columns : list(str)
+        Columns to read from the files, None for all (see read_socrates_files)
+    
+    dedup : bool
+        Combine the sort orders of each conjunction of the older csv files (see read_socrates_files)
+    
     Returns
     -------
     df : Pandas Dataframe
         Combined set of all socrates data
     '''
+    file_paths = [join(path, file) for file,date in list_socrates_files(path)]
+    return read_socrates_files(file_paths, parallel, max_workers, columns, dedup)
+
+
+def assign_conjunction_groups(df, max_tca_gap=pd.Timedelta('1 min')):
+    '''
+    Groups the entries of the same conjunction together (some entries have TCA times that
+    change slightly between snapshots).  A new group starts on a new sat pair or when the
+    TCA time jumps by more than max_tca_gap.
+    
+    The groups are numbered 0 to n - 1 in sat_pair_id then first TCA time order (the rank of
+    their (sat_pair_id, first TCA) key), so the ids are dense and the same for the same data.
+    Adding snapshots can renumber the later groups.
     
-    def __set_group_number(x):
-        global socrates_group_num
-        if x:
-            socrates_group_num += 1
-        return socrates_group_num
+    Parameters:
+    -----------
+    df : Pandas Dataframe
+        Socrates data with sat_pair_id and tca_time
+    
+    max_tca_gap : Timedelta
+        Largest TCA time difference within a group
+    
+    Returns
+    -------
+    df : Pandas Dataframe
+        Socrates data sorted by sat_pair_id and tca_time with a group column
+    '''
+    df = df.sort_values(['sat_pair_id','tca_time'])
+    new_group = ((df['sat_pair_id'] != df['sat_pair_id'].shift(1)) | (df['tca_time']-df['tca_time'].shift(1) > max_tca_gap)).values
+    df['group'] = new_group.cumsum() - 1
 
-    df = get_all_socrates_data(path)
+    return df
 
+def sort_conjunction_groups(df):
+    '''
+    Sorts grouped socrates data by sat_pair_id, first TCA time of the group and extract_date,
+    and numbers the groups again in that order (the groups of a sat pair must come from the
+    same assign_conjunction_groups call, the groups of different pairs can be combined)
+    
+    Parameters:
+    -----------
+    df : Pandas Dataframe
+        Socrates data with a group column
+    
+    Returns
+    -------
+    df : Pandas Dataframe
+        Sorted socrates data with dense group ids
+    '''
+    df = df.assign(group_tca=df.groupby(['sat_pair_id','group'])['tca_time'].transform('min'))
+    df = df.sort_values(['sat_pair_id','group_tca','extract_date'], kind='mergesort')
+    new_group = ((df['sat_pair_id'] != df['sat_pair_id'].shift(1)) | (df['group_tca'] != df['group_tca'].shift(1))).values
+    df['group'] = new_group.cumsum() - 1
+    return df.drop(columns=['group_tca'])
+
+def clean_socrates_data(df):
+    '''
+    Removes duplicates from socrates data, groups entries of the same
+    conjunction together and sorts
+    
+    Parameters:
+    -----------
+    df : Pandas Dataframe
+        Socrates data (from read_socrates_files), oldest snapshot first
+    
+    Returns
+    -------
+    df : Pandas Dataframe
+        Cleaned socrates data with a group column
+    '''
     # Clean the data
     # Remove duplicates - keep the first occurence of a sat-pair and tca_time
-    df = df.drop_duplicates(subset=['sat_pair', 'tca_time'], keep='first')
+    df = df.drop_duplicates(subset=['sat_pair_id', 'tca_time'], keep='first')
 
     # Set a group number (some entries have TCA times that change slightly and these will be grouped together)
-    df = df.sort_values(['sat_pair','tca_time'])
-    df['group'] = ((df['sat_pair'] != df['sat_pair'].shift(1)) | (df['tca_time']-df['tca_time'].shift(1) > pd.Timedelta('1 min'))).apply(__set_group_number)
+    df = assign_conjunction_groups(df)
 
     # Resort
-    df = df.sort_values(['group','extract_date'])
+    df = sort_conjunction_groups(df)
     
     return df
 
+def get_socrates_cleaned_data(path, parallel=False, store=None):
+    '''
+    Builds a dataframe out of all the socrates data files
+    and remove duplicates and sorts
+    
+    Parameters:
+    -----------
+    path : str
+        Relative file path of socrates files
+    
+    parallel : bool
+        Read the socrates files across a process pool
+    
+    store : SocratesStore
+        Optional incremental store (socrates_store.SocratesStore).  Only files
+        not yet ingested by the store are read and only their sat pairs are re-cleaned
+    
+    Returns
+    -------
+    df : Pandas Dataframe
+        Combined set of all socrates data
+    '''
+    if store is not None:
+        store.refresh(path, parallel)
+        return store.get_cleaned_data()
+
+    df = get_all_socrates_data(path, parallel, dedup=True)
+    return clean_socrates_data(df)
+
 def get_socrates_with_tle_data(df, tle_data_path):
     '''
     Merges the socrates data with the TLE data to create a new dataframe
@@ -108,13 +418,14 @@ def get_socrates_with_tle_data(df, tle_data_path):
     g = df.groupby('group')
     gdf = g.tail(1)
 
-    # Open the TLE Pickle file and merge
-    tle_df = pd.read_pickle(tle_data_path)
-    gdf = gdf.merge(tle_df, left_on=['sat_pair','tca_time', 'sat1_norad', 'sat2_norad'], right_on=['sat_pair','tca_time', 'sat1_norad', 'sat2_norad'], how='left')
+    # Look up the TLE data on the integer norads and TCA time (the names in sat_pair change with the satellite status)
+    # from the indexed side table of the TLE pickle file
+    gdf = gdf.reset_index(drop=True)
+    gdf = pd.concat([gdf, socrates_tle.lookup_tle_data(gdf, tle_data_path)], axis=1)
     
     return gdf
     
-def get_all_socrates_and_tle_data(socrates_files_path, tle_file_path):
+def get_all_socrates_and_tle_data(socrates_files_path, tle_file_path, parallel=False, store=None):
     '''
     Returns Socrates and TLE data joined together
     
@@ -126,6 +437,12 @@ def get_all_socrates_and_tle_data(socrates_files_path, tle_file_path):
     tle_file_path : str
         Relative file path of TLE data
     
+    parallel : bool
+        Read the socrates files across a process pool
+    
+    store : SocratesStore
+        Optional incremental store used to build the socrates data
+    
     Returns
     -------
     soc_df : Pandas Dataframe
@@ -135,11 +452,48 @@ def get_all_socrates_and_tle_data(socrates_files_path, tle_file_path):
         Trimmed set of socrates data with TLE data (from file only)
     '''
     
-    soc_df = get_socrates_cleaned_data(socrates_files_path)
+    soc_df = get_socrates_cleaned_data(socrates_files_path, parallel, store)
     tle_df = get_socrates_with_tle_data(soc_df, tle_file_path)
     
     return soc_df, tle_df
 
+# Status marker at the end of a socrates name, ie: 'ISS (ZARYA) [+]', and its category
+SOCRATES_STATUS_DETAILED = {'+': 'Operational', 'P': 'Paritally Operational', 'B': 'Backup/Reserve', 'S': 'New Spare',
+                            'X': 'Extended Mission', '-': 'Nonoperational', 'D': 'Decayed'}
+SOCRATES_STATUS_SUMMARY = {'+': 'Operational', 'P': 'Operational', 'B': 'Operational', 'S': 'Operational',
+                           'X': 'Operational', '-': 'Nonoperational', 'D': 'Nonoperational'}
+
+def decode_socrates_status(names, detailed=False):
+    '''
+    Decodes the status marker of socrates satellite names into a category.  The marker
+    is only sliced out once per distinct name and then looked up for all rows at once.
+    
+    Parameters:
+    -----------
+    names : Pandas Series
+        Socrates satellite names (sat1_name or sat2_name), preferably categorical
+        
+    detailed : bool
+        Returns the detailed category or a summary.  Summary contains only operational,
+        nonoperational and unknown.
+    
+    Returns
+    -------
+    status : Pandas Series
+        Categorical with the status of each name
+    '''
+    status_map = SOCRATES_STATUS_DETAILED if detailed else SOCRATES_STATUS_SUMMARY
+    labels = pd.Index(list(dict.fromkeys(status_map.values())) + ['Unknown'])
+
+    names = names.astype('category')
+    name_status = names.cat.categories.str[-2:-1].map(status_map).fillna('Unknown')
+
+    # Missing names (code -1) pick the 'Unknown' appended at the end
+    status_codes = np.append(labels.get_indexer(name_status), len(labels) - 1)
+    codes = status_codes[names.cat.codes.values]
+
+    return pd.Series(pd.Categorical.from_codes(codes, categories=labels), index=names.index)
+
 def assign_socrates_category(df, detailed=False):
     '''
     Returns the dataframe with two new columns containing the sat1_name and sat2_name decoded
@@ -159,30 +513,7 @@ def assign_socrates_category(df, detailed=False):
     df : Pandas Dataframe
         Socrates dataframe passed in with 2 new columns: sat1_cat and sat2_cat
     '''
+    df['sat1_cat'] = decode_socrates_status(df['sat1_name'], detailed)
+    df['sat2_cat'] = decode_socrates_status(df['sat2_name'], detailed)
     
-    def __detail_category(val):
-        if val == '+':
-            return 'Operational'
-        elif val == 'P':
-            return 'Paritally Operational'
-        elif val == 'B':
-            return 'Backup/Reserve'
-        elif val == 'S':
-            return 'New Spare'
-        elif val == 'X':
-            return 'Extended Mission'
-        elif val == '-':
-            return 'Nonoperational'
-        elif val == 'D':
-            return 'Decayed'
-        else:
-            return 'Unknown'
-    
-    if detailed:
-        df['sat1_cat'] = df['sat1_name'].str[-2:-1].apply(__detail_category)
-        df['sat2_cat'] = df['sat2_name'].str[-2:-1].apply(__detail_category)
-    else:
-        df['sat1_cat'] = df['sat1_name'].str[-2:-1].apply(lambda x: 'Operational' if x in ['+','P','B','S','X'] else ('Nonoperational' if x in ['-','D'] else 'Unknown'))
-        df['sat2_cat'] = df['sat2_name'].str[-2:-1].apply(lambda x: 'Operational' if x in ['+','P','B','S','X'] else ('Nonoperational' if x in ['-','D'] else 'Unknown'))
-    
-    return df
\ No newline at end of file
+    return df
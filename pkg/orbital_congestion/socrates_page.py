@@ -0,0 +1,173 @@
+'''
+socrates_page
+-------------
+Streaming parser of the SOCRATES search results pages.
+https://celestrak.com/SOCRATES/
+
+The page is read with the event driven html.parser.HTMLParser, so no document
+tree is built.  Each conjunction is a form in the 4th table of the page; the
+cells of interest (SOCRATES_COLUMNS) are converted as they are read and added
+to one typed array per column.
+'''
+
+from array import array
+from html.parser import HTMLParser
+
+import numpy as np
+import pandas as pd
+
+# td index within a conjunction form -> column
+SOCRATES_COLUMNS = {1: 'sat1_norad', 2: 'sat1_name', 3: 'sat1_days_epoch', 4: 'max_prob', 5: 'dil_thr_km', 6: 'min_rng_km',
+                    7: 'rel_velo_kms', 8: 'sat2_norad', 9: 'sat2_name', 10: 'sat2_days_epoch', 11: 'start_time',
+                    12: 'tca_time', 13: 'stop_time'}
+INT_COLUMNS = ['sat1_norad', 'sat2_norad']
+FLOAT_COLUMNS = ['sat1_days_epoch', 'max_prob', 'dil_thr_km', 'min_rng_km', 'rel_velo_kms', 'sat2_days_epoch']
+TIME_COLUMNS = ['start_time', 'tca_time', 'stop_time']
+TIME_FORMAT = '%Y %b %d %H:%M:%S.%f'
+
+RESULTS_TABLE = 3
+
+
+class SocratesPageParser(HTMLParser):
+    '''
+    Collects the conjunctions of a search results page into column arrays
+    '''
+
+    typed = None
+    columns = None
+    num_rows = 0
+
+    def __init__(self, typed=True):
+        '''
+        Initialize
+
+        Parameters:
+        -----------
+        typed : bool
+            Convert norads to int, the metrics to float and keep the times as text to be
+            parsed in one go by get_data.  False keeps the text of every cell.
+        '''
+        super().__init__(convert_charrefs=True)
+        self.typed = typed
+        self.columns = {}
+        for col in SOCRATES_COLUMNS.values():
+            if typed and col in INT_COLUMNS:
+                self.columns[col] = array('q')
+            elif typed and col in FLOAT_COLUMNS:
+                self.columns[col] = array('d')
+            else:
+                self.columns[col] = []
+        self.num_rows = 0
+        self.__table_idx = -1
+        self.__in_table = False
+        self.__row = None
+        self.__td_idx = -1
+        self.__cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            self.__table_idx += 1
+            self.__in_table = self.__table_idx == RESULTS_TABLE
+        elif not self.__in_table:
+            return
+        elif tag == 'form':
+            self.__row = {}
+            self.__td_idx = -1
+        elif tag == 'td' and self.__row is not None:
+            self.__td_idx += 1
+            self.__cell = [] if self.__td_idx in SOCRATES_COLUMNS else None
+
+    def handle_endtag(self, tag):
+        if not self.__in_table:
+            return
+        if tag == 'td' and self.__cell is not None:
+            self.__row[SOCRATES_COLUMNS[self.__td_idx]] = ''.join(self.__cell)
+            self.__cell = None
+        elif tag == 'form' and self.__row is not None:
+            self.__add_row(self.__row)
+            self.__row = None
+        elif tag == 'table':
+            self.__in_table = False
+
+    def handle_data(self, data):
+        if self.__cell is not None:
+            self.__cell.append(data)
+
+    def get_data(self):
+        '''
+        Returns the conjunctions read so far
+
+        Returns
+        -------
+        df : Pandas Dataframe
+            One row per conjunction with the SOCRATES_COLUMNS
+        '''
+        data = {}
+        for col, values in self.columns.items():
+            if not self.typed:
+                data[col] = values
+            elif col in INT_COLUMNS:
+                data[col] = np.frombuffer(values, dtype=np.int64) if len(values) > 0 else np.empty(0, dtype=np.int64)
+            elif col in FLOAT_COLUMNS:
+                data[col] = np.frombuffer(values, dtype=np.float64) if len(values) > 0 else np.empty(0, dtype=np.float64)
+            elif col in TIME_COLUMNS:
+                data[col] = pd.to_datetime(pd.Series(values, dtype=object), format=TIME_FORMAT)
+            else:
+                data[col] = values
+        return pd.DataFrame(data)
+
+    def __add_row(self, row):
+        for col, values in self.columns.items():
+            text = row.get(col)
+            if not self.typed or col not in INT_COLUMNS and col not in FLOAT_COLUMNS:
+                values.append(text)
+            elif text is None or text.strip() == '':
+                values.append(-1 if col in INT_COLUMNS else np.nan)
+            else:
+                values.append(int(text) if col in INT_COLUMNS else float(text))
+        self.num_rows += 1
+
+
+def parse_socrates_page(page, typed=True):
+    '''
+    Parses a SOCRATES search results page
+
+    Parameters:
+    -----------
+    page : str or iterable(str)
+        Text of the page, or its chunks as they are received
+
+    typed : bool
+        See SocratesPageParser
+
+    Returns
+    -------
+    df : Pandas Dataframe
+        One row per conjunction with the SOCRATES_COLUMNS
+    '''
+    parser = SocratesPageParser(typed)
+    for chunk in ([page] if isinstance(page, str) else page):
+        parser.feed(chunk)
+    parser.close()
+    return parser.get_data()
+
+
+def format_socrates_times(df):
+    '''
+    Formats the time columns of a typed page back to the SOCRATES text format
+    (milliseconds), as written to the socrates csv files
+
+    Parameters:
+    -----------
+    df : Pandas Dataframe
+        Output of parse_socrates_page
+
+    Returns
+    -------
+    df : Pandas Dataframe
+        Copy of df with the TIME_COLUMNS as text
+    '''
+    df = df.copy()
+    for col in TIME_COLUMNS:
+        df[col] = df[col].dt.strftime(TIME_FORMAT).str[:-3]
+    return df
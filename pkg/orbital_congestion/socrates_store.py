@@ -0,0 +1,212 @@
+'''
+socrates_store
+--------------
+Incremental on-disk store of the SOCRATES snapshot files.
+
+A manifest records each snapshot file that has been ingested (keyed by filename
+with its extract timestamp).  On refresh only new snapshots are read, their rows
+are appended to the raw parquet cache and only the sat pairs (sat_pair_id) they touch are
+de-duplicated and grouped again.
+
+Layout of the store directory:
+    manifest.json        - ingested files
+    raw/part-*.parquet   - raw socrates rows, one part per refresh
+    cleaned.parquet      - output of socrates.clean_socrates_data
+    store.lock           - held while a refresh writes the store
+
+Refreshes from several processes (the scraper daemon and the dashboard) take
+turns on the lock, and write their temporary files under unique names.
+'''
+
+import json
+import os
+import time
+import uuid
+import pandas as pd
+from datetime import datetime
+from os import listdir, makedirs, replace
+from os.path import isfile, join
+
+from . import socrates
+
+
+class SocratesStore():
+    '''
+    Incremental store of the socrates data files
+    '''
+
+    store_path = None
+    manifest = None
+
+    def __init__(self, store_path):
+        '''
+        Initialize
+
+        Parameters:
+        -----------
+        store_path : str
+            Relative path of the store directory (created if missing)
+        '''
+        self.store_path = store_path
+        makedirs(join(store_path, 'raw'), exist_ok=True)
+        self.manifest = self.__load_manifest()
+
+    def refresh(self, path, parallel=False):
+        '''
+        Ingests the socrates files that are not in the manifest yet
+
+        Parameters:
+        -----------
+        path : str
+            Relative file path of socrates files
+
+        parallel : bool
+            Read the new socrates files across a process pool
+
+        Returns
+        -------
+        new_files : list(str)
+            Filenames that were ingested
+        '''
+        # Snapshots are known by timestamp, so converting a csv file to parquet does not ingest it again
+        lock = acquire_lock(self.__path('store.lock'), timeout=None)
+        try:
+            # Another process may have refreshed the store since it was opened
+            self.manifest = self.__load_manifest()
+            return self.__refresh(path, parallel)
+        finally:
+            lock.close()
+
+    def __refresh(self, path, parallel):
+        '''
+        Ingests the new socrates files (with the store lock held)
+        '''
+        ingested = set(v['timestamp'] for v in self.manifest['files'].values())
+        new_files = [(file,date) for file,date in socrates.list_socrates_files(path) if date not in ingested]
+        if len(new_files) == 0:
+            return []
+
+        df = socrates.read_socrates_files([join(path, file) for file,date in new_files], parallel, dedup=True)
+
+        # Append the new rows to the raw cache
+        part = join('raw', 'part-' + new_files[-1][1] + '.parquet')
+        self.__write_parquet(df, part)
+
+        # Only re-clean the touched sat pairs, unless the new files are older than what we already
+        # have (the de-duplication keeps the first occurence, so everything has to be rebuilt then)
+        last_date = max([v['timestamp'] for v in self.manifest['files'].values()], default='')
+        if isfile(self.__path('cleaned.parquet')) and new_files[0][1] > last_date:
+            cleaned = self.__update_cleaned_data(df)
+        else:
+            cleaned = socrates.clean_socrates_data(self.get_all_data())
+        self.__write_parquet(cleaned, 'cleaned.parquet')
+
+        # Record the files last, so an interrupted refresh is redone
+        rows = df['extract_date'].dt.strftime('%Y%m%d%H%M%S').value_counts()
+        for file,date in new_files:
+            self.manifest['files'][file] = {'timestamp': date,
+                                            'extract_date': datetime.strptime(date, '%Y%m%d%H%M%S').isoformat(),
+                                            'rows': int(rows.get(date, 0)),
+                                            'part': part}
+        self.__save_manifest()
+
+        return [file for file,date in new_files]
+
+    def get_all_data(self):
+        '''
+        Returns all raw socrates rows in the store (same as socrates.get_all_socrates_data with dedup)
+        '''
+        parts = sorted(f for f in listdir(self.__path('raw')) if f.endswith('.parquet'))
+        if len(parts) == 0:
+            return pd.DataFrame()
+        df = pd.concat([pd.read_parquet(self.__path(join('raw', f))) for f in parts], ignore_index=True)
+        return socrates.intern_socrates_names(df.sort_values('extract_date', kind='mergesort'))
+
+    def get_cleaned_data(self):
+        '''
+        Returns the cleaned socrates data (same as socrates.get_socrates_cleaned_data)
+        '''
+        if not isfile(self.__path('cleaned.parquet')):
+            return pd.DataFrame()
+        return pd.read_parquet(self.__path('cleaned.parquet'))
+
+    def __update_cleaned_data(self, new_df):
+        '''
+        Re-runs the cleaning for the sat pairs found in new_df only
+        '''
+        cleaned = self.get_cleaned_data()
+        touched = cleaned['sat_pair_id'].isin(new_df['sat_pair_id'].unique())
+        kept = cleaned[~touched]
+
+        # The cleaned rows are the first occurences of the older data, so they go first
+        redo = pd.concat([cleaned[touched].drop(columns=['group']), new_df], ignore_index=True)
+        redo = socrates.clean_socrates_data(socrates.intern_socrates_names(redo))
+
+        # The groups of a sat pair all come from kept or from redo, sort_conjunction_groups numbers them again
+        return socrates.sort_conjunction_groups(socrates.intern_socrates_names(pd.concat([kept, redo], ignore_index=True)))
+
+    def __path(self, name):
+        return join(self.store_path, name)
+
+    def __tmp_path(self, name):
+        return self.__path(f'{name}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp')
+
+    def __write_parquet(self, df, name):
+        tmp_path = self.__tmp_path(name)
+        df.to_parquet(tmp_path, index=False)
+        replace(tmp_path, self.__path(name))
+
+    def __load_manifest(self):
+        if isfile(self.__path('manifest.json')):
+            with open(self.__path('manifest.json')) as f:
+                return json.load(f)
+        return {'files': {}}
+
+    def __save_manifest(self):
+        tmp_path = self.__tmp_path('manifest.json')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        replace(tmp_path, self.__path('manifest.json'))
+
+
+def acquire_lock(lock_file, timeout=0):
+    '''
+    Takes an exclusive lock on lock_file.  The lock is held by the open file, so the OS
+    releases it if the process dies (close the file to release it).
+
+    Parameters:
+    -----------
+    lock_file : str
+        Relative file path of the lock file
+
+    timeout : float
+        Seconds to wait for the lock, 0 to give up at once and None to wait as long as it takes
+
+    Returns
+    -------
+    lock : file
+        Open lock file (keep it open while running), None if another process holds the lock
+    '''
+    lock = open(lock_file, 'a+')
+    start = time.monotonic()
+    while True:
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except OSError:
+            if timeout is not None and time.monotonic() - start >= timeout:
+                lock.close()
+                return None
+            time.sleep(0.5)
+
+    lock.seek(0)
+    lock.truncate()
+    lock.write(f'{os.getpid()} {datetime.utcnow().isoformat()}\n')
+    lock.flush()
+    return lock
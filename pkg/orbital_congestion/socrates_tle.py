@@ -0,0 +1,143 @@
+'''
+socrates_tle
+------------
+Side table of the TLE data grabbed for each SOCRATES conjunction
+(see job/socrates/nm_win/socrates_gp_history_tle_grab_nm.py).
+
+The gzip pickle written by the grab job is converted once into an uncompressed
+feather file next to it, sorted on (sat1_norad, sat2_norad, tca_time).  The
+feather file is memory mapped as an Arrow table and only its key columns are
+read into an index, which is kept until the pickle changes: a lookup takes the
+matched rows from the mapped table, so only those rows are loaded into memory.
+
+pyarrow is only imported when a side table is built or read.
+'''
+
+import threading
+import numpy as np
+import pandas as pd
+from os import replace
+from os.path import getmtime, isfile
+
+TLE_KEYS = ['sat1_norad', 'sat2_norad', 'tca_time']
+
+_tle_tables = {}
+_tle_tables_lock = threading.Lock()
+
+
+def get_side_table_path(tle_data_path):
+    '''
+    Returns the path of the side table for a TLE pickle file
+
+    Parameters:
+    -----------
+    tle_data_path : str
+        Relative file path of TLE data (pickle)
+
+    Returns
+    -------
+    side_table_path : str
+        Relative file path of the feather side table
+    '''
+    for ext in ['.pkl.gz', '.pkl']:
+        if tle_data_path.endswith(ext):
+            return tle_data_path[:-len(ext)] + '.feather'
+    return tle_data_path + '.feather'
+
+def build_tle_side_table(tle_data_path):
+    '''
+    Converts the TLE pickle into the feather side table
+
+    Parameters:
+    -----------
+    tle_data_path : str
+        Relative file path of TLE data (pickle)
+
+    Returns
+    -------
+    side_table_path : str
+        Relative file path of the feather side table
+    '''
+    import pyarrow.feather as feather
+
+    side_table_path = get_side_table_path(tle_data_path)
+
+    tle_df = pd.read_pickle(tle_data_path)
+    tle_df = tle_df.drop(columns=['sat_pair']).drop_duplicates(subset=TLE_KEYS, keep='last')
+    tle_df = tle_df.sort_values(TLE_KEYS).reset_index(drop=True)
+
+    # Uncompressed so it can be memory mapped
+    feather.write_feather(tle_df, side_table_path + '.tmp', compression='uncompressed')
+    replace(side_table_path + '.tmp', side_table_path)
+
+    return side_table_path
+
+def load_tle_table(tle_data_path):
+    '''
+    Returns the memory mapped TLE side table and an index of its (sat1_norad, sat2_norad, tca_time)
+    keys.  The side table is (re)built when it is older than the pickle, and the result is cached in
+    this process until the pickle's modification time changes.
+
+    Parameters:
+    -----------
+    tle_data_path : str
+        Relative file path of TLE data (pickle)
+
+    Returns
+    -------
+    table : pyarrow Table
+        TLE data without the keys (memory mapped, rows in the order of keys)
+
+    keys : Pandas MultiIndex
+        TLE_KEYS of each row of table
+    '''
+    import pyarrow.feather as feather
+
+    mtime = getmtime(tle_data_path)
+    with _tle_tables_lock:
+        cached = _tle_tables.get(tle_data_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        side_table_path = get_side_table_path(tle_data_path)
+        if not isfile(side_table_path) or getmtime(side_table_path) < mtime:
+            build_tle_side_table(tle_data_path)
+
+        table = feather.read_table(side_table_path, memory_map=True)
+        key_df = table.drop([c for c in table.column_names if c not in TLE_KEYS]).to_pandas()
+        keys = pd.MultiIndex.from_frame(key_df[TLE_KEYS])
+        cached = (table.drop(TLE_KEYS), keys)
+        _tle_tables[tle_data_path] = (mtime, cached)
+
+    return cached
+
+def lookup_tle_data(df, tle_data_path):
+    '''
+    Looks up the TLE data of each socrates row (a left join on TLE_KEYS)
+
+    Parameters:
+    -----------
+    df : Pandas Dataframe
+        The socrates dataframe
+
+    tle_data_path : str
+        Relative file path of TLE data (pickle)
+
+    Returns
+    -------
+    tle_df : Pandas Dataframe
+        TLE columns for each row of df (same index as df, NaN when not found)
+    '''
+    import pyarrow as pa
+
+    table, keys = load_tle_table(tle_data_path)
+    rows = keys.get_indexer(pd.MultiIndex.from_arrays([df[k] for k in TLE_KEYS]))
+    found = np.flatnonzero(rows >= 0)
+
+    # Only the matched rows are read from the mapped table, the others are filled with NaN
+    tle_rows = table.take(pa.array(rows[found])).to_pandas()
+    tle_rows.index = found
+    tle_rows = tle_rows.reindex(np.arange(len(df)))
+    tle_rows.index = df.index
+
+    return tle_rows
@@ -0,0 +1,219 @@
+'''
+spacetrack_fetch
+----------------
+Runs the gp_history requests of the GP-history grab job concurrently, within a
+requests per minute and a requests per hour budget (Space-Track allows 30 per
+minute and 300 per hour).
+
+Completed requests are recorded in a checkpoint file so an interrupted grab
+skips them when it is restarted.  Failed requests are retried with an
+exponential backoff.
+
+The client only needs a gp_history(norad_cat_id=..., epoch=...) method, so a
+local stub can stand in for SpaceTrackClient (see benchmarks/bench_spacetrack_fetch.py).
+'''
+
+import hashlib
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from os.path import isfile
+
+import spacetrack.operators as op
+
+
+def build_fetch_requests(miss_tle_df, margin=timedelta(minutes=5)):
+    '''
+    Builds one gp_history request per bin of missing TLEs
+
+    Parameters:
+    -----------
+    miss_tle_df : Pandas Dataframe
+        Missing TLEs with norad, last_epoch and bin
+
+    margin : timedelta
+        Added before the first and after the last epoch of each bin
+
+    Returns
+    -------
+    requests : list(dict)
+        key, bin, norads, min_epoch and max_epoch of each request.  The key only depends on
+        the norads and epochs so it stays the same when the job is restarted.
+    '''
+    requests = []
+    for b, tmp_df in miss_tle_df.groupby('bin', observed=True):
+        norads = sorted(int(n) for n in tmp_df['norad'].unique())
+        min_epoch = tmp_df['last_epoch'].min().to_pydatetime() - margin
+        max_epoch = tmp_df['last_epoch'].max().to_pydatetime() + margin
+        digest = hashlib.sha1(','.join(str(n) for n in norads).encode()).hexdigest()[:12]
+        key = min_epoch.strftime('%Y%m%d%H%M%S') + '-' + max_epoch.strftime('%Y%m%d%H%M%S') + '-' + digest
+        requests.append({'key': key, 'bin': b, 'norads': norads, 'min_epoch': min_epoch, 'max_epoch': max_epoch})
+    return requests
+
+
+class RateLimiter():
+    '''
+    Spaces out calls so no more than requests_per_minute are started per minute, and no more
+    than requests_per_hour in any sliding hour (thread safe, shared by all the workers)
+    '''
+
+    interval = None
+    next_time = 0
+    requests_per_hour = None
+    hour_starts = None
+    lock = None
+
+    def __init__(self, requests_per_minute, requests_per_hour=None):
+        '''
+        Initialize
+
+        Parameters:
+        -----------
+        requests_per_minute : float
+            Calls per minute (evenly spaced)
+
+        requests_per_hour : int
+            Calls in any hour, None for no hourly limit
+        '''
+        self.interval = 60 / requests_per_minute
+        self.next_time = 0
+        self.requests_per_hour = requests_per_hour
+        self.hour_starts = deque(maxlen=requests_per_hour) if requests_per_hour is not None else None
+        self.lock = threading.Lock()
+
+    def wait(self):
+        '''
+        Blocks until the next call is allowed
+        '''
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            # The oldest of the last requests_per_hour calls has to be an hour old
+            if self.hour_starts is not None and len(self.hour_starts) == self.requests_per_hour:
+                start = max(start, self.hour_starts[0] + 3600)
+            if self.hour_starts is not None:
+                self.hour_starts.append(start)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class GpHistoryFetcher():
+    '''
+    Concurrent, rate limited and resumable gp_history requests
+    '''
+
+    client = None
+    limiter = None
+    max_workers = None
+    checkpoint_path = None
+    max_retries = None
+    backoff = None
+
+    def __init__(self, client, requests_per_minute=20, requests_per_hour=300, max_workers=4, checkpoint_path=None,
+                 max_retries=3, backoff=30):
+        '''
+        Initialize
+
+        Parameters:
+        -----------
+        client : SpaceTrackClient
+            Authenticated client (or anything with a gp_history method)
+
+        requests_per_minute : float
+            Request budget per minute shared by all workers.  Capped at 5 when requests_per_hour is
+            None, so the Space-Track hourly limit (300) still holds
+
+        requests_per_hour : int
+            Request budget in any hour shared by all workers (Space-Track allows 300)
+
+        max_workers : int
+            Number of requests in flight at the same time
+
+        checkpoint_path : str
+            Relative file path of the checkpoint (one completed request key per line).
+            None disables checkpoints
+
+        max_retries : int
+            Number of retries of a failed request
+
+        backoff : float
+            Seconds to wait before the first retry, doubled on every retry
+        '''
+        self.client = client
+        if requests_per_hour is None:
+            requests_per_minute = min(requests_per_minute, 5)
+        self.limiter = RateLimiter(requests_per_minute, requests_per_hour)
+        self.max_workers = max_workers
+        self.checkpoint_path = checkpoint_path
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def get_completed(self):
+        '''
+        Returns the set of request keys in the checkpoint
+        '''
+        if self.checkpoint_path is None or not isfile(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as f:
+            return set(line.strip() for line in f if line.strip())
+
+    def fetch(self, requests, on_result):
+        '''
+        Runs the requests that are not in the checkpoint yet
+
+        Parameters:
+        -----------
+        requests : list(dict)
+            Requests from build_fetch_requests
+
+        on_result : function
+            Called as on_result(request, records) for each completed request, from the calling
+            thread.  The request is added to the checkpoint once it returns.
+
+        Returns
+        -------
+        failed : list(dict)
+            Requests that still failed after all retries (with an 'error' entry)
+        '''
+        completed = self.get_completed()
+        pending = [r for r in requests if r['key'] not in completed]
+        print(f'{len(requests) - len(pending)} of {len(requests)} requests already completed (checkpoint)')
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.__fetch_one, r): r for r in pending}
+            for future in as_completed(futures):
+                request = futures[future]
+                try:
+                    records = future.result()
+                except Exception as e:
+                    failed.append(dict(request, error=repr(e)))
+                    continue
+                on_result(request, records)
+                self.__add_checkpoint(request['key'])
+
+        return failed
+
+    def __fetch_one(self, request):
+        '''
+        Runs a single request with retries
+        '''
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            try:
+                return self.client.gp_history(norad_cat_id=request['norads'],
+                                              epoch=op.inclusive_range(request['min_epoch'], request['max_epoch']))
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff * 2**attempt * random.uniform(0.8, 1.2))
+
+    def __add_checkpoint(self, key):
+        if self.checkpoint_path is None:
+            return
+        with open(self.checkpoint_path, 'a') as f:
+            f.write(key + '\n')